@@ -7,6 +7,10 @@ import json
 import glob
 import gc
 import sys
+import threading
+import collections
+import itertools
+import heapq
 
 # Initialize Pygame
 pygame.init()
@@ -293,6 +297,64 @@ class Player(Character):
         self.shielded = False
         self.shield_blocked_attack = False
 
+# Layouts of the float32 observation vectors returned by get_observation.
+# Positions are scaled by the screen size, velocities by the jump speed and
+# timers by their maximum, so every entry is roughly within [-1, 1]
+PLAYER_ACTIONS = ("idle", "run", "jump", "death", "attack", "fall", "hurt")
+PLAYER_OBSERVATION_FIELDS = ("player_health", "player_vel_y", "player_knockback", "player_attacking",
+                             "player_shielded") + tuple(f"player_{action}" for action in PLAYER_ACTIONS)
+KNIGHT_OBSERVATION_FIELDS = ("dx", "dy", "x", "y", "direction", "vel_y", "knockback", "health", "attack_cooldown",
+                             "shield_cooldown", "block_duration", "attacking", "blocking") + PLAYER_OBSERVATION_FIELDS
+ENEMY_OBSERVATION_FIELDS = ("dx", "dy", "x", "y", "direction", "vel_y", "knockback", "health", "attack_cooldown",
+                            "attacking", "arrows") + PLAYER_OBSERVATION_FIELDS
+BIRD_OBSERVATION_FIELDS = (("dx", "dy", "x", "y", "shield_cooldown", "shield_active", "shield_loading",
+                            "knight_dx", "knight_present", "enemy_dx", "enemy_present")
+                           + tuple(f"knight_{action}" for action in ("idle", "attack", "walk", "death", "block"))
+                           + tuple(f"enemy_{action}" for action in ("idle", "run", "death", "attack"))
+                           + PLAYER_OBSERVATION_FIELDS)
+OBSERVATION_FIELDS = {
+    "knight": KNIGHT_OBSERVATION_FIELDS,
+    "enemy": ENEMY_OBSERVATION_FIELDS,
+    "bird": BIRD_OBSERVATION_FIELDS,
+}
+
+
+def _one_hot(out, start, size, index):
+    out[start:start + size] = 0
+    out[start + index] = 1
+
+
+def _observe_player(player, out, start):
+    # Field by field: assigning a tuple to a slice would build a temporary array every step
+    out[start] = player.health / player.max_health
+    out[start + 1] = player.vel_y / -JUMP_STRENGTH
+    out[start + 2] = player.knockback_speed / 10
+    out[start + 3] = player.attacking
+    out[start + 4] = player.shielded
+    _one_hot(out, start + 5, len(PLAYER_ACTIONS), player.action)
+
+
+def observe(agent, player):
+    # The agent's observation written into its own reused buffer
+    if agent.observation is None:
+        agent.observation = agent.get_observation(player)
+        return agent.observation
+    return agent.get_observation(player, agent.observation)
+
+
+def observe_batch(agents, players, out, knights=None, enemies=None):
+    # One row per arena written in place, so a batched step allocates no arrays.
+    # knights and enemies are per-arena sequences for Bird agents, with None where an arena has none
+    if knights is None and enemies is None:
+        for i, agent in enumerate(agents):
+            agent.get_observation(players[i], out[i])
+        return out
+    for i, agent in enumerate(agents):
+        agent.get_observation(players[i], out[i], knights[i] if knights is not None else None,
+                              enemies[i] if enemies is not None else None)
+    return out
+
+
 class Arrow(pygame.sprite.Sprite):
     def __init__(self, x, y, direction):
         super().__init__()
@@ -376,7 +438,7 @@ class Enemy(Character):
                     temp_list.append(img)
                 cls.animation_lists.append(temp_list)
 
-    def __init__(self, x, y):
+    def __init__(self, x, y, sarsa=None):
         super().__init__(x, y)
         if Enemy.animation_lists is None:
             Enemy.load_animations()
@@ -395,6 +457,7 @@ class Enemy(Character):
         self.flash_timer = 0
         self.attack_cooldown = 0
         self.arrow_group = pygame.sprite.Group()
+        self.landed_arrows = pygame.sprite.Group()  # Stopped arrows, drawn but no longer updated
         self.attacking = False
         self.attack_frame = 0
         self.invulnerable_timer = 0
@@ -407,7 +470,9 @@ class Enemy(Character):
         self.rect.x = max(0, min(x, SCREEN_WIDTH - self.rect.width))
         self.rect.bottom = y + self.vertical_offset
 
-        self.sarsa = SARSA(character_type="enemy")
+        self.sarsa = sarsa if sarsa is not None else SARSA(character_type="enemy")
+        self.repeat = ActionRepeat()
+        self.observation = None  # Reused get_observation buffer for learners that observe
         self.previous_state = None
         self.previous_action = None
         self.episode_steps = 0
@@ -463,6 +528,38 @@ class Enemy(Character):
 
         return f"{x_state}_{x_direction}_{y_state}_{enemy_health}_{player_health}_{facing_player}_{attack_ready}_{wall_state}"
 
+    def get_observation(self, player, out=None):
+        # The unbucketed quantities behind get_state, laid out as ENEMY_OBSERVATION_FIELDS
+        if out is None:
+            import numpy as np
+            out = np.empty(len(ENEMY_OBSERVATION_FIELDS), dtype=np.float32)
+        # Written field by field, see _observe_player
+        out[0] = (player.rect.x - self.rect.x) / SCREEN_WIDTH
+        out[1] = (player.rect.y - self.rect.y) / SCREEN_HEIGHT
+        out[2] = self.rect.x / SCREEN_WIDTH
+        out[3] = self.rect.y / SCREEN_HEIGHT
+        out[4] = self.direction
+        out[5] = self.vel_y / -JUMP_STRENGTH
+        out[6] = self.knockback_velocity / 10
+        out[7] = self.health / self.max_health
+        out[8] = self.attack_cooldown / 90
+        out[9] = self.attacking
+        out[10] = len(self.arrow_group) / 3
+        _observe_player(player, out, 11)
+        return out
+
+    def action_mask(self):
+        # Read from the same field as attack_ready in get_state
+        return ('shoot',) if self.attack_cooldown else ()
+
+    def decision_events(self, player):
+        # Cheap stand-ins for the get_state fields: the player's distance in 40 pixel
+        # cells (the distance buckets are multiples of 40), the level band and the raw
+        # flags. Facing is left out, it flips every frame while the two overlap
+        dy = player.rect.y - self.rect.y
+        return (abs(player.rect.x - self.rect.x) // 40, (dy > 50) - (dy < -50), self.health, player.health,
+                self.attack_cooldown == 0)
+
     def update_animation(self):
         ANIMATION_COOLDOWN = 100
         max_frames = len(self.animation_list[self.action])
@@ -512,8 +609,12 @@ class Enemy(Character):
             self.flash_timer -= 1
 
         if self.alive:
-            current_state = self.get_state(player)
-            action = self.sarsa.get_action(current_state)
+            if self.repeat.action is not None:
+                # Driven by a trainer: keep the action committed to at the last decision
+                current_state, action = self.repeat.state, self.repeat.action
+            else:
+                current_state = observe(self, player) if self.sarsa.observes else self.get_state(player)
+                action = self.sarsa.get_action(current_state, self.action_mask())
 
             # Only act if not being knocked back significantly
             if abs(self.knockback_velocity) < 1:
@@ -547,6 +648,11 @@ class Enemy(Character):
                 self.shoot_arrow()
 
         self.arrow_group.update()
+        for arrow in self.arrow_group.sprites():
+            if arrow.stopped:
+                # A landed arrow never moves again, so stop updating and hit-testing it
+                self.arrow_group.remove(arrow)
+                self.landed_arrows.add(arrow)
 
     def act(self, action, tile_map):
         if self.alive and self.knockback_velocity == 0:  # Only act if not being knocked back
@@ -603,6 +709,7 @@ class Enemy(Character):
                 self.update_action(2)
 
     def draw_arrows(self, surface):
+        self.landed_arrows.draw(surface)
         self.arrow_group.draw(surface)
 
     def check_arrow_hit(self, player):
@@ -628,6 +735,7 @@ class Enemy(Character):
         self.action = 0
         self.frame_index = 0
         self.arrow_group.empty()
+        self.landed_arrows.empty()
         self.attacking = False
         self.attack_frame = 0
         self.flash_timer = 0
@@ -640,6 +748,7 @@ class Enemy(Character):
         self.just_attacked = False
         self.death_penalty_applied = False
         self.knockback_velocity = 0
+        self.repeat.reset()
 
     def end_episode(self):
         self.sarsa.end_episode()
@@ -741,8 +850,26 @@ class AIPlayer(Player):
         
         
         
+Q_TABLE_FOLDERS = {
+    "knight": 'knight_q_tables',
+    "enemy": 'q_tables',
+    "bird": 'bird_q_tables',
+    "rogue": 'rogue_q_tables',
+}
+
+
+SARSA_TARGETS = ("sarsa", "expected", "q_learning")
+
+
 class SARSA:
-    def __init__(self, character_type):
+    checkpoint_suffix = ".json"
+    unsupported_params = ()
+    # Learners that act on get_observation vectors rather than get_state strings
+    observes = False
+
+    def __init__(self, character_type, q_table_folder=None, max_states=None, eviction="lru", track_visits=False,
+                 trace_decay=0.0, trace_mode="replacing", max_traces=64, planning_steps=0, model_size=100000,
+                 planning="uniform", priority_threshold=1e-3, target="sarsa", load=True):
         self.character_type = character_type
         self.epsilon = 0.0
         self.epsilon_decay = 0.999997
@@ -752,76 +879,1122 @@ class SARSA:
         self.alpha_min = 0.01
         self.gamma = 0.9
 
+        # What the update bootstraps from: "sarsa" the sampled next action,
+        # "expected" its expectation under the epsilon-greedy policy and
+        # "q_learning" the greedy value
+        if target not in SARSA_TARGETS:
+            raise ValueError(f"Unknown update target: {target}")
+        self.target = target
+
         if character_type == "knight":
             self.actions = ['move_left', 'move_right', 'attack', 'block', 'maintain_block', 'idle']
-            self.q_table_folder = 'knight_q_tables'
+            self.q_table_folder = Q_TABLE_FOLDERS["knight"]
         elif character_type == "enemy":
             self.actions = ['move_left', 'move_right', 'shoot', 'idle']
-            self.q_table_folder = 'q_tables'
+            self.q_table_folder = Q_TABLE_FOLDERS["enemy"]
         elif character_type == "bird":
             self.actions = ['move_up', 'move_down', 'move_left', 'move_right', 'move_up_left', 'move_up_right', 'move_down_left', 'move_down_right', 'activate_shield', 'idle']
-            self.q_table_folder = 'bird_q_tables'
+            self.q_table_folder = Q_TABLE_FOLDERS["bird"]
         elif character_type == "rogue":
             self.actions = ['move_left', 'move_right', 'far_attack', 'close_attack', 'idle']
-            self.q_table_folder = 'rogue_q_tables'
+            self.q_table_folder = Q_TABLE_FOLDERS["rogue"]
         else:
             raise ValueError(f"Unknown character type: {character_type}")
+        if q_table_folder is not None:
+            self.q_table_folder = q_table_folder
 
-        self.q_table = self.load_q_table()
+        # load=False starts empty, for callers that install a table of their own
+        self.q_table = self.load_q_table() if load else {}
         self.episode_count = self.get_latest_episode_count()
+        # Call counters for throughput benchmarks
+        self.action_count = 0
+        self.update_count = 0
+
+        # Optional cap on Q-table rows; "lru" drops the least recently used
+        # states, "least_visited" the states chosen from least often
+        if eviction not in ("lru", "least_visited"):
+            raise ValueError(f"Unknown eviction policy: {eviction}")
+        self.max_states = max_states
+        self.eviction = eviction
+        self.track_visits = track_visits or eviction == "least_visited"
+        self.visit_counts = {}
+        self.evicted_states = 0
+
+        # Action masks: the tuple of unavailable actions an agent reports
+        # alongside a state, remembered per state so bootstrapped targets skip
+        # them too, and the allowed actions for each distinct mask
+        self.state_masks = {}
+        self.mask_actions = {}
+        self.mask_rows = {}
+
+        # SARSA(lambda): trace_decay is lambda, 0 keeps the one-step update.
+        # Traces are a short list of [state, action, trace], newest last
+        if trace_mode not in ("replacing", "accumulating"):
+            raise ValueError(f"Unknown trace mode: {trace_mode}")
+        self.trace_decay = trace_decay
+        self.trace_mode = trace_mode
+        self.max_traces = max_traces
+        self.trace_threshold = 0.01
+        self.traces = []
+
+        # Dyna: replay planning_steps remembered transitions after every real
+        # update. model maps (state, action) to [reward, next_state, steps]
+        # and model_keys lists its keys so a random one is picked in O(1)
+        self.planning_steps = planning_steps
+        self.model_size = model_size
+        self.model = {}
+        self.model_keys = []
+        self.planning_count = 0
+
+        # Prioritized sweeping spends the same budget on the largest model TD
+        # errors first: a max-heap of (-priority, tiebreak, key), the best
+        # queued priority per key for skipping stale entries, and for every
+        # state the (state, action) pairs the model says lead into it
+        if planning not in ("uniform", "prioritized"):
+            raise ValueError(f"Unknown planning mode: {planning}")
+        self.planning = planning
+        self.priority_threshold = priority_threshold
+        self.priority_queue = []
+        self.queued = {}
+        self.predecessors = {}
+        self.queue_counter = itertools.count()
 
     def get_latest_episode_count(self):
-        q_table_files = glob.glob(f'{self.q_table_folder}/*.json')
+        q_table_files = glob.glob(f'{self.q_table_folder}/*{self.checkpoint_suffix}')
         if not q_table_files:
             return 0
         latest_file = max(q_table_files, key=os.path.getctime)
         return int(latest_file.split('_')[-1].split('.')[0]) + 1
 
     def load_q_table(self):
-        q_table_files = glob.glob(f'{self.q_table_folder}/*.json')
+        q_table_files = glob.glob(f'{self.q_table_folder}/*{self.checkpoint_suffix}')
         if not q_table_files:
             return {}
         latest_file = max(q_table_files, key=os.path.getctime)
         with open(latest_file, 'r') as f:
             return json.load(f)
 
+    def to_dict(self):
+        return self.q_table
+
     def save_q_table(self):
         if not os.path.exists(self.q_table_folder):
             os.makedirs(self.q_table_folder)
-        filename = f'{self.q_table_folder}/q_table_episode_{self.episode_count}.json'
-        with open(filename, 'w') as f:
-            json.dump(self.q_table, f, indent=2)
+        filename = f'{self.q_table_folder}/q_table_episode_{self.episode_count}{self.checkpoint_suffix}'
+        # Write then rename so a concurrent reader never sees a half-written table
+        with open(filename + '.tmp', 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(filename + '.tmp', filename)
+        if self.visit_counts:
+            # Sidecar outside the *.json glob, so it is never taken for a checkpoint
+            with open(filename + '.visits.tmp', 'w') as f:
+                json.dump(self.visit_counts, f)
+            os.replace(filename + '.visits.tmp', filename + '.visits')
         print(f"Q-table saved as {filename}")
 
-    def get_action(self, state):
+    def load_visit_counts(self):
+        # Visit counts saved next to the latest checkpoint, empty when it was trained without track_visits
+        q_table_files = glob.glob(f'{self.q_table_folder}/*{self.checkpoint_suffix}')
+        if not q_table_files:
+            return {}
+        path = max(q_table_files, key=os.path.getctime) + '.visits'
+        if not os.path.exists(path):
+            return {}
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def _add_state(self, state, keep=()):
+        # keep names states the caller is about to write, they are never evicted
+        if self.max_states is not None and len(self.q_table) >= self.max_states:
+            self._evict(keep)
+        row = self.q_table[state] = {a: 0 for a in self.actions}
+        return row
+
+    def _evict(self, keep=()):
+        # Evict in batches of 1% so the cost is amortized over many insertions
+        count = len(self.q_table) - self.max_states + max(1, self.max_states // 100)
+        candidates = (s for s in self.q_table if s not in keep)
+        if self.eviction == "lru":
+            victims = list(itertools.islice(candidates, count))
+        else:
+            # The newest rows have the fewest visits, so without keep the row
+            # being updated would be the first to go
+            victims = heapq.nsmallest(count, candidates, key=lambda s: self.visit_counts.get(s, 0))
+        for state in victims:
+            del self.q_table[state]
+            self.visit_counts.pop(state, None)
+            self.state_masks.pop(state, None)
+        self.evicted_states += len(victims)
+
+    def _touch(self, state):
+        if self.track_visits:
+            self.visit_counts[state] = self.visit_counts.get(state, 0) + 1
+        if self.max_states is not None and self.eviction == "lru":
+            self.q_table[state] = self.q_table.pop(state)
+
+    def _allowed(self, mask):
+        actions = self.mask_actions.get(mask)
+        if actions is None:
+            actions = self.mask_actions[mask] = [a for a in self.actions if a not in mask]
+        return actions
+
+    def _available(self, mask):
+        # The mask as a boolean row over self.actions, for the array learners
+        row = self.mask_rows.get(mask)
+        if row is None:
+            import numpy as np
+
+            row = self.mask_rows[mask] = np.array([a not in mask for a in self.actions])
+        return row
+
+    def _values(self, state, row):
+        # The Q-values of the actions available in state
+        mask = self.state_masks.get(state)
+        if mask is None:
+            return list(row.values())
+        return [row[a] for a in self._allowed(mask)]
+
+    def get_action(self, state, mask=()):
+        self.action_count += 1
         if state not in self.q_table:
-            self.q_table[state] = {a: 0 for a in self.actions}
+            self._add_state(state)
+        if self.max_states is not None or self.track_visits:
+            self._touch(state)
+        if mask:
+            self.state_masks[state] = mask
+            actions = self._allowed(mask)
+            if random.random() < self.epsilon:
+                return random.choice(actions)
+            return max(actions, key=self.q_table[state].get)
         
         if random.random() < self.epsilon:
             return random.choice(self.actions)
         else:
             return max(self.q_table[state], key=self.q_table[state].get)
 
-    def update_q_table(self, state, action, reward, next_state, next_action):
-        if state not in self.q_table:
-            self.q_table[state] = {a: 0 for a in self.actions}
-        if next_state not in self.q_table:
-            self.q_table[next_state] = {a: 0 for a in self.actions}
-
-        current_q = self.q_table[state][action]
-        next_q = self.q_table[next_state][next_action]
-        new_q = current_q + self.alpha * (reward + self.gamma * next_q - current_q)
-        self.q_table[state][action] = new_q
-
-    def get_best_action(self, state):
+    def update_q_table(self, state, action, reward, next_state, next_action, steps=1):
+        # steps > 1 bootstraps a discounted return summed over an action repeat
+        self.update_count += 1
+        # Under a cap, inserting either state must not evict the other
+        row = self.q_table.get(state)
+        if row is None:
+            row = self._add_state(state, (next_state,))
+        next_row = self.q_table.get(next_state)
+        if next_row is None:
+            next_row = self._add_state(next_state, (state,))
+
+        current_q = row[action]
+        if self.target == "sarsa":
+            next_q = next_row[next_action]
+        elif self.target == "q_learning":
+            next_q = max(self._values(next_state, next_row))
+        else:
+            values = self._values(next_state, next_row)
+            next_q = self.epsilon * sum(values) / len(values) + (1 - self.epsilon) * max(values)
+        gamma = self.gamma if steps == 1 else self.gamma ** steps
+        if self.trace_decay:
+            self._update_traces(state, action, reward + gamma * next_q - current_q, gamma * self.trace_decay)
+        else:
+            new_q = current_q + self.alpha * (reward + gamma * next_q - current_q)
+            row[action] = new_q
+
+        if self.planning_steps:
+            self._remember(state, action, reward, next_state, steps)
+            if self.planning == "prioritized":
+                self._queue((state, action))
+                self._sweep(self.planning_steps)
+            else:
+                self._plan(self.planning_steps)
+
+    def _remember(self, state, action, reward, next_state, steps):
+        key = (state, action)
+        transition = self.model.get(key)
+        if transition is not None:
+            if transition[1] != next_state:
+                self._unlink(key, transition[1])
+                self.predecessors.setdefault(next_state, set()).add(key)
+            transition[0] = reward
+            transition[1] = next_state
+            transition[2] = steps
+            return
+        if len(self.model_keys) >= self.model_size:
+            # Full: overwrite a random slot so memory stays bounded
+            i = random.randrange(len(self.model_keys))
+            old_key = self.model_keys[i]
+            self._unlink(old_key, self.model.pop(old_key)[1])
+            self.queued.pop(old_key, None)
+            self.model_keys[i] = key
+        else:
+            self.model_keys.append(key)
+        self.model[key] = [reward, next_state, steps]
+        self.predecessors.setdefault(next_state, set()).add(key)
+
+    def _unlink(self, key, next_state):
+        predecessors = self.predecessors.get(next_state)
+        if predecessors is not None:
+            predecessors.discard(key)
+            if not predecessors:
+                del self.predecessors[next_state]
+
+    def _plan(self, n):
+        model, keys, q_table = self.model, self.model_keys, self.q_table
+        for _ in range(n):
+            key = keys[random.randrange(len(keys))]
+            reward, next_state, steps = model[key]
+            row = q_table.get(key[0])
+            next_row = q_table.get(next_state)
+            if row is None or next_row is None:
+                continue  # Evicted from a capped table
+            # Dyna-SARSA: bootstrap from the current epsilon-greedy policy
+            values = self._values(next_state, next_row)
+            if random.random() < self.epsilon:
+                next_q = random.choice(values)
+            else:
+                next_q = max(values)
+            gamma = self.gamma if steps == 1 else self.gamma ** steps
+            row[key[1]] += self.alpha * (reward + gamma * next_q - row[key[1]])
+            self.planning_count += 1
+
+    def _model_error(self, key):
+        reward, next_state, steps = self.model[key]
+        row = self.q_table.get(key[0])
+        next_row = self.q_table.get(next_state)
+        if row is None or next_row is None:
+            return None  # Evicted from a capped table
+        gamma = self.gamma if steps == 1 else self.gamma ** steps
+        return reward + gamma * max(self._values(next_state, next_row)) - row[key[1]]
+
+    def _queue(self, key):
+        error = self._model_error(key)
+        if error is None:
+            return
+        priority = abs(error)
+        if priority > self.priority_threshold and priority > self.queued.get(key, 0):
+            self.queued[key] = priority
+            heapq.heappush(self.priority_queue, (-priority, next(self.queue_counter), key))
+            if len(self.priority_queue) > 4 * self.model_size:
+                # Drop the stale duplicates left behind by re-queued keys. Rebuilt in
+                # place, _sweep holds the list while its predecessors are queued
+                self.priority_queue[:] = [(-p, next(self.queue_counter), k) for k, p in self.queued.items()]
+                heapq.heapify(self.priority_queue)
+
+    def _sweep(self, budget):
+        queue = self.priority_queue
+        while budget and queue:
+            priority, _, key = heapq.heappop(queue)
+            if self.queued.get(key) != -priority:
+                continue  # Superseded by a higher priority or dropped from the model
+            del self.queued[key]
+            error = self._model_error(key)
+            if error is None:
+                continue
+            self.q_table[key[0]][key[1]] += self.alpha * error
+            self.planning_count += 1
+            budget -= 1
+            # The value of key[0] moved, so everything leading into it may be off now
+            for predecessor in tuple(self.predecessors.get(key[0], ())):
+                self._queue(predecessor)
+
+    def _update_traces(self, state, action, delta, decay):
+        traces = self.traces
+        for i, entry in enumerate(traces):
+            if entry[0] == state and entry[1] == action:
+                del traces[i]
+                trace = 1.0 if self.trace_mode == "replacing" else entry[2] + 1.0
+                break
+        else:
+            trace = 1.0
+        traces.append([state, action, trace])
+        if len(traces) > self.max_traces:
+            del traces[0]
+
+        step = self.alpha * delta
+        kept = []
+        for entry in traces:
+            row = self.q_table.get(entry[0])
+            if row is not None:
+                row[entry[1]] += step * entry[2]
+            entry[2] *= decay
+            # Short traces are dropped, which keeps the list sparse
+            if entry[2] >= self.trace_threshold:
+                kept.append(entry)
+        self.traces = kept
+
+    def get_best_action(self, state, mask=()):
+        self.action_count += 1
         if state not in self.q_table:
-            self.q_table[state] = {a: 0 for a in self.actions}
+            self._add_state(state)
+        if self.max_states is not None or self.track_visits:
+            self._touch(state)
+        if mask:
+            self.state_masks[state] = mask
+            return max(self._allowed(mask), key=self.q_table[state].get)
         return max(self.q_table[state], key=self.q_table[state].get)
     
     def end_episode(self):
         self.episode_count += 1
         self.epsilon = max(self.epsilon * self.epsilon_decay, self.epsilon_min)
+        self.traces = []
         #self.alpha = max(self.alpha * self.alpha_decay, self.alpha_min)
+
+
+class ReplayBuffer:
+    """
+    Preallocated ring buffer of transitions stored as numeric columns:
+    state and action indices, reward, next state and action indices, and the
+    discount to apply to the next value (gamma, or gamma**k after a repeat).
+    """
+    def __init__(self, capacity=100000):
+        import numpy as np
+
+        self.capacity = capacity
+        self.states = np.zeros(capacity, dtype=np.int64)
+        self.actions = np.zeros(capacity, dtype=np.int64)
+        self.rewards = np.zeros(capacity, dtype=np.float64)
+        self.next_states = np.zeros(capacity, dtype=np.int64)
+        self.next_actions = np.zeros(capacity, dtype=np.int64)
+        self.discounts = np.zeros(capacity, dtype=np.float64)
+        self.position = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, state, action, reward, next_state, next_action, discount):
+        i = self.position
+        self.states[i] = state
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.next_states[i] = next_state
+        self.next_actions[i] = next_action
+        self.discounts[i] = discount
+        self.position = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def sample(self, batch_size, rng):
+        i = rng.integers(0, self.size, batch_size)
+        return self.states[i], self.actions[i], self.rewards[i], self.next_states[i], self.next_actions[i], self.discounts[i]
+
+
+class ArrayQTable:
+    """Read-only {state: {action: value}} view of an ArraySARSA's Q-values."""
+    def __init__(self, sarsa):
+        self.sarsa = sarsa
+
+    def __len__(self):
+        return len(self.sarsa.states)
+
+    def __contains__(self, state):
+        return state in self.sarsa.state_index
+
+    def __iter__(self):
+        return iter(self.sarsa.states)
+
+    def __getitem__(self, state):
+        return dict(zip(self.sarsa.actions, self.sarsa.q_values[self.sarsa.state_index[state]].tolist()))
+
+    def get(self, state, default=None):
+        return self[state] if state in self.sarsa.state_index else default
+
+    def keys(self):
+        return list(self.sarsa.states)
+
+    def values(self):
+        return [self[state] for state in self.sarsa.states]
+
+    def items(self):
+        return [(state, self[state]) for state in self.sarsa.states]
+
+
+class ArraySARSA(SARSA):
+    """
+    SARSA with the Q-table held in a NumPy array, one row per state, so
+    updates can be applied in vectorized minibatches. q_table reads as the
+    usual {state: {action: value}} view and accepts such a dict on
+    assignment, so saving and loading stay JSON.
+
+    With replay_capacity > 0, update_q_table only stores the transition in a
+    ReplayBuffer and every replay_every transitions a minibatch of batch_size
+    is learnt with one scatter-add. Nothing is locked, so drive replay() from
+    the training thread only. Capping, visit counts, traces and planning are
+    SARSA-only and configure_sarsa rejects them.
+    """
+    # SARSA features this learner ignores, refused by configure_sarsa
+    unsupported_params = ("max_states", "eviction", "track_visits", "trace_decay", "trace_mode", "max_traces",
+                          "planning_steps", "planning", "model_size", "priority_threshold")
+
+    def __init__(self, character_type, q_table_folder=None, replay_capacity=0, batch_size=256, replay_every=64,
+                 target="sarsa"):
+        import numpy as np
+
+        self.np = np  # Bound once for the per-frame methods
+        self.replay_capacity = replay_capacity
+        self.batch_size = batch_size
+        self.replay_every = replay_every
+        self.replay_buffer = None
+        # Seeded from random so a seeded trainer replays the same minibatches
+        self.rng = np.random.default_rng(random.getrandbits(64))
+        super().__init__(character_type, q_table_folder, target=target)
+
+    @property
+    def q_table(self):
+        return ArrayQTable(self)
+
+    @q_table.setter
+    def q_table(self, table):
+        import numpy as np
+
+        self.action_index = {action: i for i, action in enumerate(self.actions)}
+        self.state_index = {}
+        self.states = []
+        self.q_values = np.zeros((max(1024, len(table)), len(self.actions)))
+        self.available = np.ones(self.q_values.shape, dtype=bool)
+        for state, row in table.items():
+            self.q_values[self._index(state)] = [row.get(action, 0) for action in self.actions]
+
+    def to_dict(self):
+        return {state: dict(zip(self.actions, values)) for state, values in zip(self.states, self.q_values.tolist())}
+
+    def _index(self, state):
+        i = self.state_index.get(state)
+        if i is None:
+            i = len(self.states)
+            if i == len(self.q_values):
+                import numpy as np
+
+                grown = np.zeros((2 * i, len(self.actions)))
+                grown[:i] = self.q_values
+                self.q_values = grown
+                available = np.ones(grown.shape, dtype=bool)
+                available[:i] = self.available
+                self.available = available
+            self.state_index[state] = i
+            self.states.append(state)
+        return i
+
+    def _next_values(self, next_q, next_actions, available):
+        # next_q is one row or a batch of rows, the reduction runs along the actions
+        np = self.np
+        if self.target == "sarsa":
+            return next_q[next_actions] if next_q.ndim == 1 else next_q[range(len(next_q)), next_actions]
+        greedy = np.where(available, next_q, -np.inf).max(axis=-1)
+        if self.target == "q_learning":
+            return greedy
+        mean = (next_q * available).sum(axis=-1) / available.sum(axis=-1)
+        return self.epsilon * mean + (1 - self.epsilon) * greedy
+
+    def _mask(self, i, mask):
+        # Record the mask on the state's row and return the masked Q-values
+        row = self._available(mask)
+        self.available[i] = row
+        return self.np.where(row, self.q_values[i], -self.np.inf)
+
+    def get_action(self, state, mask=()):
+        self.action_count += 1
+        i = self._index(state)
+        if mask:
+            q = self._mask(i, mask)
+            if random.random() < self.epsilon:
+                return random.choice(self._allowed(mask))
+            return self.actions[int(q.argmax())]
+        if random.random() < self.epsilon:
+            return random.choice(self.actions)
+        return self.actions[int(self.q_values[i].argmax())]
+
+    def get_best_action(self, state, mask=()):
+        self.action_count += 1
+        i = self._index(state)
+        q = self._mask(i, mask) if mask else self.q_values[i]
+        return self.actions[int(q.argmax())]
+
+    def update_q_table(self, state, action, reward, next_state, next_action, steps=1):
+        i = self._index(state)
+        j = self._index(next_state)
+        gamma = self.gamma if steps == 1 else self.gamma ** steps
+        if self.replay_capacity:
+            if self.replay_buffer is None:
+                self.replay_buffer = ReplayBuffer(self.replay_capacity)
+            self.replay_buffer.add(i, self.action_index[action], reward, j, self.action_index[next_action], gamma)
+            if self.replay_buffer.position % self.replay_every == 0:
+                self.replay(self.batch_size)
+            return
+
+        self.update_count += 1
+        a = self.action_index[action]
+        q = self.q_values
+        q[i, a] += self.alpha * (reward + gamma * self._next_values(q[j], self.action_index[next_action], self.available[j]) - q[i, a])
+
+    def replay(self, batch_size=None):
+        import numpy as np
+
+        buffer = self.replay_buffer
+        if buffer is None or len(buffer) == 0:
+            return
+        batch_size = batch_size or self.batch_size
+        states, actions, rewards, next_states, next_actions, discounts = buffer.sample(batch_size, self.rng)
+        q = self.q_values
+        targets = rewards + discounts * self._next_values(q[next_states], next_actions, self.available[next_states])
+        # add.at accumulates repeated (state, action) pairs instead of keeping the last write
+        np.add.at(q, (states, actions), self.alpha * (targets - q[states, actions]))
+        self.update_count += batch_size
+
+
+# The categorical fields of each get_state in order, with every value each can
+# take. A value that extends another one ("medium_close", "medium") comes first
+KNIGHT_STATE_FIELDS = (
+    ("x_state", ("melee_range", "close", "medium", "far")),
+    ("x_direction", ("right", "left")),
+    ("y_state", ("same_level", "above", "below")),
+    ("knight_health", ("high", "medium", "low")),
+    ("player_health", ("high", "medium", "low")),
+    ("current_action", ("idle", "attack", "walk", "death", "block")),
+    ("facing_player", ("facing_player", "not_facing_player")),
+    ("attack_ready", ("attack_ready", "attack_cooldown")),
+    ("player_attacking", ("player_attacking", "player_not_attacking")),
+    ("wall_state", ("close_to_left_wall", "close_to_right_wall", "no_wall")),
+    ("shield_ready", ("shield_ready", "shield_cooldown")),
+    ("block_state", ("not_blocking", "blocking_0", "blocking_1", "blocking_2", "blocking_3", "blocking_4")),
+)
+
+ENEMY_STATE_FIELDS = (
+    ("x_state", ("melee_range", "close", "medium_close", "medium_far", "medium", "far", "very_far", "extreme_range")),
+    ("x_direction", ("right", "left")),
+    ("y_state", ("same_level", "above", "below")),
+    ("enemy_health", ("high", "medium", "low")),
+    ("player_health", ("high", "medium", "low")),
+    ("facing_player", ("facing_player", "not_facing_player")),
+    ("attack_ready", ("attack_ready", "attack_cooldown")),
+    ("wall_state", ("far_to_left_wall", "far_to_right_wall", "no_wall")),
+)
+
+BIRD_STATE_FIELDS = (
+    ("proximity", ("close", "far", "very_far")),
+    ("x_direction", ("right", "left")),
+    ("y_direction", ("above", "below")),
+    ("shield_state", ("shield_active", "shield_inactive")),
+    ("shield_cooldown", ("shield_ready", "shield_cooldown")),
+    ("pk_distance", ("very_close", "close", "medium", "far")),
+    ("pe_distance", ("very_close", "close", "medium", "far")),
+    ("knight_action", ("idle", "attack", "walk", "death", "block")),
+    ("enemy_action", ("idle", "run", "death", "attack")),
+)
+
+STATE_FIELDS = {
+    "knight": KNIGHT_STATE_FIELDS,
+    "enemy": ENEMY_STATE_FIELDS,
+    "bird": BIRD_STATE_FIELDS,
+}
+
+
+def parse_state(state, fields):
+    # Split a state string into the index of each field's value. Values may
+    # contain underscores, so match them against the vocabulary left to right
+    indices = []
+    position = 0
+    for name, values in fields:
+        for i, value in enumerate(values):
+            end = position + len(value)
+            if state.startswith(value, position) and (end == len(state) or state[end] == "_"):
+                indices.append(i)
+                position = end + 1
+                break
+        else:
+            raise ValueError(f"Cannot read field {name} of state {state}")
+    return indices
+
+
+class LinearQTable:
+    """Read-only {state: {action: value}} view of a LinearSARSA over the states it has seen."""
+    def __init__(self, sarsa):
+        self.sarsa = sarsa
+
+    def __len__(self):
+        return len(self.sarsa.feature_cache)
+
+    def __contains__(self, state):
+        return state in self.sarsa.feature_cache
+
+    def __iter__(self):
+        return iter(list(self.sarsa.feature_cache))
+
+    def __getitem__(self, state):
+        if state not in self.sarsa.feature_cache:
+            raise KeyError(state)
+        return dict(zip(self.sarsa.actions, self.sarsa.q_values(state).tolist()))
+
+    def get(self, state, default=None):
+        return self[state] if state in self.sarsa.feature_cache else default
+
+    def keys(self):
+        return list(self.sarsa.feature_cache)
+
+    def values(self):
+        return [self[state] for state in self.keys()]
+
+    def items(self):
+        return [(state, self[state]) for state in self.keys()]
+
+
+class LinearSARSA(SARSA):
+    """
+    SARSA over a linear value function instead of a table. The state string
+    is read back into its categorical fields (STATE_FIELDS), and the
+    features are a bias, a one-hot per field and, with pairs, a one-hot per
+    pair of fields, which is tile coding with one tile per value. Q(s, a) is
+    the sum of the active features' weights for a, so all actions are scored
+    in one row sum and updated with one semi-gradient step.
+
+    The weight matrix has a fixed size however many states are visited, and
+    rarely seen combinations borrow from the fields they share with common
+    ones. Checkpoints are .npz weight files. Capping, visit counts, traces and
+    planning are SARSA-only and configure_sarsa rejects them.
+    """
+    checkpoint_suffix = ".npz"
+    unsupported_params = ArraySARSA.unsupported_params
+
+    def __init__(self, character_type, q_table_folder=None, target="sarsa", pairs=True):
+        import numpy as np
+
+        # Bound once for the per-frame methods, an import statement costs microseconds per call
+        self.np = np
+        if character_type not in STATE_FIELDS:
+            raise ValueError(f"No state fields known for character type: {character_type}")
+        self.fields = STATE_FIELDS[character_type]
+        sizes = [len(values) for _, values in self.fields]
+        self.field_offsets = []
+        self.num_features = 1  # Bias
+        for size in sizes:
+            self.field_offsets.append(self.num_features)
+            self.num_features += size
+        self.pair_offsets = []
+        if pairs:
+            for i, j in itertools.combinations(range(len(sizes)), 2):
+                self.pair_offsets.append((i, j, sizes[j], self.num_features))
+                self.num_features += sizes[i] * sizes[j]
+        # State string to active feature indices, bounded by the vocabulary
+        self.feature_cache = {}
+        super().__init__(character_type, q_table_folder, target=target)
+        self.action_index = {action: i for i, action in enumerate(self.actions)}
+
+    @property
+    def q_table(self):
+        return LinearQTable(self)
+
+    @q_table.setter
+    def q_table(self, weights):
+        import numpy as np
+
+        shape = (self.num_features, len(self.actions))
+        if weights is None:
+            weights = np.zeros(shape)
+        elif weights.shape != shape:
+            raise ValueError(f"Weights of shape {weights.shape} do not match {shape} features x actions")
+        self.weights = weights
+
+    def load_q_table(self):
+        import numpy as np
+
+        q_table_files = glob.glob(f'{self.q_table_folder}/*{self.checkpoint_suffix}')
+        if not q_table_files:
+            return None
+        latest_file = max(q_table_files, key=os.path.getctime)
+        with np.load(latest_file) as data:
+            return data["weights"]
+
+    def save_q_table(self):
+        import numpy as np
+
+        if not os.path.exists(self.q_table_folder):
+            os.makedirs(self.q_table_folder)
+        filename = f'{self.q_table_folder}/q_table_episode_{self.episode_count}{self.checkpoint_suffix}'
+        with open(filename + '.tmp', 'wb') as f:
+            np.savez(f, weights=self.weights)
+        os.replace(filename + '.tmp', filename)
+        print(f"Weights saved as {filename}")
+
+    def to_dict(self):
+        return dict(self.q_table.items())
+
+    def features(self, state):
+        active = self.feature_cache.get(state)
+        if active is None:
+            values = parse_state(state, self.fields)
+            active = [0] + [offset + v for offset, v in zip(self.field_offsets, values)]
+            active += [offset + values[i] * size + values[j] for i, j, size, offset in self.pair_offsets]
+            active = self.feature_cache[state] = self.np.array(active)
+        return active
+
+    def q_values(self, state):
+        return self.weights[self.features(state)].sum(axis=0)
+
+    def get_action(self, state, mask=()):
+        np = self.np
+        self.action_count += 1
+        q = self.q_values(state)
+        if mask:
+            self.state_masks[state] = mask
+            if random.random() < self.epsilon:
+                return random.choice(self._allowed(mask))
+            return self.actions[int(np.where(self._available(mask), q, -np.inf).argmax())]
+        if random.random() < self.epsilon:
+            return random.choice(self.actions)
+        return self.actions[int(q.argmax())]
+
+    def get_best_action(self, state, mask=()):
+        np = self.np
+        self.action_count += 1
+        q = self.q_values(state)
+        if mask:
+            self.state_masks[state] = mask
+            q = np.where(self._available(mask), q, -np.inf)
+        return self.actions[int(q.argmax())]
+
+    def update_q_table(self, state, action, reward, next_state, next_action, steps=1):
+        np = self.np
+        self.update_count += 1
+        active = self.features(state)
+        a = self.action_index[action]
+        next_q = self.q_values(next_state)
+        if self.target == "sarsa":
+            next_value = next_q[self.action_index[next_action]]
+        else:
+            available = self._available(self.state_masks.get(next_state, ()))
+            next_value = np.where(available, next_q, -np.inf).max()
+            if self.target == "expected":
+                next_value = self.epsilon * next_q[available].mean() + (1 - self.epsilon) * next_value
+        gamma = self.gamma if steps == 1 else self.gamma ** steps
+        delta = reward + gamma * next_value - self.weights[active, a].sum()
+        # The step is shared between the active features, as with tile coding
+        self.weights[active, a] += self.alpha / len(active) * delta
+
+
+class ObservationReplayBuffer:
+    """
+    Preallocated ring buffer of observation transitions: float32 observation
+    rows, action indices, rewards, the discount on the next value (0 after a
+    terminal step) and the actions available in the next state. A batch from
+    many arenas is written with one wrapped index assignment per column.
+    """
+    def __init__(self, capacity, observation_size, num_actions):
+        import numpy as np
+
+        self.np = np  # Bound once, add runs every step
+        self.capacity = capacity
+        self.observations = np.zeros((capacity, observation_size), dtype=np.float32)
+        self.actions = np.zeros(capacity, dtype=np.int64)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.next_observations = np.zeros((capacity, observation_size), dtype=np.float32)
+        self.discounts = np.zeros(capacity, dtype=np.float32)
+        self.next_masks = np.ones((capacity, num_actions), dtype=bool)
+        self.position = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, observations, actions, rewards, next_observations, discounts, next_masks):
+        n = len(actions)
+        i = (self.position + self.np.arange(n)) % self.capacity
+        self.observations[i] = observations
+        self.actions[i] = actions
+        self.rewards[i] = rewards
+        self.next_observations[i] = next_observations
+        self.discounts[i] = discounts
+        self.next_masks[i] = next_masks
+        self.position = (self.position + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+
+    def sample(self, batch_size, rng):
+        i = rng.integers(0, self.size, batch_size)
+        return (self.observations[i], self.actions[i], self.rewards[i], self.next_observations[i],
+                self.discounts[i], self.next_masks[i])
+
+
+class QNetwork:
+    """Small float32 ReLU MLP from an observation vector to one Q-value per action."""
+    def __init__(self, inputs, outputs, hidden=(64, 64), rng=None):
+        import numpy as np
+
+        self.np = np  # Bound once, forward runs for every decision
+        rng = rng or np.random.default_rng()
+        sizes = (inputs,) + tuple(hidden) + (outputs,)
+        self.params = []
+        for n_in, n_out in zip(sizes[:-1], sizes[1:]):
+            # He initialization for the ReLU layers
+            self.params.append((rng.standard_normal((n_in, n_out)) * math.sqrt(2 / n_in)).astype(np.float32))
+            self.params.append(np.zeros(n_out, dtype=np.float32))
+
+    def forward(self, x, activations=None):
+        # activations collects each layer's input for backward
+        maximum = self.np.maximum
+        last = len(self.params) - 2
+        for i in range(0, len(self.params), 2):
+            if activations is not None:
+                activations.append(x)
+            x = x @ self.params[i] + self.params[i + 1]
+            if i < last:
+                maximum(x, 0, out=x)
+        return x
+
+    def backward(self, activations, grad):
+        grads = [None] * len(self.params)
+        for i in range(len(self.params) - 2, -1, -2):
+            a = activations[i // 2]
+            grads[i] = a.T @ grad
+            grads[i + 1] = grad.sum(axis=0)
+            if i:
+                grad = (grad @ self.params[i].T) * (a > 0)
+        return grads
+
+    def copy_from(self, other):
+        for param, source in zip(self.params, other.params):
+            param[...] = source
+
+    def load(self, params):
+        if [p.shape for p in params] != [p.shape for p in self.params]:
+            raise ValueError("Saved network does not match the configured layer sizes")
+        for param, source in zip(self.params, params):
+            param[...] = source
+
+
+class NetworkSARSA(SARSA):
+    """
+    Deep Q-learning on the numeric get_observation vectors: a QNetwork
+    scores every action and is trained with Adam on minibatches from an
+    ObservationReplayBuffer, against a target network synced every
+    target_sync training steps. Learning is off-policy, so target is
+    "q_learning" (the DQN greedy target) or "expected" (under the
+    epsilon-greedy policy), both over the next state's available actions.
+
+    act_batch scores a whole batch of arenas in one forward pass.
+    get_action serves a single agent, and a Knight or Enemy built with this
+    learner plays from its observations. Plain NumPy on the CPU;
+    checkpoints are .npz parameter files. The SARSA-only options are
+    rejected by configure_sarsa, as for ArraySARSA.
+    """
+    checkpoint_suffix = ".npz"
+    observes = True
+    unsupported_params = ArraySARSA.unsupported_params
+
+    def __init__(self, character_type, q_table_folder=None, target="q_learning", hidden=(64, 64), learning_rate=1e-3,
+                 batch_size=128, replay_capacity=100000, train_every=16, target_sync=500):
+        import numpy as np
+
+        if character_type not in NETWORK_SCENARIOS:
+            # Only Knight and Enemy choose from observations, the Bird always passes state strings
+            raise ValueError(f"No network scenario for character type: {character_type}")
+        if target == "sarsa":
+            raise ValueError("NetworkSARSA learns off-policy, use target 'expected' or 'q_learning'")
+        self.np = np  # Bound once for the per-decision methods
+        self.hidden = tuple(hidden)
+        self.learning_rate = learning_rate
+        self.batch_size = batch_size
+        self.replay_capacity = replay_capacity
+        self.train_every = train_every  # Stored transitions per gradient step
+        self.target_sync = target_sync
+        self.replay = None
+        self.pending = 0
+        self.train_count = 0
+        self.last_mask = ()  # The mask of the latest decision, the next state of the coming update
+        self.rng = np.random.default_rng(random.getrandbits(64))
+        super().__init__(character_type, q_table_folder, target=target)
+        self.action_index = {action: i for i, action in enumerate(self.actions)}
+
+    @property
+    def q_table(self):
+        # No table, the Q-function lives in the network. The size metrics use
+        # parameter_count and parameter_bytes instead of this empty view
+        return {}
+
+    @q_table.setter
+    def q_table(self, params):
+        import numpy as np
+
+        self.network = QNetwork(len(OBSERVATION_FIELDS[self.character_type]), len(self.actions), self.hidden, self.rng)
+        if params is not None:
+            self.network.load(params)
+        self.target_network = QNetwork(len(OBSERVATION_FIELDS[self.character_type]), len(self.actions), self.hidden, self.rng)
+        self.target_network.copy_from(self.network)
+        self.moments = [np.zeros_like(p) for p in self.network.params]
+        self.velocities = [np.zeros_like(p) for p in self.network.params]
+        self.adam_steps = 0
+
+    def load_q_table(self):
+        import numpy as np
+
+        q_table_files = glob.glob(f'{self.q_table_folder}/*{self.checkpoint_suffix}')
+        if not q_table_files:
+            return None
+        latest_file = max(q_table_files, key=os.path.getctime)
+        with np.load(latest_file) as data:
+            return [data[f"arr_{i}"] for i in range(len(data.files))]
+
+    def parameter_count(self):
+        return sum(p.size for p in self.network.params)
+
+    def parameter_bytes(self):
+        # Online and target networks, Adam moments and the replay buffer
+        arrays = self.network.params + self.target_network.params + self.moments + self.velocities
+        if self.replay is not None:
+            replay = self.replay
+            arrays += [replay.observations, replay.actions, replay.rewards, replay.next_observations,
+                       replay.discounts, replay.next_masks]
+        return sum(a.nbytes for a in arrays)
+
+    def save_q_table(self):
+        import numpy as np
+
+        if not os.path.exists(self.q_table_folder):
+            os.makedirs(self.q_table_folder)
+        filename = f'{self.q_table_folder}/q_table_episode_{self.episode_count}{self.checkpoint_suffix}'
+        with open(filename + '.tmp', 'wb') as f:
+            np.savez(f, *self.network.params)
+        os.replace(filename + '.tmp', filename)
+        print(f"Network saved as {filename}")
+
+    def get_action(self, observation, mask=()):
+        self.action_count += 1
+        self.last_mask = mask
+        if random.random() < self.epsilon:
+            return random.choice(self._allowed(mask) if mask else self.actions)
+        return self._greedy(observation, mask)
+
+    def get_best_action(self, observation, mask=()):
+        self.action_count += 1
+        self.last_mask = mask
+        return self._greedy(observation, mask)
+
+    def _greedy(self, observation, mask):
+        np = self.np
+        q = self.network.forward(observation[None])[0]
+        if mask:
+            q = np.where(self._available(mask), q, -np.inf)
+        return self.actions[int(q.argmax())]
+
+    def act_batch(self, observations, masks):
+        # Epsilon-greedy action indices for a batch of arenas, masks is a boolean (arenas, actions) array
+        np = self.np
+
+        q = np.where(masks, self.network.forward(observations), -np.inf)
+        actions = q.argmax(axis=1)
+        explore = self.rng.random(len(actions)) < self.epsilon
+        if explore.any():
+            # The largest of uniform draws over the allowed actions is a uniform allowed action
+            actions[explore] = (self.rng.random((int(explore.sum()), q.shape[1])) * masks[explore]).argmax(axis=1)
+        self.action_count += len(actions)
+        return actions
+
+    def update_q_table(self, state, action, reward, next_state, next_action, steps=1):
+        # Single-agent loops: state and next_state are observation vectors, and
+        # next_action was just chosen with next_state's mask
+        np = self.np
+        gamma = self.gamma if steps == 1 else self.gamma ** steps
+        self.store(state[None], np.array([self.action_index[action]]), np.array([reward], dtype=np.float32),
+                   next_state[None], np.array([gamma], dtype=np.float32), self._available(self.last_mask)[None])
+
+    def store(self, observations, actions, rewards, next_observations, discounts, next_masks):
+        if self.replay is None:
+            self.replay = ObservationReplayBuffer(self.replay_capacity, observations.shape[1], len(self.actions))
+        self.replay.add(observations, actions, rewards, next_observations, discounts, next_masks)
+        if len(self.replay) < self.batch_size:
+            return
+        self.pending += len(actions)
+        while self.pending >= self.train_every:
+            self.pending -= self.train_every
+            self.train()
+
+    def train(self):
+        np = self.np
+        observations, actions, rewards, next_observations, discounts, next_masks = self.replay.sample(self.batch_size, self.rng)
+        next_q = self.target_network.forward(next_observations)
+        next_values = np.where(next_masks, next_q, -np.inf).max(axis=1)
+        if self.target == "expected":
+            mean = (next_q * next_masks).sum(axis=1) / next_masks.sum(axis=1)
+            next_values = self.epsilon * mean + (1 - self.epsilon) * next_values
+        targets = rewards + discounts * next_values
+
+        activations = []
+        q = self.network.forward(observations, activations)
+        rows = np.arange(len(actions))
+        # Huber loss: the TD error's gradient is clipped to [-1, 1]
+        grad = np.zeros_like(q)
+        grad[rows, actions] = np.clip(q[rows, actions] - targets, -1, 1) / len(actions)
+        grads = self.network.backward(activations, grad)
+
+        self.adam_steps += 1
+        step = self.learning_rate * math.sqrt(1 - 0.999 ** self.adam_steps) / (1 - 0.9 ** self.adam_steps)
+        for param, g, m, v in zip(self.network.params, grads, self.moments, self.velocities):
+            m *= 0.9
+            m += 0.1 * g
+            v *= 0.999
+            v += 0.001 * g * g
+            param -= step * m / (np.sqrt(v) + 1e-8)
+
+        self.update_count += len(actions)
+        self.train_count += 1
+        if self.train_count % self.target_sync == 0:
+            self.target_network.copy_from(self.network)
+
+
+class ActionRepeat:
+    """
+    Frame-skip bookkeeping for one agent. A new action is chosen every k frames,
+    the rewards of the repeat are summed with discounting and learnt from in a
+    single k-step SARSA update. With k=1 this is the plain per-frame loop.
+
+    When event_driven is set, decisions are event-driven: k is only the longest
+    hold, and the repeat also ends as soon as the agent's decision_events change
+    (a hit, a cooldown running out, an attack or block starting, the player
+    crossing a coarse distance cell). Those are a tuple of raw fields read without
+    building the state string, so a held frame costs far less than get_state.
+    """
+    def __init__(self, k=1, event_driven=False):
+        self.k = k
+        self.event_driven = event_driven
+        self.reset()
+
+    def reset(self):
+        self.state = None
+        self.action = None
+        self.events = None
+        self.frames = 0
+        self.reward = 0.0
+        self.discount = 1.0
+        self.carried = None
+
+    def due(self):
+        return self.frames == 0
+
+    def choose(self, sarsa, state, mask=()):
+        # Take the action the last update bootstrapped from when the state is
+        # unchanged, so the SARSA target is the action that actually runs
+        carried = self.carried
+        self.carried = None
+        if carried is not None and carried[0] == state:
+            return carried[1]
+        return sarsa.get_action(state, mask)
+
+    def begin(self, state, action, events=None):
+        self.state = state
+        self.action = action
+        self.events = events
+
+    def add(self, reward, gamma, events=None):
+        # Returns True once the repeat is complete and an update is due
+        self.reward += self.discount * reward
+        self.discount *= gamma
+        self.frames += 1
+        if self.frames >= self.k:
+            return True
+        return events is not None and events != self.events
+
+    def update(self, sarsa, next_state, next_action):
+        sarsa.update_q_table(self.state, self.action, self.reward, next_state, next_action, steps=self.frames)
+        self.carried = (next_state, next_action)
+        self.frames = 0
+        self.reward = 0.0
+        self.discount = 1.0
+
         
 class SimplePlayer(Player):
     def __init__(self, x, y):
@@ -848,7 +2021,7 @@ class SimplePlayer(Player):
         self.rect.y = self.initial_y
 
 class Bird(pygame.sprite.Sprite):
-    def __init__(self, x, y):
+    def __init__(self, x, y, sarsa=None):
         super().__init__()
         self.load_animations()
         self.rect = self.image.get_rect()
@@ -861,7 +2034,8 @@ class Bird(pygame.sprite.Sprite):
         self.update_time = pygame.time.get_ticks()
         self.facing_right = True
         
-        self.sarsa = SARSA(character_type="bird")
+        self.sarsa = sarsa if sarsa is not None else SARSA(character_type="bird")
+        self.repeat = ActionRepeat()
         self.previous_state = None
         self.previous_action = None
         self.total_reward = 0
@@ -881,6 +2055,7 @@ class Bird(pygame.sprite.Sprite):
         self.shield_reward_given = False
         self.shield_start_time = 0
         self.unnecessary_shield_use = False
+        self.blocked_attacks = 0
         
     def load_animations(self):
         self.animations = {
@@ -900,20 +2075,23 @@ class Bird(pygame.sprite.Sprite):
         self.heal_cooldown = max(0, self.heal_cooldown - 1)
         self.shield_cooldown = max(0, self.shield_cooldown - 1)
         
-        current_state = self.get_state(player)
-        action = self.sarsa.get_action(current_state)
-        self.perform_action(action, player)
-        
-        reward = self.get_reward(player, knight=knight, enemy=enemy)
-        self.total_reward += reward
-        next_state = self.get_state(player)
-        next_action = self.sarsa.get_action(next_state)
+        if self.repeat.action is not None:
+            # Driven by a trainer: repeat the committed action, learning happens in the trainer's update
+            self.perform_action(self.repeat.action, player)
+            self.total_reward += self.get_reward(player, knight=knight, enemy=enemy)
+        else:
+            current_state = self.get_state(player)
+            action = self.sarsa.get_action(current_state, self.action_mask())
+            self.perform_action(action, player)
 
-        if self.previous_state is not None and self.previous_action is not None:
-            self.sarsa.update_q_table(self.previous_state, self.previous_action, reward, current_state, action)
+            reward = self.get_reward(player, knight=knight, enemy=enemy)
+            self.total_reward += reward
 
-        self.previous_state = current_state
-        self.previous_action = action
+            if self.previous_state is not None and self.previous_action is not None:
+                self.sarsa.update_q_table(self.previous_state, self.previous_action, reward, current_state, action)
+
+            self.previous_state = current_state
+            self.previous_action = action
         
         self.update_animation()
         self.update_shield(player)
@@ -969,6 +2147,40 @@ class Bird(pygame.sprite.Sprite):
 
         return f"{proximity}_{x_direction}_{y_direction}_{shield_state}_{shield_cooldown}_{pk_distance}_{pe_distance}_{knight_action}_{enemy_action}"
         
+    def get_observation(self, player, out=None, knight=None, enemy=None):
+        # The unbucketed quantities behind get_state, laid out as BIRD_OBSERVATION_FIELDS
+        if out is None:
+            import numpy as np
+            out = np.empty(len(BIRD_OBSERVATION_FIELDS), dtype=np.float32)
+        # Written field by field, see _observe_player
+        out[0] = (player.rect.centerx - self.rect.centerx) / SCREEN_WIDTH
+        out[1] = (player.rect.top - self.rect.bottom) / SCREEN_HEIGHT
+        out[2] = self.rect.centerx / SCREEN_WIDTH
+        out[3] = self.rect.centery / SCREEN_HEIGHT
+        out[4] = self.shield_cooldown / self.shield_cooldown_max
+        out[5] = self.shield_active
+        out[6] = self.shield_loading
+        out[7] = (player.rect.centerx - knight.rect.centerx) / SCREEN_WIDTH if knight else 0
+        out[8] = knight is not None
+        out[9] = (player.rect.centerx - enemy.rect.centerx) / SCREEN_WIDTH if enemy else 0
+        out[10] = enemy is not None
+        _one_hot(out, 11, 5, knight.action if knight else 0)
+        _one_hot(out, 16, 4, enemy.action if enemy else 0)
+        _observe_player(player, out, 20)
+        return out
+
+    def action_mask(self):
+        # Read from the same fields as shield_state and shield_cooldown in get_state
+        return ('activate_shield',) if self.shield_cooldown or self.shield_active else ()
+
+    def decision_events(self, player, knight=None, enemy=None):
+        # Cheap stand-ins for the get_state fields: distances in 50 pixel cells and the raw flags
+        return (abs(player.rect.centerx - self.rect.centerx) // 50, (player.rect.top - self.rect.bottom) // 50,
+                abs(player.rect.centerx - knight.rect.centerx) // 50 if knight else None,
+                abs(player.rect.centerx - enemy.rect.centerx) // 50 if enemy else None,
+                self.shield_active, self.shield_cooldown == 0, knight.action if knight else None,
+                enemy.action if enemy else None)
+
     def perform_action(self, action, player):
         dx, dy = 0, 0
         if action == 'move_up': dy = -self.speed
@@ -1026,6 +2238,7 @@ class Bird(pygame.sprite.Sprite):
                 for arrow in enemy.arrow_group:
                     if not arrow.stopped and arrow.rect.colliderect(player.rect):
                         reward += 50  # Big reward for blocking an attack
+                        self.blocked_attacks += 1
                         self.shield_reward_given = True
                         self.unnecessary_shield_use = False
                         break
@@ -1108,11 +2321,11 @@ class Bird(pygame.sprite.Sprite):
         self.shield_frame = 0
         self.shield_reward_given = False
         self.unnecessary_shield_use = False
+        self.blocked_attacks = 0
+        self.repeat.reset()
 
     def end_episode(self):
         self.sarsa.end_episode()
-        print(f"Episode {self.sarsa.episode_count} ended. Total Reward: {self.total_reward}")
-        print(f"Epsilon: {self.sarsa.epsilon:.6f}, Alpha: {self.sarsa.alpha:.6f}")
         self.total_reward = 0
 
 
@@ -1133,7 +2346,7 @@ class Knight(Character):
                     temp_list.append(img)
                 cls.animation_lists.append(temp_list)
 
-    def __init__(self, x, y):
+    def __init__(self, x, y, sarsa=None):
         super().__init__(x, y)
         if Knight.animation_lists is None:
             Knight.load_animations()
@@ -1166,7 +2379,9 @@ class Knight(Character):
         self.rect.x = max(0, min(x, SCREEN_WIDTH - self.rect.width))
         self.rect.bottom = y + self.vertical_offset
         
-        self.sarsa = SARSA(character_type="knight")
+        self.sarsa = sarsa if sarsa is not None else SARSA(character_type="knight")
+        self.repeat = ActionRepeat()
+        self.observation = None  # Reused get_observation buffer for learners that observe
         self.previous_state = None
         self.previous_action = None
         self.episode_steps = 0
@@ -1231,6 +2446,48 @@ class Knight(Character):
         
         return f"{x_state}_{x_direction}_{y_state}_{knight_health}_{player_health}_{current_action}_{facing_player}_{attack_ready}_{player_attacking}_{wall_state}_{shield_ready}_{block_state}"
 
+    def get_observation(self, player, out=None):
+        # The unbucketed quantities behind get_state, laid out as KNIGHT_OBSERVATION_FIELDS
+        if out is None:
+            import numpy as np
+            out = np.empty(len(KNIGHT_OBSERVATION_FIELDS), dtype=np.float32)
+        # Written field by field, see _observe_player
+        out[0] = (player.rect.x - self.rect.x) / SCREEN_WIDTH
+        out[1] = (player.rect.y - self.rect.y) / SCREEN_HEIGHT
+        out[2] = self.rect.x / SCREEN_WIDTH
+        out[3] = self.rect.y / SCREEN_HEIGHT
+        out[4] = self.direction
+        out[5] = self.vel_y / -JUMP_STRENGTH
+        out[6] = self.knockback_velocity / 10
+        out[7] = self.health / self.max_health
+        out[8] = self.attack_cooldown / 60
+        out[9] = self.shield_cooldown / self.block_release_cooldown
+        out[10] = self.block_duration / self.max_block_duration
+        out[11] = self.attacking
+        out[12] = self.blocking
+        _observe_player(player, out, 13)
+        return out
+
+    def action_mask(self):
+        # Read from the same fields as attack_ready, shield_ready and block_state in get_state.
+        # attack() does nothing while blocking, block() nothing while the shield cools down
+        # (while blocking it still releases a block held to its limit)
+        if self.blocking:
+            return ('attack',)
+        if self.attack_cooldown:
+            return ('attack', 'block', 'maintain_block') if self.shield_cooldown else ('attack', 'maintain_block')
+        return ('block', 'maintain_block') if self.shield_cooldown else ('maintain_block',)
+
+    def decision_events(self, player):
+        # Cheap stand-ins for the get_state fields: the player's distance in 50 pixel
+        # cells, the level band, the wall margin and the raw flags. Facing is left
+        # out, it flips every frame while the two overlap
+        dy = player.rect.y - self.rect.y
+        return (abs(player.rect.x - self.rect.x) // 50, (dy > 50) - (dy < -50),
+                self.rect.left <= 50 or self.rect.right >= SCREEN_WIDTH - 50, self.health, player.health,
+                self.action, self.attack_cooldown == 0, player.attacking, self.shield_cooldown == 0,
+                self.blocking and self.block_duration // 30)
+
     def is_facing_player(self):
         if self.player:
             return (self.direction == 1 and self.player.rect.centerx > self.rect.centerx) or \
@@ -1378,8 +2635,12 @@ class Knight(Character):
             self.shield_cooldown -= 1
         
         if self.alive:
-            current_state = self.get_state(player)
-            action = self.sarsa.get_action(current_state)
+            if self.repeat.action is not None:
+                # Driven by a trainer: keep the action committed to at the last decision
+                current_state, action = self.repeat.state, self.repeat.action
+            else:
+                current_state = observe(self, player) if self.sarsa.observes else self.get_state(player)
+                action = self.sarsa.get_action(current_state, self.action_mask())
             self.act(action, player, tile_map)
 
             self.check_melee_hit(player)
@@ -1476,99 +2737,565 @@ class Knight(Character):
         self.player = None
         self.hit_player = False
         self.killed_player = False
+        self.repeat.reset()
 
     def end_episode(self):
         self.sarsa.end_episode()
         self.episode_steps = 0
         self.total_reward = 0
 
-def train_knight_fast():
+class MetricsSink:
+    """
+    Buffered per-episode training metrics.
+    record() only appends to an in-memory ring buffer. A background thread writes
+    the buffer to a JSONL file in batches, and a one-line console summary is
+    printed every summary_interval episodes instead of one line per episode.
+    """
+    FIELDS = ("episode", "reward", "epsilon", "steps", "hits", "wall_time")
+
+    def __init__(self, name, folder='metrics', capacity=100000, flush_interval=2.0, summary_interval=100):
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self.path = os.path.join(folder, f"{name}_{time.strftime('%Y%m%d-%H%M%S')}_{os.getpid()}.jsonl")
+        self.summary_interval = summary_interval
+        self.flush_interval = flush_interval
+        self.buffer = collections.deque(maxlen=capacity)
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.start_time = time.time()
+        self.window = []
+        self.window_start = self.start_time
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+
+    def record(self, episode, reward, epsilon, steps, hits=0):
+        row = (episode, reward, epsilon, steps, hits, time.time() - self.start_time)
+        with self.lock:
+            if len(self.buffer) == self.buffer.maxlen:
+                self.dropped += 1
+            self.buffer.append(row)
+
+        if self.summary_interval:
+            self.window.append(row)
+            if len(self.window) >= self.summary_interval:
+                self.print_summary()
+
+    def print_summary(self):
+        if not self.window:
+            return
+        rewards = [row[1] for row in self.window]
+        elapsed = max(time.time() - self.window_start, 1e-9)
+        print(f"Episodes {self.window[0][0]}-{self.window[-1][0]}: "
+              f"Avg Reward: {sum(rewards) / len(rewards):.2f}, Min: {min(rewards):.2f}, Max: {max(rewards):.2f}, "
+              f"Avg Steps: {sum(row[3] for row in self.window) / len(self.window):.1f}, "
+              f"Hits: {sum(row[4] for row in self.window)}, Epsilon: {self.window[-1][2]:.6f}, "
+              f"{len(self.window) / elapsed:.1f} episodes/s", flush=True)
+        self.window = []
+        self.window_start = time.time()
+
+    def _drain(self, f):
+        with self.lock:
+            batch = list(self.buffer)
+            self.buffer.clear()
+        if batch:
+            f.write("".join(json.dumps(dict(zip(self.FIELDS, row))) + "\n" for row in batch))
+            f.flush()
+
+    def _write_loop(self):
+        with open(self.path, 'a') as f:
+            while not self.stop_event.wait(self.flush_interval):
+                self._drain(f)
+            self._drain(f)
+
+    def close(self):
+        self.print_summary()
+        self.stop_event.set()
+        self.writer.join()
+        if self.dropped:
+            print(f"Metrics buffer overflowed, {self.dropped} episodes were not written")
+        print(f"Metrics written to {self.path}")
+
+
+class PhaseTimer:
+    """
+    Opt-in per-frame timing of the training step phases.
+    The trainer takes a perf_counter_ns timestamp at every phase boundary and
+    hands them to record(); every report_interval episodes the per-phase totals
+    and percentiles are printed and the samples are cleared.
+    """
+    PHASES = ("get_state", "get_action", "act", "player_update", "knight_update",
+              "reward", "next_state", "next_action", "q_update")
+
+    def __init__(self, report_interval=100):
+        from array import array
+
+        self.report_interval = report_interval
+        self.samples = [array('q') for _ in self.PHASES]
+        self.episodes = 0
+
+    def record(self, timestamps):
+        for samples, start, end in zip(self.samples, timestamps, timestamps[1:]):
+            samples.append(end - start)
+
+    def end_episode(self):
+        self.episodes += 1
+        if self.episodes % self.report_interval == 0:
+            self.report()
+
+    def report(self):
+        totals = [sum(samples) for samples in self.samples]
+        grand_total = sum(totals) or 1
+        frames = len(self.samples[0])
+        print(f"Phase timings over {self.report_interval} episodes ({frames} frames):")
+        for phase, samples, total in zip(self.PHASES, self.samples, totals):
+            if not samples:
+                continue
+            ordered = sorted(samples)
+            p50, p90, p99 = (ordered[min(len(ordered) - 1, int(len(ordered) * q))] for q in (0.5, 0.9, 0.99))
+            print(f"  {phase:<14} {total / 1e6:10.1f} ms {100 * total / grand_total:5.1f}%  "
+                  f"p50 {p50 / 1e3:8.2f} us  p90 {p90 / 1e3:8.2f} us  p99 {p99 / 1e3:8.2f} us", flush=True)
+        for samples in self.samples:
+            del samples[:]
+
+
+class Profiler:
+    """
+    Profile a bounded window of episodes [start_episode, end_episode) in place.
+    mode 'cprofile' records deterministic stats to <prefix>.pstats, mode 'sample'
+    records the training thread's stack every interval seconds to
+    <prefix>.collapsed (one "frame;frame;frame count" line per stack, ready for
+    flamegraph tools). Trainers call episode() at the start of every episode.
+    Set RL_PROFILE=mode:start:end (e.g. sample:1000:1100) to profile a run
+    without touching the code.
+    """
+    def __init__(self, mode="cprofile", start_episode=0, end_episode=100, output_prefix="profiles/run", interval=0.005):
+        if mode not in ("cprofile", "sample"):
+            raise ValueError(f"Unknown profiling mode: {mode}")
+        self.mode = mode
+        self.start_episode = start_episode
+        self.end_episode = end_episode
+        self.output_prefix = output_prefix
+        self.interval = interval
+        self.active = False
+        self.finished = False
+        self.profile = None
+        self.stacks = collections.Counter()
+        self.sampler = None
+        self.stop_event = threading.Event()
+
+    @classmethod
+    def from_env(cls, name):
+        spec = os.environ.get("RL_PROFILE")
+        if not spec:
+            return None
+        parts = spec.split(":")
+        mode = parts[0] or "cprofile"
+        start_episode = int(parts[1]) if len(parts) > 1 and parts[1] else 0
+        end_episode = int(parts[2]) if len(parts) > 2 and parts[2] else start_episode + 100
+        return cls(mode, start_episode, end_episode, output_prefix=f"profiles/{name}_{os.getpid()}")
+
+    def episode(self, episode):
+        if self.finished:
+            return
+        if not self.active and self.start_episode <= episode < self.end_episode:
+            self.start()
+        elif self.active and episode >= self.end_episode:
+            self.stop()
+
+    def start(self):
+        self.active = True
+        print(f"Profiling ({self.mode}) from episode {self.start_episode} to {self.end_episode}")
+        if self.mode == "cprofile":
+            import cProfile
+
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        else:
+            self.stop_event.clear()
+            self.sampler = threading.Thread(target=self._sample_loop, args=(threading.get_ident(),), daemon=True)
+            self.sampler.start()
+
+    def _sample_loop(self, thread_id):
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        if not self.active:
+            return
+        self.active = False
+        self.finished = True
+        folder = os.path.dirname(self.output_prefix)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        if self.mode == "cprofile":
+            self.profile.disable()
+            path = f"{self.output_prefix}.pstats"
+            self.profile.dump_stats(path)
+        else:
+            self.stop_event.set()
+            self.sampler.join()
+            path = f"{self.output_prefix}.collapsed"
+            with open(path, 'w') as f:
+                for stack, count in self.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        print(f"Profile saved as {path}")
+
+    def close(self):
+        self.stop()
+
+
+def peak_rss_bytes():
+    try:
+        import resource
+    except ImportError:
+        # Windows has no resource module; psutil is optional
+        try:
+            import psutil
+        except ImportError:
+            return None
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # Linux reports kilobytes
+
+
+def current_rss_bytes():
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+def q_table_memory(sarsa, sample=1000):
+    if isinstance(sarsa, NetworkSARSA):
+        # No table rows, the footprint is the network, optimizer and replay arrays
+        return {"parameters": sarsa.parameter_count(), "estimated_bytes": sarsa.parameter_bytes()}
+    rows = len(sarsa.q_table)
+    if rows == 0:
+        return {"rows": 0, "bytes_per_row": 0, "estimated_bytes": 0}
+    # Action names are shared strings, so only the key, the row dict and its values count
+    sampled = list(itertools.islice(sarsa.q_table.items(), sample))
+    row_bytes = sum(sys.getsizeof(state) + sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row.values())
+                    for state, row in sampled) / len(sampled)
+    bytes_per_row = row_bytes + sys.getsizeof(sarsa.q_table) / rows
+    return {"rows": rows, "bytes_per_row": round(bytes_per_row, 1), "estimated_bytes": int(bytes_per_row * rows),
+            "max_states": sarsa.max_states, "evicted_states": sarsa.evicted_states}
+
+
+def memory_report(sarsas):
+    return {
+        "rss_bytes": current_rss_bytes(),
+        "peak_rss_bytes": peak_rss_bytes(),
+        "q_tables": {sarsa.character_type: q_table_memory(sarsa) for sarsa in sarsas},
+    }
+
+
+def tracemalloc_snapshot(path, top=10):
+    import tracemalloc
+
+    snapshot = tracemalloc.take_snapshot()
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    snapshot.dump(path)
+    print(f"tracemalloc snapshot saved as {path}")
+    for stat in snapshot.statistics('lineno')[:top]:
+        print(f"  {stat}")
+    return snapshot
+
+
+class MemoryMonitor:
+    """
+    Print RSS and Q-table sizes every interval episodes.
+    Creating the snapshot_trigger file asks for a tracemalloc snapshot: tracing
+    starts at the next report and the snapshot is written at the one after.
+    """
+    def __init__(self, interval=1000, snapshot_trigger='memory_snapshot.request', folder='profiles'):
+        self.interval = interval
+        self.snapshot_trigger = snapshot_trigger
+        self.folder = folder
+
+    def end_episode(self, episode, sarsas):
+        if episode % self.interval != 0:
+            return
+        report = memory_report(sarsas)
+        rss = report["rss_bytes"]
+        tables = ", ".join(f"{name}: {table['parameters']} parameters, {table['estimated_bytes'] / 2**20:.1f} MiB arrays"
+                           if "parameters" in table else f"{name}: {table['rows']} rows x {table['bytes_per_row']:.0f} B"
+                           for name, table in report["q_tables"].items())
+        print(f"Memory at episode {episode}: RSS {rss / 2**20 if rss else float('nan'):.1f} MiB, {tables}", flush=True)
+
+        if os.path.exists(self.snapshot_trigger):
+            import tracemalloc
+
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                print("tracemalloc started, snapshot follows at the next report")
+            else:
+                tracemalloc_snapshot(os.path.join(self.folder, f"tracemalloc_{os.getpid()}_{episode}.snap"))
+                tracemalloc.stop()
+                os.remove(self.snapshot_trigger)
+        return report
+
+
+def training_stats(sarsas, frames, episodes, seconds):
+    seconds = max(seconds, 1e-9)
+    decisions = sum(sarsa.action_count for sarsa in sarsas)
+    updates = sum(sarsa.update_count for sarsa in sarsas)
+    return {
+        "frames": frames,
+        "episodes": episodes,
+        "seconds": seconds,
+        "frames_per_sec": frames / seconds,
+        "decisions": decisions,
+        "decisions_per_sec": decisions / seconds,
+        "updates": updates,
+        "updates_per_sec": updates / seconds,
+        "planning_updates": sum(sarsa.planning_count for sarsa in sarsas),
+        "q_table_states": {sarsa.character_type: len(sarsa.q_table) for sarsa in sarsas
+                           if not isinstance(sarsa, NetworkSARSA)},
+        "network_bytes": {sarsa.character_type: sarsa.parameter_bytes() for sarsa in sarsas
+                          if isinstance(sarsa, NetworkSARSA)},
+        "epsilon": {sarsa.character_type: sarsa.epsilon for sarsa in sarsas},
+    }
+
+
+# Knight reward weights. 'training' is used by the training loops; the evaluation
+# scenarios score checkpoints, 'performance' matching the learning-curve sweep
+# and 'test' the greedy rollout in test().
+KNIGHT_REWARDS = {
+    "training": {"attack": -10, "far": 0.01, "near": 0, "hit": 40, "kill": 100, "damaged": -40, "block": 30, "death": -100},
+    "performance": {"attack": -10, "far": 0, "near": 0.01, "hit": 40, "kill": 100, "damaged": -40, "block": 30, "death": -100},
+    "test": {"attack": -10, "far": -0.01, "near": 0, "hit": 40, "kill": 100, "damaged": -40, "block": 30, "death": -100},
+}
+
+
+def knight_reward(knight, player, previous_health, weights):
+    dx = player.rect.x - knight.rect.x
+
+    reward = 0
+    if knight.just_attacked:
+        reward += weights["attack"]
+        knight.just_attacked = False
+
+    if abs(dx) > 100:
+        reward += weights["far"]
+    elif abs(dx) < 100:
+        reward += weights["near"]
+    if knight.hit_player:
+        reward += weights["hit"]
+        if knight.killed_player:
+            reward += weights["kill"]
+    if knight.health < previous_health:
+        reward += weights["damaged"]
+    if knight.blocking and knight.shield_used and knight.is_facing_player():
+        reward += weights["block"]
+    if knight.health == 0 and not knight.death_penalty_applied:
+        reward += weights["death"]
+        knight.death_penalty_applied = True
+    return reward
+
+
+ENEMY_REWARDS = {
+    "training": {"near": -0.1, "wall": -0.1, "damaged": -50, "hit": 50, "kill": 100, "death": -100, "attack": -10},
+}
+
+
+def enemy_reward(enemy, player, previous_health, hit_player, killed_player, weights):
+    dx = player.rect.x - enemy.rect.x
+
+    reward = 0
+    if abs(dx) < 150:
+        reward += weights["near"]
+    if enemy.rect.left <= 100 or enemy.rect.right >= SCREEN_WIDTH - 100:
+        reward += weights["wall"]
+    if enemy.health < previous_health:
+        reward += weights["damaged"]
+    if hit_player:
+        reward += weights["hit"]
+    if killed_player:
+        reward += weights["kill"]
+    if enemy.health <= 0:
+        reward += weights["death"]
+    if enemy.just_attacked:
+        reward += weights["attack"]
+        enemy.just_attacked = False
+    return reward
+
+
+def configure_sarsa(sarsa, sarsa_params=None, max_q_states=None, eviction="lru", observations=False):
+    if sarsa.observes and not observations:
+        raise ValueError(f"{type(sarsa).__name__} acts on observation vectors, train it with train_q_network")
+    requested = set(sarsa_params or ())
+    if max_q_states is not None:
+        requested.add("max_states")
+    if eviction != "lru":
+        requested.add("eviction")
+    ignored = sorted(requested.intersection(sarsa.unsupported_params))
+    if ignored:
+        raise ValueError(f"{type(sarsa).__name__} does not support: {', '.join(ignored)}")
+    for name, value in (sarsa_params or {}).items():
+        if not hasattr(sarsa, name):
+            raise ValueError(f"Unknown SARSA parameter: {name}")
+        setattr(sarsa, name, value)
+    if sarsa.target not in SARSA_TARGETS:
+        raise ValueError(f"Unknown update target: {sarsa.target}")
+    if eviction not in ("lru", "least_visited"):
+        raise ValueError(f"Unknown eviction policy: {eviction}")
+    sarsa.max_states = max_q_states
+    sarsa.eviction = eviction
+    sarsa.track_visits = sarsa.track_visits or eviction == "least_visited"
+
+
+def train_knight_fast(summary_interval=100, phase_report_interval=None, num_episodes=500000, max_frames=None, save=True,
+                      seed=None, metrics=None, profiler=None, memory=None, max_q_states=None, eviction="lru",
+                      action_repeat=1, event_driven=False, q_table_folder=None, sarsa_params=None, sarsa_class=SARSA,
+                      save_interval=100, reward_weights=None):
     tile_map = TileMap()
-    knight = Knight(500, SCREEN_HEIGHT - 72)
+    knight = Knight(500, SCREEN_HEIGHT - 72, sarsa=sarsa_class("knight", q_table_folder=q_table_folder))
     player = AIPlayer(250, SCREEN_HEIGHT - 50)
+    if seed is not None:
+        random.seed(seed)
+    metrics = metrics or MetricsSink("knight", summary_interval=summary_interval)
+    profiler = profiler or Profiler.from_env("knight")
+    configure_sarsa(knight.sarsa, sarsa_params, max_q_states, eviction)
+    knight.repeat.k = action_repeat
+    knight.repeat.event_driven = event_driven
+    # Phase timers cost one local flag check per boundary when disabled
+    timer = PhaseTimer(phase_report_interval) if phase_report_interval else None
+    timed = timer is not None
+    clock = time.perf_counter_ns
 
-    num_episodes = 500000  
     frames_per_episode = 30 * 60  # 60 seconds at 60 FPS
     FULL_RESET_INTERVAL = 50000
 
     start_time = time.time()
-    last_epsilon = knight.sarsa.epsilon
+    total_frames = 0
+    episodes_done = 0
+    weights = reward_weights or KNIGHT_REWARDS["training"]
 
     for episode in range(num_episodes):
+        if max_frames is not None and total_frames >= max_frames:
+            break
+        if profiler:
+            profiler.episode(episode)
         if episode % FULL_RESET_INTERVAL == 0 and episode > 0:
-            last_epsilon = knight.sarsa.epsilon
+            # Rebuild the knight but keep its learner, so unsaved progress survives
+            sarsa = knight.sarsa
             del knight
             gc.collect()
-            knight = Knight(500, SCREEN_HEIGHT - 72)
-            knight.sarsa.epsilon = last_epsilon
-            print(f"Performed full reset at episode {episode}, continuing with epsilon {last_epsilon:.6f}")
+            knight = Knight(500, SCREEN_HEIGHT - 72, sarsa=sarsa)
+            knight.repeat.k = action_repeat
+            knight.repeat.event_driven = event_driven
+            print(f"Performed full reset at episode {episode}, continuing with epsilon {sarsa.epsilon:.6f}")
         
         knight.reset()
         player.reset()
         frame_count = 0
         episode_reward = 0
+        hits = 0
         
-        while frame_count < frames_per_episode:
-            current_state = knight.get_state(player)
-            action = knight.sarsa.get_action(current_state)
+        episode_frames = frames_per_episode if max_frames is None else min(frames_per_episode, max_frames - total_frames)
+        while frame_count < episode_frames:
+            if timed:
+                t0 = clock()
+            if knight.repeat.due():
+                current_state = knight.get_state(player)
+                if timed:
+                    t1 = clock()
+                action = knight.repeat.choose(knight.sarsa, current_state, knight.action_mask())
+                knight.repeat.begin(current_state, action,
+                                    knight.decision_events(player) if knight.repeat.event_driven else None)
+            else:
+                action = knight.repeat.action
+                if timed:
+                    t1 = t0
+            if timed:
+                t2 = clock()
             
             previous_health = knight.health
             knight.act(action, player, tile_map)
+            if timed:
+                t3 = clock()
             player.update(knight, tile_map)
+            if timed:
+                t4 = clock()
             knight.update(player, tile_map)
+            if timed:
+                t5 = clock()
 
             # Calculate reward
-            dx = player.rect.x - knight.rect.x
-
-            # Calculate reward
-            reward = 0
-            if knight.just_attacked:
-                reward -= 10
-                knight.just_attacked = False
-
-            if abs(dx) > 100:
-                reward += 0.01
+            reward = knight_reward(knight, player, previous_health, weights)
             if knight.hit_player:
-                reward += 40
-                if knight.killed_player:
-                    reward += 100
-            if knight.health < previous_health:
-                reward -= 40
-            if knight.blocking and knight.shield_used and knight.is_facing_player():
-                reward += 30
-            if knight.health == 0 and not knight.death_penalty_applied:
-                reward -= 100
-                knight.death_penalty_applied = True
-            
+                hits += 1
             episode_reward += reward
-
-            next_state = knight.get_state(player)
-            next_action = knight.sarsa.get_action(next_state)
-
-            # Update Q-table
-            knight.sarsa.update_q_table(current_state, action, reward, next_state, next_action)
+            if timed:
+                t6 = t7 = t8 = clock()
+
+            events = knight.decision_events(player) if knight.repeat.event_driven else None
+            if knight.repeat.add(reward, knight.sarsa.gamma, events):
+                next_state = knight.get_state(player)
+                if timed:
+                    t7 = clock()
+                next_action = knight.sarsa.get_action(next_state, knight.action_mask())
+                if timed:
+                    t8 = clock()
+
+                # Update Q-table
+                knight.repeat.update(knight.sarsa, next_state, next_action)
+            if timed:
+                timer.record((t0, t1, t2, t3, t4, t5, t6, t7, t8, clock()))
 
             frame_count += 1
 
             if not player.alive or not knight.alive:
                 break
 
+        if not knight.repeat.due():
+            # Learn from the truncated repeat at the end of the episode
+            next_state = knight.get_state(player)
+            knight.repeat.update(knight.sarsa, next_state, knight.sarsa.get_action(next_state, knight.action_mask()))
         knight.sarsa.end_episode()
+        if timed:
+            timer.end_episode()
         
-        print(f"Episode {episode + 1}: Reward: {episode_reward:.2f}, Epsilon: {knight.sarsa.epsilon:.6f}", flush=True)
+        metrics.record(episode + 1, episode_reward, knight.sarsa.epsilon, frame_count, hits)
+        total_frames += frame_count
+        episodes_done += 1
+        if memory:
+            memory.end_episode(episode + 1, [knight.sarsa])
         
-        if (episode + 1) % 100 == 0:
+        if save and (episode + 1) % save_interval == 0:
             knight.sarsa.save_q_table()
             gc.collect()
 
+    metrics.close()
+    if profiler:
+        profiler.close()
     print("Training complete")
     print(f"Final Epsilon: {knight.sarsa.epsilon:.6f}")
-    knight.sarsa.save_q_table()
+    if save:
+        knight.sarsa.save_q_table()
 
     total_time = (time.time() - start_time) / 60
     print(f"\nTotal training time: {total_time:.2f} minutes")
 
     gc.collect()
+    return training_stats([knight.sarsa], total_frames, episodes_done, time.time() - start_time)
 
 def visualize_training():
     tile_map = TileMap()
@@ -1606,7 +3333,7 @@ def visualize_training():
                     sys.exit()
 
             current_state = knight.get_state(player)
-            action = knight.sarsa.get_action(current_state)
+            action = knight.sarsa.get_action(current_state, knight.action_mask())
             
             previous_health = knight.health
             knight.act(action, player, tile_map)
@@ -1637,7 +3364,7 @@ def visualize_training():
             episode_reward += reward
 
             next_state = knight.get_state(player)
-            next_action = knight.sarsa.get_action(next_state)
+            next_action = knight.sarsa.get_action(next_state, knight.action_mask())
 
             # Update Q-table
             knight.sarsa.update_q_table(current_state, action, reward, next_state, next_action)
@@ -1690,23 +3417,43 @@ def visualize_training():
     gc.collect()
     pygame.quit()
     
-def train_bird_with_knight_fast():
+def train_bird_with_knight_fast(summary_interval=1000, num_episodes=1000000, max_frames=None, save=True, seed=None,
+                                metrics=None, profiler=None, memory=None, max_q_states=None, eviction="lru",
+                                action_repeat=1, event_driven=False, q_table_folder=None, sarsa_params=None,
+                                sarsa_class=SARSA, save_interval=1000, reload_frozen=None, frozen_folders=None):
     tile_map = TileMap()
-    bird = Bird(400, SCREEN_HEIGHT - 100)
+    bird = Bird(400, SCREEN_HEIGHT - 100, sarsa=sarsa_class("bird", q_table_folder=q_table_folder))
     player = AIPlayer(250, SCREEN_HEIGHT - 50)
-    knight = Knight(500, SCREEN_HEIGHT - 72)
+    # frozen_folders maps a frozen agent's character type to the folder its trainer saves to
+    frozen_folders = frozen_folders or {}
+    knight = Knight(500, SCREEN_HEIGHT - 72, sarsa=SARSA("knight", q_table_folder=frozen_folders.get("knight")))
     knight.sarsa.epsilon_min = 0
     knight.sarsa.epsilon = 0
     knight.sarsa.q_table = knight.sarsa.load_q_table()
     bird.sarsa.q_table = bird.sarsa.load_q_table()
+    if seed is not None:
+        random.seed(seed)
+    metrics = metrics or MetricsSink("bird_with_knight", summary_interval=summary_interval)
+    profiler = profiler or Profiler.from_env("bird_with_knight")
+    configure_sarsa(bird.sarsa, sarsa_params, max_q_states, eviction)
+    bird.repeat.k = action_repeat
+    bird.repeat.event_driven = event_driven
 
-    num_episodes = 1000000
     frames_per_episode = 30 * 60  # 30 seconds at 60 FPS
     FULL_RESET_INTERVAL = 1000
 
     start_time = time.time()
+    total_frames = 0
+    episodes_done = 0
 
     for episode in range(num_episodes):
+        if max_frames is not None and total_frames >= max_frames:
+            break
+        if profiler:
+            profiler.episode(episode)
+        if reload_frozen and episode % reload_frozen == 0 and episode > 0:
+            # Pick up the latest snapshot saved by a concurrently running trainer
+            knight.sarsa.q_table = knight.sarsa.load_q_table()
         if episode % FULL_RESET_INTERVAL == 0 and episode > 0:
             gc.collect()
             print(f"Performed full reset at episode {episode}, continuing with epsilon {bird.sarsa.epsilon:.6f}")
@@ -1719,57 +3466,77 @@ def train_bird_with_knight_fast():
         frame_count = 0
         episode_reward = 0
         
-        while frame_count < frames_per_episode:
+        episode_frames = frames_per_episode if max_frames is None else min(frames_per_episode, max_frames - total_frames)
+        while frame_count < episode_frames:
             # Knight's turn (using best action, not training)
             knight_state = knight.get_state(player)
-            knight_action = knight.sarsa.get_best_action(knight_state)
+            knight_action = knight.sarsa.get_best_action(knight_state, knight.action_mask())
             knight.act(knight_action, player, tile_map)
             
             # Player's turn
             player.make_decision(knight)
             
             # Bird's turn
-            bird_state = bird.get_state(player, knight)
-            bird_action = bird.sarsa.get_action(bird_state)
+            if bird.repeat.due():
+                bird_state = bird.get_state(player, knight)
+                bird_action = bird.repeat.choose(bird.sarsa, bird_state, bird.action_mask())
+                bird.repeat.begin(bird_state, bird_action,
+                                  bird.decision_events(player, knight) if bird.repeat.event_driven else None)
+            else:
+                bird_action = bird.repeat.action
             bird.perform_action(bird_action, player)
             
             # Update all entities
             player.update(knight,tile_map)
             knight.update(player, tile_map)
-            bird.update(player, knight)
+            bird.update(player, enemy=None, knight=knight)
             
             # Calculate reward
             reward = bird.get_reward(player, knight)
             episode_reward += reward
 
-            # Get next state and action for SARSA update
-            next_bird_state = bird.get_state(player, knight)
-            next_bird_action = bird.sarsa.get_action(next_bird_state)
+            events = bird.decision_events(player, knight) if bird.repeat.event_driven else None
+            if bird.repeat.add(reward, bird.sarsa.gamma, events):
+                # Get next state and action for SARSA update
+                next_bird_state = bird.get_state(player, knight)
+                next_bird_action = bird.sarsa.get_action(next_bird_state, bird.action_mask())
 
-            # Update Q-table for bird only
-            bird.sarsa.update_q_table(bird_state, bird_action, reward, next_bird_state, next_bird_action)
+                # Update Q-table for bird only
+                bird.repeat.update(bird.sarsa, next_bird_state, next_bird_action)
 
             frame_count += 1
 
             if not player.alive or not knight.alive:
                 break
 
+        if not bird.repeat.due():
+            # Learn from the truncated repeat at the end of the episode
+            next_bird_state = bird.get_state(player, knight)
+            bird.repeat.update(bird.sarsa, next_bird_state, bird.sarsa.get_action(next_bird_state, bird.action_mask()))
+        metrics.record(episode + 1, episode_reward, bird.sarsa.epsilon, frame_count, bird.blocked_attacks)
+        total_frames += frame_count
+        episodes_done += 1
+        if memory:
+            memory.end_episode(episode + 1, [bird.sarsa, knight.sarsa])
         bird.end_episode()
         
-        if (episode + 1) % 1000 == 0:
+        if save and (episode + 1) % save_interval == 0:
             bird.sarsa.save_q_table()
             gc.collect()
 
-        print(f"Episode {episode + 1}: Reward: {episode_reward:.2f}, Bird Epsilon: {bird.sarsa.epsilon:.6f}", flush=True)
-
+    metrics.close()
+    if profiler:
+        profiler.close()
     print("Training complete")
     print(f"Final Epsilon: {bird.sarsa.epsilon:.6f}")
-    bird.sarsa.save_q_table()
+    if save:
+        bird.sarsa.save_q_table()
 
     total_time = (time.time() - start_time) / 60
     print(f"\nTotal training time: {total_time:.2f} minutes")
 
     gc.collect()
+    return training_stats([bird.sarsa, knight.sarsa], total_frames, episodes_done, time.time() - start_time)
 def visualize_bird_knight_training():
     tile_map = TileMap()
     bird = Bird(400, SCREEN_HEIGHT - 100)
@@ -1801,7 +3568,7 @@ def visualize_bird_knight_training():
 
             # Knight's turn (using best action, not training)
             knight_state = knight.get_state(player)
-            knight_action = knight.sarsa.get_best_action(knight_state)
+            knight_action = knight.sarsa.get_best_action(knight_state, knight.action_mask())
             knight.act(knight_action, player, tile_map)
             
             # Player's turn
@@ -1809,7 +3576,7 @@ def visualize_bird_knight_training():
             
             # Bird's turn
             bird_state = bird.get_state(player, knight)
-            bird_action = bird.sarsa.get_action(bird_state)
+            bird_action = bird.sarsa.get_action(bird_state, bird.action_mask())
             bird.perform_action(bird_action, player)
             
             # Update all entities
@@ -1823,7 +3590,7 @@ def visualize_bird_knight_training():
 
             # Get next state and action for SARSA update
             next_bird_state = bird.get_state(player, knight)
-            next_bird_action = bird.sarsa.get_action(next_bird_state)
+            next_bird_action = bird.sarsa.get_action(next_bird_state, bird.action_mask())
 
             # Update Q-table for bird only
             bird.sarsa.update_q_table(bird_state, bird_action, reward, next_bird_state, next_bird_action)
@@ -1880,18 +3647,34 @@ def visualize_bird_knight_training():
     pygame.quit()
 
 
-def train_enemy_fast():
+def train_enemy_fast(summary_interval=1000, num_episodes=500000, max_frames=None, save=True, seed=None, metrics=None,
+                     profiler=None, memory=None, max_q_states=None, eviction="lru", action_repeat=1, event_driven=False,
+                     q_table_folder=None, sarsa_params=None, sarsa_class=SARSA, save_interval=1000,
+                     reward_weights=None):
     tile_map = TileMap()
-    enemy = Enemy(500, SCREEN_HEIGHT - 50)
+    enemy = Enemy(500, SCREEN_HEIGHT - 50, sarsa=sarsa_class("enemy", q_table_folder=q_table_folder))
     player = AIPlayer(250, SCREEN_HEIGHT - 50)
+    if seed is not None:
+        random.seed(seed)
+    metrics = metrics or MetricsSink("enemy", summary_interval=summary_interval)
+    profiler = profiler or Profiler.from_env("enemy")
+    configure_sarsa(enemy.sarsa, sarsa_params, max_q_states, eviction)
+    enemy.repeat.k = action_repeat
+    enemy.repeat.event_driven = event_driven
 
-    num_episodes = 500000
     frames_per_episode = 60 * 60  # 60 seconds at 60 FPS
     FULL_RESET_INTERVAL = 50000
 
     start_time = time.time()
+    total_frames = 0
+    episodes_done = 0
+    weights = reward_weights or ENEMY_REWARDS["training"]
 
     for episode in range(num_episodes):
+        if max_frames is not None and total_frames >= max_frames:
+            break
+        if profiler:
+            profiler.episode(episode)
         if episode % FULL_RESET_INTERVAL == 0 and episode > 0:
             gc.collect()
             print(f"Performed full reset at episode {episode}, continuing with epsilon {enemy.sarsa.epsilon:.6f}")
@@ -1903,9 +3686,15 @@ def train_enemy_fast():
         episode_reward = 0
         successful_hits = 0
 
-        while frame_count < frames_per_episode:
-            enemy_state = enemy.get_state(player)
-            enemy_action = enemy.sarsa.get_action(enemy_state)
+        episode_frames = frames_per_episode if max_frames is None else min(frames_per_episode, max_frames - total_frames)
+        while frame_count < episode_frames:
+            if enemy.repeat.due():
+                enemy_state = enemy.get_state(player)
+                enemy_action = enemy.repeat.choose(enemy.sarsa, enemy_state, enemy.action_mask())
+                enemy.repeat.begin(enemy_state, enemy_action,
+                                   enemy.decision_events(player) if enemy.repeat.event_driven else None)
+            else:
+                enemy_action = enemy.repeat.action
             enemy.act(enemy_action, tile_map)
 
             player.make_decision(enemy)
@@ -1916,60 +3705,56 @@ def train_enemy_fast():
             enemy.update(player, tile_map)
 
             hit_player, killed_player = enemy.check_arrow_hit(player)
-            dx = player.rect.x - enemy.rect.x
 
             # Calculate reward
-            reward = 0
-
-
-            if abs(dx) < 150:
-                reward -= 0.1
-            if enemy.rect.left <= 100 or enemy.rect.right >= SCREEN_WIDTH - 100:
-                reward -= 0.1
-            if enemy.health < previous_enemy_health:
-                reward -= 50
+            reward = enemy_reward(enemy, player, previous_enemy_health, hit_player, killed_player, weights)
             if hit_player:
-                reward += 50
                 successful_hits += 1
-            if killed_player:
-                reward += 100
-            if enemy.health <= 0:
-                reward -= 100
-            if enemy.just_attacked:
-                reward -= 10
-                enemy.just_attacked = False
             episode_reward += reward
 
-            # Get next state and action
-            next_enemy_state = enemy.get_state(player)
-            next_enemy_action = enemy.sarsa.get_action(next_enemy_state)
+            events = enemy.decision_events(player) if enemy.repeat.event_driven else None
+            if enemy.repeat.add(reward, enemy.sarsa.gamma, events):
+                # Get next state and action
+                next_enemy_state = enemy.get_state(player)
+                next_enemy_action = enemy.sarsa.get_action(next_enemy_state, enemy.action_mask())
 
-            # Update Q-table
-            enemy.sarsa.update_q_table(enemy_state, enemy_action, reward, next_enemy_state, next_enemy_action)
+                # Update Q-table
+                enemy.repeat.update(enemy.sarsa, next_enemy_state, next_enemy_action)
 
             frame_count += 1
 
             if not player.alive or not enemy.alive:
                 break
 
+        if not enemy.repeat.due():
+            # Learn from the truncated repeat at the end of the episode
+            next_enemy_state = enemy.get_state(player)
+            enemy.repeat.update(enemy.sarsa, next_enemy_state, enemy.sarsa.get_action(next_enemy_state, enemy.action_mask()))
         enemy.end_episode()
 
-        print(
-            f"Episode {episode + 1}: Reward: {episode_reward:.2f}, Epsilon: {enemy.sarsa.epsilon:.6f}, Successful Hits: {successful_hits}",
-            flush=True)
+        metrics.record(episode + 1, episode_reward, enemy.sarsa.epsilon, frame_count, successful_hits)
+        total_frames += frame_count
+        episodes_done += 1
+        if memory:
+            memory.end_episode(episode + 1, [enemy.sarsa])
 
-        if (episode + 1) % 1000 == 0:
+        if save and (episode + 1) % save_interval == 0:
             enemy.sarsa.save_q_table()
             gc.collect()
 
+    metrics.close()
+    if profiler:
+        profiler.close()
     print("Training complete")
     print(f"Final Epsilon: {enemy.sarsa.epsilon:.6f}")
-    enemy.sarsa.save_q_table()
+    if save:
+        enemy.sarsa.save_q_table()
 
     total_time = (time.time() - start_time) / 60
     print(f"\nTotal training time: {total_time:.2f} minutes")
 
     gc.collect()
+    return training_stats([enemy.sarsa], total_frames, episodes_done, time.time() - start_time)
     
     
 def visualize_enemy_training():
@@ -1999,7 +3784,7 @@ def visualize_enemy_training():
                     sys.exit()
 
             enemy_state = enemy.get_state(player)
-            enemy_action = enemy.sarsa.get_action(enemy_state)
+            enemy_action = enemy.sarsa.get_action(enemy_state, enemy.action_mask())
             enemy.act(enemy_action, tile_map)
 
             player.make_decision(enemy)
@@ -2034,7 +3819,7 @@ def visualize_enemy_training():
             
             # Get next state and action
             next_enemy_state = enemy.get_state(player)
-            next_enemy_action = enemy.sarsa.get_action(next_enemy_state)
+            next_enemy_action = enemy.sarsa.get_action(next_enemy_state, enemy.action_mask())
 
             # Update Q-table
             enemy.sarsa.update_q_table(enemy_state, enemy_action, reward, next_enemy_state, next_enemy_action)
@@ -2087,22 +3872,159 @@ def visualize_enemy_training():
     enemy.sarsa.save_q_table()
 
     pygame.quit()
-def train_bird_and_enemy_fast():
+
+
+def _network_step_knight(knight, player, action, tile_map, weights):
+    previous_health = knight.health
+    knight.act(action, player, tile_map)
+    player.update(knight, tile_map)
+    knight.update(player, tile_map)
+    return knight_reward(knight, player, previous_health, weights), knight.hit_player
+
+
+def _network_step_enemy(enemy, player, action, tile_map, weights):
+    enemy.act(action, tile_map)
+    player.make_decision(enemy)
+    previous_health = enemy.health
+    player.update(enemy, tile_map)
+    enemy.update(player, tile_map)
+    hit_player, killed_player = enemy.check_arrow_hit(player)
+    return enemy_reward(enemy, player, previous_health, hit_player, killed_player, weights), hit_player
+
+
+NETWORK_SCENARIOS = {
+    # name: (agent factory, one frame of the fast trainer's loop, reward weights, frames per episode)
+    "knight": (lambda sarsa: Knight(500, SCREEN_HEIGHT - 72, sarsa=sarsa), _network_step_knight, KNIGHT_REWARDS, 30 * 60),
+    "enemy": (lambda sarsa: Enemy(500, SCREEN_HEIGHT - 50, sarsa=sarsa), _network_step_enemy, ENEMY_REWARDS, 60 * 60),
+}
+
+
+def train_q_network(character_type="knight", num_arenas=64, num_steps=100000, summary_interval=100, save=True, seed=None,
+                    metrics=None, q_table_folder=None, sarsa_params=None, hidden=(64, 64), save_interval=1000,
+                    reward_weights=None):
+    """
+    Train a NetworkSARSA for the knight or the enemy in num_arenas arenas
+    stepped in lockstep. Every step the arenas' observations are written
+    into one preallocated array, a single forward pass picks all their
+    actions and the whole batch of transitions goes to the replay buffer.
+    Finished arenas are reset in place. num_steps counts lockstep steps, so
+    the frames played are num_steps * num_arenas.
+    """
+    import numpy as np
+
+    if character_type not in NETWORK_SCENARIOS:
+        raise ValueError(f"Unknown network scenario: {character_type}")
+    make_agent, step, rewards, frames_per_episode = NETWORK_SCENARIOS[character_type]
+    if seed is not None:
+        random.seed(seed)
+    learner = NetworkSARSA(character_type, q_table_folder=q_table_folder, hidden=hidden)
+    configure_sarsa(learner, sarsa_params, observations=True)
+    metrics = metrics or MetricsSink(f"{character_type}_network", summary_interval=summary_interval)
+    weights = reward_weights or rewards["training"]
+
     tile_map = TileMap()
-    bird = Bird(400, SCREEN_HEIGHT - 100)
+    agents = [make_agent(learner) for _ in range(num_arenas)]
+    players = [AIPlayer(250, SCREEN_HEIGHT - 50) for _ in range(num_arenas)]
+    observations = np.zeros((num_arenas, len(OBSERVATION_FIELDS[character_type])), dtype=np.float32)
+    next_observations = np.zeros_like(observations)
+    masks = np.ones((num_arenas, len(learner.actions)), dtype=bool)
+    next_masks = np.ones_like(masks)
+    step_rewards = np.zeros(num_arenas, dtype=np.float32)
+    discounts = np.zeros(num_arenas, dtype=np.float32)
+    frames = [0] * num_arenas
+    episode_rewards = [0.0] * num_arenas
+    hits = [0] * num_arenas
+    for i, agent in enumerate(agents):
+        agent.reset()
+        players[i].reset()
+        agent.get_observation(players[i], observations[i])
+        masks[i] = learner._available(agent.action_mask())
+
+    start_time = time.time()
+    total_frames = 0
+    episodes_done = 0
+    for _ in range(num_steps):
+        actions = learner.act_batch(observations, masks)
+        for i, agent in enumerate(agents):
+            player = players[i]
+            action = learner.actions[actions[i]]
+            # Committing the action makes the agent's own update play it rather than choose again
+            agent.repeat.begin(None, action)
+            reward, hit = step(agent, player, action, tile_map, weights)
+            step_rewards[i] = reward
+            episode_rewards[i] += reward
+            hits[i] += hit
+            frames[i] += 1
+            discounts[i] = 0 if not player.alive or not agent.alive else learner.gamma
+            agent.get_observation(player, next_observations[i])
+            next_masks[i] = learner._available(agent.action_mask())
+        learner.store(observations, actions, step_rewards, next_observations, discounts, next_masks)
+        total_frames += num_arenas
+
+        for i, agent in enumerate(agents):
+            if discounts[i] and frames[i] < frames_per_episode:
+                continue
+            episodes_done += 1
+            metrics.record(episodes_done, episode_rewards[i], learner.epsilon, frames[i], hits[i])
+            learner.end_episode()
+            agent.reset()
+            players[i].reset()
+            frames[i] = 0
+            episode_rewards[i] = 0.0
+            hits[i] = 0
+            agent.get_observation(players[i], next_observations[i])
+            next_masks[i] = learner._available(agent.action_mask())
+            if save and episodes_done % save_interval == 0:
+                learner.save_q_table()
+
+        # The next observations become the current ones, the old rows are overwritten next step
+        observations, next_observations = next_observations, observations
+        masks, next_masks = next_masks, masks
+
+    metrics.close()
+    print("Training complete")
+    print(f"Final Epsilon: {learner.epsilon:.6f}")
+    if save:
+        learner.save_q_table()
+    return training_stats([learner], total_frames, episodes_done, time.time() - start_time)
+
+
+def train_bird_and_enemy_fast(summary_interval=1000, num_episodes=1000000, max_frames=None, save=True, seed=None,
+                              metrics=None, profiler=None, memory=None, max_q_states=None, eviction="lru",
+                              action_repeat=1, event_driven=False, q_table_folder=None, sarsa_params=None,
+                              sarsa_class=SARSA, save_interval=1000, reload_frozen=None, frozen_folders=None):
+    tile_map = TileMap()
+    bird = Bird(400, SCREEN_HEIGHT - 100, sarsa=sarsa_class("bird", q_table_folder=q_table_folder))
     player = AIPlayer(250, SCREEN_HEIGHT - 50)
-    enemy = Enemy(500, SCREEN_HEIGHT - 50)
+    # frozen_folders maps a frozen agent's character type to the folder its trainer saves to
+    frozen_folders = frozen_folders or {}
+    enemy = Enemy(500, SCREEN_HEIGHT - 50, sarsa=SARSA("enemy", q_table_folder=frozen_folders.get("enemy")))
     
     bird.sarsa.q_table = bird.sarsa.load_q_table()
     enemy.sarsa.q_table = enemy.sarsa.load_q_table()
+    if seed is not None:
+        random.seed(seed)
+    metrics = metrics or MetricsSink("bird_and_enemy", summary_interval=summary_interval)
+    profiler = profiler or Profiler.from_env("bird_and_enemy")
+    configure_sarsa(bird.sarsa, sarsa_params, max_q_states, eviction)
+    bird.repeat.k = action_repeat
+    bird.repeat.event_driven = event_driven
 
-    num_episodes = 1000000
     frames_per_episode = 30 * 60  # 30 seconds at 60 FPS
     FULL_RESET_INTERVAL = 1000
 
     start_time = time.time()
+    total_frames = 0
+    episodes_done = 0
 
     for episode in range(num_episodes):
+        if max_frames is not None and total_frames >= max_frames:
+            break
+        if profiler:
+            profiler.episode(episode)
+        if reload_frozen and episode % reload_frozen == 0 and episode > 0:
+            # Pick up the latest snapshot saved by a concurrently running trainer
+            enemy.sarsa.q_table = enemy.sarsa.load_q_table()
         if episode % FULL_RESET_INTERVAL == 0 and episode > 0:
             gc.collect()
             print(f"Performed full reset at episode {episode}, continuing with epsilon Bird: {bird.sarsa.epsilon:.6f}")
@@ -2116,18 +4038,24 @@ def train_bird_and_enemy_fast():
         bird_episode_reward = 0
         enemy_episode_reward = 0
         
-        while frame_count < frames_per_episode:
+        episode_frames = frames_per_episode if max_frames is None else min(frames_per_episode, max_frames - total_frames)
+        while frame_count < episode_frames:
             # Enemy's turn
             enemy_state = enemy.get_state(player)
-            enemy_action = enemy.sarsa.get_action(enemy_state)
+            enemy_action = enemy.sarsa.get_action(enemy_state, enemy.action_mask())
             enemy.act(enemy_action, tile_map)
             
             # Player's turn
             player.make_decision(enemy)
             
             # Bird's turn
-            bird_state = bird.get_state(player, enemy=enemy)
-            bird_action = bird.sarsa.get_action(bird_state)
+            if bird.repeat.due():
+                bird_state = bird.get_state(player, enemy=enemy)
+                bird_action = bird.repeat.choose(bird.sarsa, bird_state, bird.action_mask())
+                bird.repeat.begin(bird_state, bird_action,
+                                  bird.decision_events(player, enemy=enemy) if bird.repeat.event_driven else None)
+            else:
+                bird_action = bird.repeat.action
             bird.perform_action(bird_action, player)
             
             previous_enemy_health = enemy.health
@@ -2147,14 +4075,13 @@ def train_bird_and_enemy_fast():
 
 
             # Get next states and actions for SARSA update
-            next_bird_state = bird.get_state(player, enemy=enemy)
-            next_bird_action = bird.sarsa.get_action(next_bird_state)
-            
-            next_enemy_state = enemy.get_state(player)
-            next_enemy_action = enemy.sarsa.get_action(next_enemy_state)
+            events = bird.decision_events(player, enemy=enemy) if bird.repeat.event_driven else None
+            if bird.repeat.add(bird_reward, bird.sarsa.gamma, events):
+                next_bird_state = bird.get_state(player, enemy=enemy)
+                next_bird_action = bird.sarsa.get_action(next_bird_state, bird.action_mask())
 
-            # Update Q-tables
-            bird.sarsa.update_q_table(bird_state, bird_action, bird_reward, next_bird_state, next_bird_action)
+                # Update Q-tables
+                bird.repeat.update(bird.sarsa, next_bird_state, next_bird_action)
             #enemy.sarsa.update_q_table(enemy_state, enemy_action, enemy_reward, next_enemy_state, next_enemy_action)
 
             frame_count += 1
@@ -2162,26 +4089,37 @@ def train_bird_and_enemy_fast():
             if not player.alive or not enemy.alive:
                 break
 
+        if not bird.repeat.due():
+            # Learn from the truncated repeat at the end of the episode
+            next_bird_state = bird.get_state(player, enemy=enemy)
+            bird.repeat.update(bird.sarsa, next_bird_state, bird.sarsa.get_action(next_bird_state, bird.action_mask()))
+        metrics.record(episode + 1, bird_episode_reward, bird.sarsa.epsilon, frame_count, bird.blocked_attacks)
+        total_frames += frame_count
+        episodes_done += 1
+        if memory:
+            memory.end_episode(episode + 1, [bird.sarsa, enemy.sarsa])
         bird.end_episode()
         #enemy.end_episode()
         
-        if (episode + 1) % 1000 == 0:
+        if save and (episode + 1) % save_interval == 0:
             bird.sarsa.save_q_table()
 
             gc.collect()
 
-        print(f"Episode {episode + 1}: Bird Reward: {bird_episode_reward:.2f} "
-              f"Bird Epsilon: {bird.sarsa.epsilon:.6f}", flush=True)
-
+    metrics.close()
+    if profiler:
+        profiler.close()
     print("Training complete")
     print(f"Final Epsilon - Bird: {bird.sarsa.epsilon:.6f}")
-    bird.sarsa.save_q_table()
+    if save:
+        bird.sarsa.save_q_table()
 
 
     total_time = (time.time() - start_time) / 60
     print(f"\nTotal training time: {total_time:.2f} minutes")
 
     gc.collect()
+    return training_stats([bird.sarsa, enemy.sarsa], total_frames, episodes_done, time.time() - start_time)
     
 def visualize_bird_and_enemy_training():
     tile_map = TileMap()
@@ -2215,7 +4153,7 @@ def visualize_bird_and_enemy_training():
 
             # Enemy's turn
             enemy_state = enemy.get_state(player)
-            enemy_action = enemy.sarsa.get_action(enemy_state)
+            enemy_action = enemy.sarsa.get_action(enemy_state, enemy.action_mask())
             enemy.act(enemy_action, tile_map)
             
             # Player's turn
@@ -2223,7 +4161,7 @@ def visualize_bird_and_enemy_training():
             
             # Bird's turn
             bird_state = bird.get_state(player, enemy=enemy)
-            bird_action = bird.sarsa.get_action(bird_state)
+            bird_action = bird.sarsa.get_action(bird_state, bird.action_mask())
             bird.perform_action(bird_action, player)
             previous_enemy_health = enemy.health
             
@@ -2263,10 +4201,10 @@ def visualize_bird_and_enemy_training():
 
             # Get next states and actions for SARSA update
             next_bird_state = bird.get_state(player, enemy=enemy)
-            next_bird_action = bird.sarsa.get_action(next_bird_state)
+            next_bird_action = bird.sarsa.get_action(next_bird_state, bird.action_mask())
             
             next_enemy_state = enemy.get_state(player)
-            next_enemy_action = enemy.sarsa.get_action(next_enemy_state)
+            next_enemy_action = enemy.sarsa.get_action(next_enemy_state, enemy.action_mask())
 
             # Update Q-tables
             bird.sarsa.update_q_table(bird_state, bird_action, bird_reward, next_bird_state, next_bird_action)
@@ -2366,7 +4304,7 @@ def visualize_bird_and_enemy_training():
 
             # Enemy's turn
             enemy_state = enemy.get_state(player)
-            enemy_action = enemy.sarsa.get_action(enemy_state)
+            enemy_action = enemy.sarsa.get_action(enemy_state, enemy.action_mask())
             enemy.act(enemy_action, tile_map)
             
             # Player's turn
@@ -2374,7 +4312,7 @@ def visualize_bird_and_enemy_training():
             
             # Bird's turn
             bird_state = bird.get_state(player, enemy=enemy)
-            bird_action = bird.sarsa.get_action(bird_state)
+            bird_action = bird.sarsa.get_action(bird_state, bird.action_mask())
             bird.perform_action(bird_action, player)
             previous_enemy_health = enemy.health
             
@@ -2414,10 +4352,10 @@ def visualize_bird_and_enemy_training():
 
             # Get next states and actions for SARSA update
             next_bird_state = bird.get_state(player, enemy=enemy)
-            next_bird_action = bird.sarsa.get_action(next_bird_state)
+            next_bird_action = bird.sarsa.get_action(next_bird_state, bird.action_mask())
             
             next_enemy_state = enemy.get_state(player)
-            next_enemy_action = enemy.sarsa.get_action(next_enemy_state)
+            next_enemy_action = enemy.sarsa.get_action(next_enemy_state, enemy.action_mask())
 
             # Update Q-tables
             bird.sarsa.update_q_table(bird_state, bird_action, bird_reward, next_bird_state, next_bird_action)
@@ -2485,12 +4423,18 @@ def visualize_bird_and_enemy_training():
 
     pygame.quit()
     
-def train_bird_with_knight_and_enemy_fast():
+def train_bird_with_knight_and_enemy_fast(summary_interval=1000, num_episodes=1000000, max_frames=None, save=True,
+                                          seed=None, metrics=None, profiler=None, memory=None, max_q_states=None,
+                                          eviction="lru", action_repeat=1, event_driven=False, q_table_folder=None,
+                                          sarsa_params=None, sarsa_class=SARSA, save_interval=1000, reload_frozen=None,
+                                          frozen_folders=None):
     tile_map = TileMap()
-    bird = Bird(400, SCREEN_HEIGHT - 100)
+    bird = Bird(400, SCREEN_HEIGHT - 100, sarsa=sarsa_class("bird", q_table_folder=q_table_folder))
     player = AIPlayer(250, SCREEN_HEIGHT - 50)
-    knight = Knight(500, SCREEN_HEIGHT - 72)
-    enemy = Enemy(600, SCREEN_HEIGHT - 50)
+    # frozen_folders maps a frozen agent's character type to the folder its trainer saves to
+    frozen_folders = frozen_folders or {}
+    knight = Knight(500, SCREEN_HEIGHT - 72, sarsa=SARSA("knight", q_table_folder=frozen_folders.get("knight")))
+    enemy = Enemy(600, SCREEN_HEIGHT - 50, sarsa=SARSA("enemy", q_table_folder=frozen_folders.get("enemy")))
 
     knight.sarsa.epsilon_min = 0
     knight.sarsa.epsilon = 0
@@ -2500,14 +4444,30 @@ def train_bird_with_knight_and_enemy_fast():
     knight.sarsa.q_table = knight.sarsa.load_q_table()
     enemy.sarsa.q_table = enemy.sarsa.load_q_table()
     bird.sarsa.q_table = bird.sarsa.load_q_table()
+    if seed is not None:
+        random.seed(seed)
+    metrics = metrics or MetricsSink("bird_with_knight_and_enemy", summary_interval=summary_interval)
+    profiler = profiler or Profiler.from_env("bird_with_knight_and_enemy")
+    configure_sarsa(bird.sarsa, sarsa_params, max_q_states, eviction)
+    bird.repeat.k = action_repeat
+    bird.repeat.event_driven = event_driven
 
-    num_episodes = 1000000
     frames_per_episode = 30 * 60  # 30 seconds at 60 FPS
     FULL_RESET_INTERVAL = 1000
 
     start_time = time.time()
+    total_frames = 0
+    episodes_done = 0
 
     for episode in range(num_episodes):
+        if max_frames is not None and total_frames >= max_frames:
+            break
+        if profiler:
+            profiler.episode(episode)
+        if reload_frozen and episode % reload_frozen == 0 and episode > 0:
+            # Pick up the latest snapshot saved by a concurrently running trainer
+            knight.sarsa.q_table = knight.sarsa.load_q_table()
+            enemy.sarsa.q_table = enemy.sarsa.load_q_table()
         if episode % FULL_RESET_INTERVAL == 0 and episode > 0:
             gc.collect()
             print(f"Performed full reset at episode {episode}, continuing with epsilon {bird.sarsa.epsilon:.6f}")
@@ -2521,27 +4481,33 @@ def train_bird_with_knight_and_enemy_fast():
         frame_count = 0
         episode_reward = 0
         
-        while frame_count < frames_per_episode:
+        episode_frames = frames_per_episode if max_frames is None else min(frames_per_episode, max_frames - total_frames)
+        while frame_count < episode_frames:
             # Knight's turn (using best action, not training)
             knight_state = knight.get_state(player)
-            knight_action = knight.sarsa.get_best_action(knight_state)
+            knight_action = knight.sarsa.get_best_action(knight_state, knight.action_mask())
             knight.act(knight_action, player, tile_map)
             
             # Enemy's turn (using best action, not training)
             enemy_state = enemy.get_state(player)
-            enemy_action = enemy.sarsa.get_best_action(enemy_state)
+            enemy_action = enemy.sarsa.get_best_action(enemy_state, enemy.action_mask())
             enemy.act(enemy_action, tile_map)
             
-            # Player's turn
-            player.make_decision(knight, enemy)
+            # Player's turn, fighting the knight first and the enemy once it is down
+            player.make_decision(knight if knight.alive else enemy)
             
             # Bird's turn
-            bird_state = bird.get_state(player, knight=knight, enemy=enemy)
-            bird_action = bird.sarsa.get_action(bird_state)
+            if bird.repeat.due():
+                bird_state = bird.get_state(player, knight=knight, enemy=enemy)
+                bird_action = bird.repeat.choose(bird.sarsa, bird_state, bird.action_mask())
+                bird.repeat.begin(bird_state, bird_action,
+                                  bird.decision_events(player, knight, enemy) if bird.repeat.event_driven else None)
+            else:
+                bird_action = bird.repeat.action
             bird.perform_action(bird_action, player)
             
             # Update all entities
-            player.update(knight, enemy, tile_map)
+            player.update(enemy if enemy.alive else knight, tile_map)
             knight.update(player, tile_map)
             enemy.update(player, tile_map)
             bird.update(player, knight=knight, enemy=enemy)
@@ -2569,34 +4535,48 @@ def train_bird_with_knight_and_enemy_fast():
             reward = bird.get_reward(player, knight=knight, enemy=enemy)
             episode_reward += reward
 
-            # Get next state and action for SARSA update
-            next_bird_state = bird.get_state(player, knight=knight, enemy=enemy)
-            next_bird_action = bird.sarsa.get_action(next_bird_state)
+            events = bird.decision_events(player, knight, enemy) if bird.repeat.event_driven else None
+            if bird.repeat.add(reward, bird.sarsa.gamma, events):
+                # Get next state and action for SARSA update
+                next_bird_state = bird.get_state(player, knight=knight, enemy=enemy)
+                next_bird_action = bird.sarsa.get_action(next_bird_state, bird.action_mask())
 
-            # Update Q-table for bird only
-            bird.sarsa.update_q_table(bird_state, bird_action, reward, next_bird_state, next_bird_action)
+                # Update Q-table for bird only
+                bird.repeat.update(bird.sarsa, next_bird_state, next_bird_action)
 
             frame_count += 1
 
             if not player.alive or (not knight.alive and not enemy.alive):
                 break
 
+        if not bird.repeat.due():
+            # Learn from the truncated repeat at the end of the episode
+            next_bird_state = bird.get_state(player, knight=knight, enemy=enemy)
+            bird.repeat.update(bird.sarsa, next_bird_state, bird.sarsa.get_action(next_bird_state, bird.action_mask()))
+        metrics.record(episode + 1, episode_reward, bird.sarsa.epsilon, frame_count, bird.blocked_attacks)
+        total_frames += frame_count
+        episodes_done += 1
+        if memory:
+            memory.end_episode(episode + 1, [bird.sarsa, knight.sarsa, enemy.sarsa])
         bird.end_episode()
         
-        if (episode + 1) % 1000 == 0:
+        if save and (episode + 1) % save_interval == 0:
             bird.sarsa.save_q_table()
             gc.collect()
 
-        print(f"Episode {episode + 1}: Reward: {episode_reward:.2f}, Bird Epsilon: {bird.sarsa.epsilon:.6f}", flush=True)
-
+    metrics.close()
+    if profiler:
+        profiler.close()
     print("Training complete")
     print(f"Final Epsilon: {bird.sarsa.epsilon:.6f}")
-    bird.sarsa.save_q_table()
+    if save:
+        bird.sarsa.save_q_table()
 
     total_time = (time.time() - start_time) / 60
     print(f"\nTotal training time: {total_time:.2f} minutes")
 
     gc.collect()
+    return training_stats([bird.sarsa, knight.sarsa, enemy.sarsa], total_frames, episodes_done, time.time() - start_time)
 
 def visualize_bird_knight_and_enemy_training():
     tile_map = TileMap()
@@ -2632,12 +4612,12 @@ def visualize_bird_knight_and_enemy_training():
 
             # Knight's turn (using best action, not training)
             knight_state = knight.get_state(player)
-            knight_action = knight.sarsa.get_best_action(knight_state)
+            knight_action = knight.sarsa.get_best_action(knight_state, knight.action_mask())
             knight.act(knight_action, player, tile_map)
             
             # Enemy's turn (using best action, not training)
             enemy_state = enemy.get_state(player)
-            enemy_action = enemy.sarsa.get_best_action(enemy_state)
+            enemy_action = enemy.sarsa.get_best_action(enemy_state, enemy.action_mask())
             enemy.act(enemy_action, tile_map)
             
             # Player's turn
@@ -2647,7 +4627,7 @@ def visualize_bird_knight_and_enemy_training():
                 player.make_decision(enemy)
             # Bird's turn
             bird_state = bird.get_state(player, knight=knight, enemy=enemy)
-            bird_action = bird.sarsa.get_action(bird_state)
+            bird_action = bird.sarsa.get_action(bird_state, bird.action_mask())
             bird.perform_action(bird_action, player)
             
             # Update all entities
@@ -2684,7 +4664,7 @@ def visualize_bird_knight_and_enemy_training():
 
             # Get next state and action for SARSA update
             next_bird_state = bird.get_state(player, knight=knight, enemy=enemy)
-            next_bird_action = bird.sarsa.get_action(next_bird_state)
+            next_bird_action = bird.sarsa.get_action(next_bird_state, bird.action_mask())
 
             # Update Q-table for bird only
             bird.sarsa.update_q_table(bird_state, bird_action, reward, next_bird_state, next_bird_action)
@@ -2778,7 +4758,7 @@ def main():
         bird.update(player, enemy, knight)
 
         # Check for collisions between player and arrows
-        for arrow in enemy.arrow_group:
+        for arrow in itertools.chain(enemy.arrow_group, enemy.landed_arrows):
             if pygame.sprite.collide_rect(arrow, player):
                 player.take_damage(5, 1 if arrow.direction > 0 else -1)
                 arrow.kill()
@@ -2882,116 +4862,385 @@ def show_map():
     pygame.quit()
 
     
-def test_knight_performance():
-    import matplotlib.pyplot as plt
+def run_knight_eval_episode(knight, player, tile_map, frames_per_episode, weights):
+    knight.reset()
+    player.reset()
+    total_reward = 0
+    frame_count = 0
+
+    while frame_count < frames_per_episode:
+        current_state = knight.get_state(player)
+        action = knight.sarsa.get_action(current_state, knight.action_mask())
+        # Committed as in training, so knight.update plays it rather than drawing again
+        knight.repeat.begin(current_state, action)
+
+        previous_health = knight.health
+        knight.act(action, player, tile_map)
+        player.update(knight, tile_map)
+        knight.update(player, tile_map)
+
+        total_reward += knight_reward(knight, player, previous_health, weights)
+
+        frame_count += 1
+
+        if not player.alive or not knight.alive:
+            break
+
+    return total_reward
+
+
+def run_enemy_eval_episode(enemy, player, tile_map, frames_per_episode, weights):
+    enemy.reset()
+    player.reset()
+    total_reward = 0
+    frame_count = 0
+
+    while frame_count < frames_per_episode:
+        current_state = enemy.get_state(player)
+        action = enemy.sarsa.get_action(current_state, enemy.action_mask())
+        # Committed as in training, so enemy.update plays it rather than drawing again
+        enemy.repeat.begin(current_state, action)
+        enemy.act(action, tile_map)
+        player.make_decision(enemy)
+
+        previous_health = enemy.health
+        player.update(enemy, tile_map)
+        enemy.update(player, tile_map)
+        hit_player, killed_player = enemy.check_arrow_hit(player)
+
+        total_reward += enemy_reward(enemy, player, previous_health, hit_player, killed_player, weights)
+
+        frame_count += 1
+
+        if not player.alive or not enemy.alive:
+            break
+
+    return total_reward
+
+
+def knight_checkpoint_path(q_table_number):
+    return f'knight_q_tables/q_table_episode_{q_table_number}.json'
+
+
+def latest_knight_checkpoint():
+    # Same "latest file" rule SARSA.load_q_table uses; 0 means no checkpoint yet
+    q_table_files = glob.glob('knight_q_tables/*.json')
+    if not q_table_files:
+        return 0
+    latest_file = max(q_table_files, key=os.path.getctime)
+    return int(latest_file.split('_')[-1].split('.')[0])
+
+
+# Per-process arena for checkpoint evaluation, built once by the pool initializer
+_eval_arena = None
+_eval_profiler = None
+_eval_episodes = 0
+
+
+def _init_eval_worker():
+    global _eval_arena, _eval_profiler
+    tile_map = TileMap()
+    # Every task installs its checkpoint's table, so skip loading the latest one here
+    knight = Knight(500, SCREEN_HEIGHT - 72, sarsa=SARSA("knight", load=False))
+    player = AIPlayer(250, SCREEN_HEIGHT - 50)
+    _eval_arena = (tile_map, knight, player)
+    _eval_profiler = Profiler.from_env("eval")
+    if _eval_profiler:
+        from multiprocessing.util import Finalize
+
+        # Pool workers skip atexit, so flush a window that is still open on shutdown
+        Finalize(_eval_profiler, _eval_profiler.close, exitpriority=10)
+
+
+def _evaluate_knight_checkpoint(task):
+    global _eval_episodes
+    q_table_number, first_episode, last_episode, frames_per_episode, seed, scenario = task
+    if _eval_arena is None:
+        _init_eval_worker()
+    tile_map, knight, player = _eval_arena
+
+    if q_table_number == 0:
+        knight.sarsa.q_table = {}  # Empty q_table
+        knight.sarsa.epsilon = 1  # Fully random actions
+    else:
+        q_table_file = knight_checkpoint_path(q_table_number)
+        if not os.path.exists(q_table_file):
+            return q_table_number, first_episode, None
+        with open(q_table_file, 'r') as f:
+            knight.sarsa.q_table = json.load(f)
+        knight.sarsa.epsilon = 0  # Greedy policy
+
+    rewards = []
+    for episode in range(first_episode, last_episode):
+        if _eval_profiler:
+            _eval_profiler.episode(_eval_episodes)
+        _eval_episodes += 1
+        # Seed every episode on its own so results do not depend on scheduling,
+        # and share the seeds across checkpoints so their curves are comparable
+        random.seed(f"{seed}:{episode}")
+        rewards.append(run_knight_eval_episode(knight, player, tile_map, frames_per_episode, KNIGHT_REWARDS[scenario]))
+    return q_table_number, first_episode, rewards
+
+
+def _headless_pool(workers, initializer=None, initargs=()):
+    from multiprocessing import Pool
+
+    # Workers re-import this module, which opens a display; keep them offscreen
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    return Pool(workers, initializer=initializer, initargs=initargs)
+
+
+EVAL_CACHE_DIR = 'eval_cache'
+# Bump whenever run_knight_eval_episode changes what it plays, so cached
+# rewards from an older policy or episode loop are never reused
+EVAL_VERSION = 4  # 2: greedy actions honour Knight.action_mask, 3: one action per frame as in training,
+                 # 4: the mask also covers block during the shield cooldown and attack while blocking
+
+
+def _file_sha256(path):
+    import hashlib
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def eval_cache_key(q_table_number, frames_per_episode, seed, scenario):
+    import hashlib
+
+    if q_table_number == 0:
+        checkpoint = "random_policy"
+    else:
+        q_table_file = knight_checkpoint_path(q_table_number)
+        if not os.path.exists(q_table_file):
+            return None
+        checkpoint = _file_sha256(q_table_file)
+
+    params = {
+        "checkpoint": checkpoint,
+        "frames_per_episode": frames_per_episode,
+        "seed": seed,
+        "scenario": scenario,
+        "weights": KNIGHT_REWARDS[scenario],
+        "eval_version": EVAL_VERSION,
+    }
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+def load_eval_cache(cache_dir, key):
+    path = os.path.join(cache_dir, f'{key}.json')
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)["rewards"]
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Ignoring unreadable cache entry {path}: {e}")
+        return []
+
+
+def save_eval_cache(cache_dir, key, q_table_number, rewards):
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    path = os.path.join(cache_dir, f'{key}.json')
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({"q_table_number": q_table_number, "rewards": rewards}, f)
+    os.replace(tmp_path, path)
+
+
+def evaluate_knight_checkpoints(q_table_numbers, num_episodes=100, frames_per_episode=1000, seed=0,
+                                scenario="performance", workers=None, cache_dir=EVAL_CACHE_DIR):
+    """
+    Evaluate knight checkpoints in a process pool.
+    Returns a (len(q_table_numbers), num_episodes) array of episode rewards,
+    with NaN rows for checkpoints whose file is missing.
+    Rewards are cached on disk by checkpoint content, seed and scenario, so only
+    new checkpoints and episodes beyond the cached ones are simulated.
+    workers=0 runs everything in the current process, cache_dir=None disables the cache.
+    """
     import numpy as np
 
-    q_table_numbers = list(range(0, 50001, 100))
-    x_data = []
-    y_data = []
+    rewards = np.full((len(q_table_numbers), num_episodes), np.nan)
+    rows = {number: row for row, number in enumerate(q_table_numbers)}
+    keys = {}
+    cached = {}
+    tasks = []
+
+    for q_table_number in q_table_numbers:
+        first_episode = 0
+        if cache_dir is not None:
+            key = eval_cache_key(q_table_number, frames_per_episode, seed, scenario)
+            if key is not None:
+                keys[q_table_number] = key
+                cached[q_table_number] = load_eval_cache(cache_dir, key)
+                first_episode = min(len(cached[q_table_number]), num_episodes)
+                rewards[rows[q_table_number], :first_episode] = cached[q_table_number][:first_episode]
+        if first_episode < num_episodes:
+            tasks.append((q_table_number, first_episode, num_episodes, frames_per_episode, seed, scenario))
+
+    print(f"Evaluating {len(tasks)} of {len(q_table_numbers)} checkpoints ({len(q_table_numbers) - len(tasks)} cached)")
+
+    if not tasks:
+        results = []
+        pool = None
+    elif workers == 0:
+        results = map(_evaluate_knight_checkpoint, tasks)
+        pool = None
+    else:
+        pool = _headless_pool(workers, initializer=_init_eval_worker)
+        results = pool.imap_unordered(_evaluate_knight_checkpoint, tasks)
+
+    try:
+        for q_table_number, first_episode, episode_rewards in results:
+            if episode_rewards is None:
+                print(f"Q-table file {knight_checkpoint_path(q_table_number)} not found. Skipping.")
+                continue
+            row = rows[q_table_number]
+            rewards[row, first_episode:first_episode + len(episode_rewards)] = episode_rewards
+            if q_table_number in keys:
+                save_eval_cache(cache_dir, keys[q_table_number], q_table_number,
+                                cached[q_table_number][:first_episode] + episode_rewards)
+            print(f"Average reward for q_table {q_table_number}: {np.mean(rewards[row]):.2f}", flush=True)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return rewards
+
+
+def available_knight_checkpoints():
+    numbers = []
+    for q_table_file in glob.glob('knight_q_tables/q_table_episode_*.json'):
+        try:
+            numbers.append(int(q_table_file.split('_')[-1].split('.')[0]))
+        except ValueError:
+            continue
+    return sorted(numbers)
+
+
+def adaptive_knight_learning_curve(coarse_points=11, min_episodes=20, max_episodes=320, error_budget=5.0,
+                                   frames_per_episode=1000, seed=0, scenario="performance", workers=None,
+                                   cache_dir=EVAL_CACHE_DIR, max_rounds=20):
+    """
+    Estimate the knight learning curve to within error_budget (reward units).
+    Starts from a coarse grid over the saved checkpoints, doubles the episodes of
+    checkpoints whose 95% confidence half-width exceeds the budget and inserts
+    checkpoints between neighbours whose mean rewards differ by more than it.
+    Relies on the evaluation cache to extend checkpoints instead of re-running them.
+    If max_rounds runs out first, the last round's targets are still evaluated
+    and a warning says the budget was not met.
+    Returns (checkpoints, means, half_widths, episodes) as NumPy arrays.
+    """
+    import numpy as np
+
+    # Checkpoint 0 is the random policy, the rest are whatever exists on disk
+    candidates = [0] + [number for number in available_knight_checkpoints() if number > 0]
+    coarse = np.unique(np.linspace(0, len(candidates) - 1, min(coarse_points, len(candidates))).round().astype(int))
+    episodes = {int(i): min_episodes for i in coarse}
+    stats = {}
+
+    def evaluate_pending():
+        # Evaluate everything whose episode target moved, grouped by episode count
+        pending = {}
+        for i, n in episodes.items():
+            if stats.get(i) is None or stats[i][2] < n:
+                pending.setdefault(n, []).append(i)
+        for n, indices in pending.items():
+            rewards = evaluate_knight_checkpoints([candidates[i] for i in indices], num_episodes=n,
+                                                  frames_per_episode=frames_per_episode, seed=seed,
+                                                  scenario=scenario, workers=workers, cache_dir=cache_dir)
+            for i, row in zip(indices, rewards):
+                if np.isnan(row).any():
+                    stats[i] = None
+                    continue
+                half_width = 1.96 * row.std(ddof=1) / math.sqrt(n) if n > 1 else float('inf')
+                stats[i] = (row.mean(), half_width, n)
+
+        for i in [i for i in episodes if stats.get(i) is None]:
+            del episodes[i]
+
+    for round_number in range(max_rounds):
+        evaluate_pending()
+
+        changed = False
+        # More episodes where the confidence interval is too wide
+        for i, (mean, half_width, n) in ((i, stats[i]) for i in episodes):
+            if half_width > error_budget and n < max_episodes:
+                episodes[i] = min(n * 2, max_episodes)
+                changed = True
+
+        # More checkpoints where the curve moves faster than the budget
+        indices = sorted(episodes)
+        for left, right in zip(indices, indices[1:]):
+            if right - left > 1 and abs(stats[right][0] - stats[left][0]) > error_budget:
+                middle = (left + right) // 2
+                if middle not in episodes:
+                    episodes[middle] = min_episodes
+                    changed = True
+
+        evaluated = sum(stats[i][2] for i in episodes if i in stats)
+        print(f"Adaptive round {round_number + 1}: {len(episodes)} checkpoints, {evaluated} episodes", flush=True)
+        if not changed:
+            break
+    else:
+        # Out of rounds: evaluate the last round's new checkpoints and doubled episode counts
+        evaluate_pending()
+        print(f"Warning: stopped after {max_rounds} rounds, the curve may not be within error_budget={error_budget}",
+              flush=True)
+
+    indices = sorted(i for i in episodes if i in stats)
+    checkpoints = np.array([candidates[i] for i in indices])
+    means = np.array([stats[i][0] for i in indices])
+    half_widths = np.array([stats[i][1] for i in indices])
+    episode_counts = np.array([stats[i][2] for i in indices])
+    return checkpoints, means, half_widths, episode_counts
+
+
+def test_knight_performance(adaptive=False):
+    import matplotlib.pyplot as plt
+    import numpy as np
 
     frames_per_episode = 1000  # Number of frames per episode
 
-    for q_table_number in q_table_numbers:
-        total_rewards = []
-        print(f"Testing q_table_number: {q_table_number}")
+    if adaptive:
+        x_array, y_array, half_widths, _ = adaptive_knight_learning_curve(frames_per_episode=frames_per_episode)
+        plt.figure(figsize=(10, 6))
+        plt.errorbar(x_array, y_array, yerr=half_widths, fmt='o', alpha=0.5)
+        plt.ylabel('Average Reward (95% CI)')
+    else:
+        q_table_numbers = list(range(0, 50001, 100))
+        num_episodes = 100
+        group = 10  # Episodes per plotted average
 
-        # Initialize tile_map, knight, player
-        tile_map = TileMap()
-        knight = Knight(500, SCREEN_HEIGHT - 72)
-        player = AIPlayer(250, SCREEN_HEIGHT - 50)
+        rewards = evaluate_knight_checkpoints(q_table_numbers, num_episodes=num_episodes, frames_per_episode=frames_per_episode)
 
-        # Initialize knight's SARSA
-        if q_table_number == 0:
-            knight.sarsa = SARSA(character_type="knight")
-            knight.sarsa.q_table = {}  # Empty q_table
-            knight.sarsa.epsilon = 1  # Fully random actions
-        else:
-            knight.sarsa = SARSA(character_type="knight")
-            # Load q_table from file
-            q_table_file = f'knight_q_tables/q_table_episode_{q_table_number}.json'
-            if not os.path.exists(q_table_file):
-                print(f"Q-table file {q_table_file} not found. Skipping.")
-                continue
-            with open(q_table_file, 'r') as f:
-                knight.sarsa.q_table = json.load(f)
-            knight.sarsa.epsilon = 0  # Greedy policy
-
-        # Run 100 episodes
-        for episode in range(100):
-            knight.reset()
-            player.reset()
-            total_reward = 0
-            frame_count = 0
-
-            while frame_count < frames_per_episode:
-                current_state = knight.get_state(player)
-                action = knight.sarsa.get_action(current_state)
+        # Compute average rewards every 10 episodes, dropping missing checkpoints
+        # and the episodes that do not fill a whole group
+        found = ~np.isnan(rewards).any(axis=1)
+        groups = num_episodes // group
+        avg_rewards_10 = rewards[found, :groups * group].reshape(-1, groups, group).mean(axis=2)
+        x_array = np.repeat(np.array(q_table_numbers)[found], groups)
+        y_array = avg_rewards_10.ravel()
+
+        # Now plot the results
+        plt.figure(figsize=(10, 6))
+        plt.scatter(x_array, y_array, alpha=0.5)
+        plt.ylabel('Average Reward over 10 Episodes')
 
-                previous_health = knight.health
-                knight.act(action, player, tile_map)
-                player.update(knight, tile_map)
-                knight.update(player, tile_map)
-                dx = player.rect.x - knight.rect.x
-
-                # Calculate reward
-                reward = 0
-                if knight.just_attacked:
-                    reward -= 10
-                    knight.just_attacked = False
-
-                if abs(dx) < 100:
-                    reward += 0.01
-                if knight.hit_player:
-                    reward += 40
-                    if knight.killed_player:
-                        reward += 100
-                if knight.health < previous_health:
-                    reward -= 40
-                if knight.blocking and knight.shield_used and knight.is_facing_player():
-                    reward += 30
-                if knight.health == 0 and not knight.death_penalty_applied:
-                    reward -= 100
-                    knight.death_penalty_applied = True
-
-                total_reward += reward
-
-                frame_count += 1
-
-                if not player.alive or not knight.alive:
-                    break
-
-            total_rewards.append(total_reward)
-
-        # Compute average rewards every 10 episodes
-        avg_rewards_10 = []
-        for i in range(0, 100, 10):
-            avg = sum(total_rewards[i:i+10]) / 10
-            avg_rewards_10.append(avg)
-
-        # Append data
-        x_data.extend([q_table_number]*10)
-        y_data.extend(avg_rewards_10)
-
-        print(f"Average reward for q_table {q_table_number}: {sum(total_rewards)/len(total_rewards):.2f}")
-
-    # Now plot the results
-    plt.figure(figsize=(10, 6))
-    plt.scatter(x_data, y_data, alpha=0.5)
     plt.xlabel('Training Episodes')
-    plt.ylabel('Average Reward over 10 Episodes')
     plt.title('Knight Performance over Training')
     plt.grid(True)
 
-    # Add logarithmic trend line
-    x_array = np.array(x_data)
-    y_array = np.array(y_data)
-
     # Exclude q_table_number == 0 from trendline calculation
     mask = x_array > 0
     x_array = x_array[mask]
     y_array = y_array[mask]
 
+    # Add logarithmic trend line
     coefficients = np.polyfit(np.log(x_array), y_array, 1)
     trendline = coefficients[0] * np.log(x_array) + coefficients[1]
     plt.plot(x_array, trendline, label='Logarithmic Trendline', color='red')
@@ -2999,139 +5248,930 @@ def test_knight_performance():
 
     plt.show()
 
-def test():
-    import pandas as pd
-    from openpyxl import load_workbook
-    import os
+RESULTS_DIR = 'results'
+LEGACY_RESULTS_EXCEL = 'knight_training_rewards.xlsx'  # Written by test() before the store existed
 
-    excel_file = 'knight_training_rewards.xlsx'
-    
-    # Load existing data or create new DataFrame
-    if os.path.exists(excel_file):
-        try:
-            df = pd.read_excel(excel_file)
-            # Find the first empty column
-            next_col = len(df.columns)
-            column_name = f'Run_{next_col + 1}'
-        except Exception as e:
-            print(f"Error reading existing Excel file: {e}")
-            df = pd.DataFrame()
-            column_name = 'Run_1'
-    else:
-        df = pd.DataFrame()
-        column_name = 'Run_1'
-
-    rewards_list = []  # Store rewards for this run
-
-    tile_map = TileMap()
-    knight = Knight(500, SCREEN_HEIGHT - 72)
-    player = AIPlayer(250, SCREEN_HEIGHT - 50)
 
+class ResultsStore:
+    """
+    Append-only store of evaluation runs.
+    Each run's per-episode rewards go to their own little-endian float64 file and
+    one JSON line of metadata is appended to index.jsonl, so adding a run costs the
+    same no matter how many runs are already stored.
+    """
+    def __init__(self, folder=RESULTS_DIR):
+        self.folder = folder
+        self.index_file = os.path.join(folder, 'index.jsonl')
+
+    def append_run(self, rewards, **metadata):
+        from array import array
+        import uuid
+
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        values = array('d', rewards)
+        if sys.byteorder == 'big':
+            values.byteswap()
+        filename = f'run_{run_id}.f64'
+        with open(os.path.join(self.folder, filename), 'xb') as f:
+            values.tofile(f)
+
+        entry = dict(metadata, run_id=run_id, created=time.time(), num_episodes=len(values), file=filename)
+        with open(self.index_file, 'a') as f:
+            f.write(json.dumps(entry) + "\n")
+        return run_id
+
+    def runs(self):
+        if not os.path.exists(self.index_file):
+            return []
+        with open(self.index_file, 'r') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def load_rewards(self, run):
+        from array import array
+
+        values = array('d')
+        with open(os.path.join(self.folder, run["file"]), 'rb') as f:
+            values.frombytes(f.read())
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return values.tolist()
+
+    def import_excel(self, excel_file=LEGACY_RESULTS_EXCEL):
+        """
+        Append each Run_ column of a legacy rewards workbook as a run.
+        Columns already imported from the same file are skipped, so this is safe to call again.
+        """
+        import pandas as pd
+
+        if not os.path.exists(excel_file):
+            return 0
+        source = os.path.abspath(excel_file)
+        imported = {run.get("column") for run in self.runs() if run.get("imported_from") == source}
+        df = pd.read_excel(excel_file)
+        count = 0
+        for column in df.columns:
+            if column in imported:
+                continue
+            self.append_run(df[column].dropna().tolist(), agent="knight", scenario="test",
+                            imported_from=source, column=column)
+            count += 1
+        print(f"Imported {count} runs from {excel_file}")
+        return count
+
+    def export_excel(self, excel_file=None):
+        # Defaults to a file inside the store, the legacy workbook is only ever read by import_excel
+        import pandas as pd
+
+        if excel_file is None:
+            excel_file = os.path.join(self.folder, 'rewards.xlsx')
+        if os.path.abspath(excel_file) == os.path.abspath(LEGACY_RESULTS_EXCEL):
+            raise ValueError(f"Refusing to overwrite {LEGACY_RESULTS_EXCEL}, import it with import_excel instead")
+        columns = {f'Run_{i + 1}': pd.Series(self.load_rewards(run)) for i, run in enumerate(self.runs())}
+        pd.DataFrame(columns).to_excel(excel_file, index=False)
+        print(f"Rewards exported to {excel_file}")
+
+
+def test(export_excel=False):
     num_episodes = 100 
     frames_per_episode = 30 * 60  # 60 seconds at 60 FPS
-    FULL_RESET_INTERVAL = 50000
 
     start_time = time.time()
-    last_epsilon = knight.sarsa.epsilon
 
-    for episode in range(num_episodes):
-        if episode % FULL_RESET_INTERVAL == 0 and episode > 0:
-            last_epsilon = knight.sarsa.epsilon
-            del knight
+    # Evaluate the latest knight checkpoint with the greedy policy. Every run is
+    # a fresh sample, so draw a new seed and bypass the cache, which would
+    # otherwise replay the same episodes and store them as another run.
+    q_table_number = latest_knight_checkpoint()
+    seed = random.getrandbits(32)
+    print(f"Testing q_table_number: {q_table_number} (seed {seed})")
+    rewards = evaluate_knight_checkpoints([q_table_number], num_episodes=num_episodes,
+                                          frames_per_episode=frames_per_episode, seed=seed, scenario="test",
+                                          workers=0, cache_dir=None)
+    rewards_list = rewards[0].tolist()  # Store rewards for this run
+
+    for episode, episode_reward in enumerate(rewards_list):
+        print(f"Episode {episode + 1}: Reward: {episode_reward:.2f}")
+
+    print("Testing complete")
+
+    store = ResultsStore()
+    run_id = store.append_run(rewards_list, agent="knight", q_table_number=q_table_number, scenario="test",
+                              frames_per_episode=frames_per_episode, seed=seed)
+    print(f"Rewards saved to {store.folder} as run {run_id}")
+
+    if export_excel:
+        store.import_excel()
+        store.export_excel()
+
+    total_time = (time.time() - start_time) / 60
+    print(f"\nTotal testing time: {total_time:.2f} minutes")
+
+BENCHMARK_SCENARIOS = {
+    "knight": train_knight_fast,
+    "enemy": train_enemy_fast,
+    "bird_and_enemy": train_bird_and_enemy_fast,
+    "bird_with_knight_and_enemy": train_bird_with_knight_and_enemy_fast,
+}
+
+
+def _run_benchmark_scenario(task):
+    import tempfile
+    import shutil
+
+    name, frames, seed = task
+    # Keep the benchmark's metrics out of the real metrics folder
+    folder = tempfile.mkdtemp()
+    try:
+        metrics = MetricsSink(name, folder=folder, summary_interval=0)
+        stats = BENCHMARK_SCENARIOS[name](num_episodes=sys.maxsize, max_frames=frames, save=False, seed=seed,
+                                          metrics=metrics)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    stats["peak_rss_bytes"] = peak_rss_bytes()
+    return name, stats
+
+
+def compare_benchmarks(report, baseline, tolerance=0.05):
+    ratios = {}
+    for name, stats in report["scenarios"].items():
+        if name not in baseline.get("scenarios", {}):
+            print(f"{name}: no baseline")
+            continue
+        ratio = stats["frames_per_sec"] / max(baseline["scenarios"][name]["frames_per_sec"], 1e-9)
+        ratios[name] = ratio
+        verdict = "REGRESSION" if ratio < 1 - tolerance else ("faster" if ratio > 1 + tolerance else "same")
+        print(f"{name}: {ratio:.3f}x baseline frames/sec ({verdict})")
+    return ratios
+
+
+def benchmark_scenarios(frames=20000, seed=0, scenarios=None, output=None, baseline=None, tolerance=0.05):
+    """
+    Run each training scenario headless for a fixed number of frames and report
+    frames/sec, decisions/sec, Q-updates/sec, peak RSS and Q-table sizes as JSON.
+    Every scenario runs in its own process so peak RSS is not shared.
+    Pass baseline (a path to an earlier report) to compare against it.
+    """
+    results = {}
+    for name in scenarios or BENCHMARK_SCENARIOS:
+        pool = _headless_pool(1)
+        try:
+            _, stats = pool.apply(_run_benchmark_scenario, ((name, frames, seed),))
+        finally:
+            pool.close()
+            pool.join()
+        results[name] = stats
+        print(f"{name}: {stats['frames_per_sec']:.0f} frames/s, {stats['decisions_per_sec']:.0f} decisions/s, "
+              f"{stats['updates_per_sec']:.0f} updates/s, peak RSS {stats['peak_rss_bytes']}", flush=True)
+
+    report = {"frames": frames, "seed": seed, "python": sys.version.split()[0], "created": time.time(), "scenarios": results}
+    if output is None:
+        if not os.path.exists('benchmarks'):
+            os.makedirs('benchmarks')
+        output = f"benchmarks/throughput_{time.strftime('%Y%m%d-%H%M%S')}.json"
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Benchmark saved as {output}")
+
+    if baseline is not None:
+        with open(baseline, 'r') as f:
+            compare_benchmarks(report, json.load(f), tolerance)
+    return report
+
+def _ns_per_call(func, number=2000, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        for _ in range(number):
+            func()
+        elapsed = (time.perf_counter_ns() - start) / number
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _synthetic_q_table(actions, size):
+    # Bird-shaped state strings; the index suffix lets the table grow past the real state space
+    proximity = ["close", "far", "very_far"]
+    direction = ["right", "left"]
+    distance = ["very_close", "close", "medium", "far"]
+    q_table = {}
+    for i in range(size):
+        state = (f"{proximity[i % 3]}_{direction[i % 2]}_above_shield_inactive_shield_ready_"
+                 f"{distance[i % 4]}_{distance[(i // 4) % 4]}_idle_idle_{i}")
+        q_table[state] = {a: random.random() for a in actions}
+    return q_table
+
+
+def microbenchmark_sarsa(sizes=(0, 1000, 10000, 100000, 1000000), character_type="bird", io_max_states=100000,
+                         output=None, plot=False):
+    """
+    Time the SARSA primitives and the per-frame encoders in nanoseconds per call.
+    The SARSA primitives are timed at every Q-table size in sizes to show how
+    lookup cost scales; save/load are skipped above io_max_states.
+    """
+    import tempfile
+    import shutil
+
+    folder = tempfile.mkdtemp()
+    results = {"character_type": character_type, "sarsa": {}, "encoders": {}}
+    try:
+        for size in sizes:
+            sarsa = SARSA(character_type=character_type, q_table_folder=folder)
+            sarsa.epsilon = 0.1
+            sarsa.q_table = _synthetic_q_table(sarsa.actions, size)
+            states = list(sarsa.q_table) or ["empty_state"]
+            picks = [random.choice(states) for _ in range(1024)]
+            counter = iter(range(sys.maxsize))
+
+            def pick():
+                return picks[next(counter) & 1023]
+
+            timings = {
+                "get_action": _ns_per_call(lambda: sarsa.get_action(pick())),
+                "get_best_action": _ns_per_call(lambda: sarsa.get_best_action(pick())),
+                "update_q_table": _ns_per_call(lambda: sarsa.update_q_table(pick(), sarsa.actions[0], 1.0, pick(), sarsa.actions[1])),
+                "get_action_new_state": _ns_per_call(lambda: sarsa.get_action(f"unseen_{next(counter)}"), number=500),
+            }
+            if size <= io_max_states:
+                for old_file in glob.glob(f'{folder}/*.json'):
+                    os.remove(old_file)
+                timings["save_q_table"] = _ns_per_call(sarsa.save_q_table, number=1, repeat=1)
+                timings["load_q_table"] = _ns_per_call(sarsa.load_q_table, number=1, repeat=1)
+            results["sarsa"][size] = timings
+            print(f"{size} states: " + ", ".join(f"{name} {ns / 1e3:.2f} us" for name, ns in timings.items()), flush=True)
+            del sarsa, states
             gc.collect()
-            knight = Knight(500, SCREEN_HEIGHT - 72)
-            knight.sarsa.epsilon = last_epsilon
-            print(f"Performed full reset at episode {episode}, continuing with epsilon {last_epsilon:.6f}")
-        
-        knight.reset()
-        player.reset()
-        frame_count = 0
-        episode_reward = 0
-        
-        while frame_count < frames_per_episode:
-            current_state = knight.get_state(player)
-            action = knight.sarsa.get_action(current_state)
-            
-            previous_health = knight.health
-            knight.act(action, player, tile_map)
-            player.update(knight, tile_map)
-            knight.update(player, tile_map)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
 
-            # Calculate reward
-            dx = player.rect.x - knight.rect.x
+    tile_map = TileMap()
+    player = AIPlayer(250, SCREEN_HEIGHT - 50)
+    knight = Knight(500, SCREEN_HEIGHT - 72)
+    enemy = Enemy(600, SCREEN_HEIGHT - 50)
+    bird = Bird(400, SCREEN_HEIGHT - 100)
+    character = Character(300, SCREEN_HEIGHT - 100)
+    arrow = Arrow(300, 300, 1)
+
+    def move_character():
+        character.rect.x = 300
+        character.move(3, tile_map)
+
+    def fly_arrow():
+        arrow.rect.center = (300, 300)
+        arrow.vel_y = 0
+        arrow.stopped = False
+        arrow.update()
+
+    results["encoders"] = {
+        "knight.get_state": _ns_per_call(lambda: knight.get_state(player)),
+        "enemy.get_state": _ns_per_call(lambda: enemy.get_state(player)),
+        "bird.get_state": _ns_per_call(lambda: bird.get_state(player, knight=knight, enemy=enemy)),
+        "character.move": _ns_per_call(move_character),
+        "character.update": _ns_per_call(lambda: character.update(tile_map)),
+        "arrow.update": _ns_per_call(fly_arrow, number=500),
+    }
+    for name, ns in results["encoders"].items():
+        print(f"{name}: {ns / 1e3:.2f} us")
+
+    if output is None:
+        if not os.path.exists('benchmarks'):
+            os.makedirs('benchmarks')
+        output = f"benchmarks/micro_{time.strftime('%Y%m%d-%H%M%S')}.json"
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Micro-benchmarks saved as {output}")
+
+    if plot:
+        import matplotlib.pyplot as plt
+
+        plt.figure(figsize=(10, 6))
+        table_sizes = sorted(results["sarsa"])
+        for primitive in ("get_action", "get_best_action", "update_q_table", "get_action_new_state"):
+            plt.plot([max(size, 1) for size in table_sizes],
+                     [results["sarsa"][size][primitive] / 1e3 for size in table_sizes], marker='o', label=primitive)
+        plt.xscale('log')
+        plt.xlabel('Q-table states')
+        plt.ylabel('Microseconds per call')
+        plt.title(f'SARSA primitive scaling ({character_type})')
+        plt.grid(True)
+        plt.legend()
+        plt.show()
+    return results
+
+
+TRAINING_SCENARIOS = {
+    # name: (trainer, learning agent, frozen agents loaded from their latest Q-table)
+    "knight": (train_knight_fast, "knight", ()),
+    "enemy": (train_enemy_fast, "enemy", ()),
+    "bird_with_knight": (train_bird_with_knight_fast, "bird", ("knight",)),
+    "bird_and_enemy": (train_bird_and_enemy_fast, "bird", ("enemy",)),
+    "bird_with_knight_and_enemy": (train_bird_with_knight_and_enemy_fast, "bird", ("knight", "enemy")),
+}
+
+# The bird jobs share bird_q_tables, so they run one after the other
+TRAINING_CURRICULUM = [
+    {"scenario": "knight"},
+    {"scenario": "enemy"},
+    {"scenario": "bird_with_knight", "after": {"knight": 50000}},
+    {"scenario": "bird_and_enemy", "after": {"enemy": 50000, "bird_with_knight": None}},
+    {"scenario": "bird_with_knight_and_enemy", "after": {"knight": 100000, "enemy": 100000, "bird_and_enemy": None}},
+]
+
+
+def checkpoint_episodes(character_type, q_table_folder=None):
+    # Latest checkpoint episode of any learner (.json or .npz) in the folder, the character's default one if None
+    folder = q_table_folder or Q_TABLE_FOLDERS[character_type]
+    episodes = []
+    for path in glob.glob(f'{folder}/q_table_episode_*'):
+        number, _, suffix = os.path.basename(path)[len('q_table_episode_'):].partition('.')
+        if suffix in ("json", "npz") and number.isdigit():
+            episodes.append(int(number))
+    return max(episodes, default=0)
+
+
+def _run_training_job(scenario, kwargs):
+    trainer = TRAINING_SCENARIOS[scenario][0]
+    trainer(**kwargs)
+
+
+def schedule_training(jobs=TRAINING_CURRICULUM, workers=None, reload_frozen=1000, poll_interval=5.0):
+    """
+    Run a curriculum of training jobs, each in its own headless process.
+    Every job is a dict with a "scenario" from TRAINING_SCENARIOS and optional
+    "name" (defaults to the scenario), "kwargs" for the trainer and "after",
+    mapping job names to the checkpoint episode they must reach first (None
+    waits for the job to finish). Jobs with frozen agents reload their latest
+    Q-tables every reload_frozen episodes while their dependencies keep training.
+    Progress is read from each dependency's own q_table_folder, and a job
+    inherits its dependencies' folders, for its frozen agents and, when a
+    dependency trains the same character, for its own learner.
+    Returns the exit code of every job, None for jobs skipped after a failure.
+    """
+    from multiprocessing import Process
+
+    pending = {}
+    for job in jobs:
+        name = job.get("name", job["scenario"])
+        if job["scenario"] not in TRAINING_SCENARIOS:
+            raise ValueError(f"Unknown training scenario: {job['scenario']}")
+        if name in pending:
+            raise ValueError(f"Duplicate training job: {name}")
+        pending[name] = job
+    for name, job in pending.items():
+        for dependency in job.get("after", {}):
+            if dependency not in pending:
+                raise ValueError(f"Job {name} depends on unknown job {dependency}")
+
+    workers = workers or os.cpu_count() or 1
+    # Children re-import this module, which opens a display; keep them offscreen
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    jobs_by_name = dict(pending)
+    running = {}
+    exit_codes = {}
+
+    def blocked(job):
+        for dependency, episodes in job.get("after", {}).items():
+            if dependency in exit_codes:
+                if exit_codes[dependency] != 0:
+                    return None
+                continue
+            if episodes is None or checkpoint_episodes(learner_of(dependency), folder_of(dependency)) < episodes:
+                return True
+        return False
 
-            reward = 0
-            if knight.just_attacked:
-                reward -= 10
-                knight.just_attacked = False
+    def learner_of(name):
+        return TRAINING_SCENARIOS[jobs_by_name[name]["scenario"]][1]
+
+    def folder_of(name, seen=()):
+        # The job's own q_table_folder, else that of a dependency training the same character
+        job = jobs_by_name[name]
+        folder = job.get("kwargs", {}).get("q_table_folder")
+        if folder:
+            return folder
+        for dependency in job.get("after", {}):
+            if learner_of(dependency) == learner_of(name) and dependency not in seen:
+                return folder_of(dependency, seen + (name,))
+        return Q_TABLE_FOLDERS[learner_of(name)]
+
+    def job_kwargs(name):
+        job = jobs_by_name[name]
+        kwargs = dict(job.get("kwargs", {}))
+        kwargs["q_table_folder"] = folder_of(name)
+        frozen = TRAINING_SCENARIOS[job["scenario"]][2]
+        frozen_folders = dict(kwargs.get("frozen_folders") or {})
+        for dependency in job.get("after", {}):
+            if learner_of(dependency) in frozen:
+                frozen_folders.setdefault(learner_of(dependency), folder_of(dependency))
+        if frozen:
+            kwargs.setdefault("reload_frozen", reload_frozen)
+            kwargs["frozen_folders"] = frozen_folders
+        return kwargs
+
+    while pending or running:
+        for name, job in list(pending.items()):
+            state = blocked(job)
+            if state is None:
+                print(f"Skipping {name}: a dependency failed", flush=True)
+                exit_codes[name] = None
+                del pending[name]
+            elif not state and len(running) < workers:
+                process = Process(target=_run_training_job, args=(job["scenario"], job_kwargs(name)), name=name)
+                process.start()
+                print(f"Started {name} (pid {process.pid})", flush=True)
+                running[name] = process
+                del pending[name]
+
+        for name, process in list(running.items()):
+            if not process.is_alive():
+                process.join()
+                exit_codes[name] = process.exitcode
+                print(f"Finished {name} with exit code {process.exitcode}", flush=True)
+                del running[name]
+
+        if pending and not running and all(blocked(job) for job in pending.values()):
+            raise RuntimeError(f"Training jobs can never start: {', '.join(pending)}")
+        if pending or running:
+            time.sleep(poll_interval)
+    return exit_codes
+
+
+SWEEP_DIR = 'sweeps'
+SWEEP_SARSA_PARAMS = ("alpha", "gamma", "epsilon", "epsilon_decay", "epsilon_min", "trace_decay", "planning_steps", "target")
+
+SWEEP_SCENARIOS = {
+    # name: (trainer, reward weights, greedy evaluation episode)
+    "knight": (train_knight_fast, KNIGHT_REWARDS, run_knight_eval_episode),
+    "enemy": (train_enemy_fast, ENEMY_REWARDS, run_enemy_eval_episode),
+}
+
+_sweep_arenas = {}
+
+
+def sample_configs(space, method="grid", num_trials=20, seed=0):
+    if method == "grid":
+        names = list(space)
+        return [dict(zip(names, values)) for values in itertools.product(*(space[name] for name in names))]
+    if method != "random":
+        raise ValueError(f"Unknown search method: {method}")
+
+    rng = random.Random(seed)
+    configs = []
+    for _ in range(num_trials):
+        config = {}
+        for name, values in space.items():
+            if isinstance(values, list):
+                config[name] = rng.choice(values)
+            elif len(values) == 3 and values[2] == "log":
+                config[name] = math.exp(rng.uniform(math.log(values[0]), math.log(values[1])))
+            else:
+                config[name] = rng.uniform(values[0], values[1])
+        configs.append(config)
+    return configs
 
-            if  abs(dx) > 100:
-                reward -= 0.01
-            if knight.hit_player:
-                reward += 40
-                if knight.killed_player:
-                    reward += 100
-            if knight.health < previous_health:
-                reward -= 40
-            if knight.blocking and knight.shield_used and knight.is_facing_player():
-                reward += 30
-            if knight.health == 0 and not knight.death_penalty_applied:
-                reward -= 100
-                knight.death_penalty_applied = True
-            
-            episode_reward += reward
 
-            next_state = knight.get_state(player)
-            next_action = knight.sarsa.get_action(next_state)
-# Update Q-table
-            #knight.sarsa.update_q_table(current_state, action, reward, next_state, next_action)
+def split_config(config, rewards):
+    sarsa_params = {name: value for name, value in config.items() if name not in rewards["training"]}
+    weights = dict(rewards["training"])
+    weights.update((name, value) for name, value in config.items() if name in rewards["training"])
+    return sarsa_params, weights
 
-            frame_count += 1
 
-            if not player.alive or not knight.alive:
+def _sweep_arena(scenario):
+    if scenario not in _sweep_arenas:
+        tile_map = TileMap()
+        player = AIPlayer(250, SCREEN_HEIGHT - 50)
+        if scenario == "knight":
+            agent = Knight(500, SCREEN_HEIGHT - 72, sarsa=SARSA("knight", q_table_folder=SWEEP_DIR))
+        else:
+            agent = Enemy(500, SCREEN_HEIGHT - 50, sarsa=SARSA("enemy", q_table_folder=SWEEP_DIR))
+        _sweep_arenas[scenario] = (tile_map, agent, player)
+    return _sweep_arenas[scenario]
+
+
+def score_policy(scenario, q_table_folder, eval_episodes=20, frames_per_episode=1000, seed=0):
+    _, rewards, run_episode = SWEEP_SCENARIOS[scenario]
+    tile_map, agent, player = _sweep_arena(scenario)
+    agent.sarsa.q_table_folder = q_table_folder
+    agent.sarsa.q_table = agent.sarsa.load_q_table()
+    agent.sarsa.epsilon = 0  # Greedy policy
+    total = 0
+    for episode in range(eval_episodes):
+        # Shared seeds so every trial meets the same episodes
+        random.seed(f"{seed}:eval:{episode}")
+        total += run_episode(agent, player, tile_map, frames_per_episode, rewards["training"])
+    return total / eval_episodes
+
+
+def _run_sweep_trial(task):
+    import tempfile
+    import shutil
+
+    scenario, trial, config, start, end, eval_episodes, frames_per_episode, seed, folder = task
+    trainer, rewards, _ = SWEEP_SCENARIOS[scenario]
+    sarsa_params, weights = split_config(config, rewards)
+    metrics_folder = tempfile.mkdtemp()
+    try:
+        metrics = MetricsSink(f"trial_{trial}", folder=metrics_folder, summary_interval=0)
+        stats = trainer(num_episodes=end - start, seed=f"{seed}:{trial}:{start}", metrics=metrics,
+                        q_table_folder=folder, sarsa_params=sarsa_params, reward_weights=weights,
+                        save_interval=sys.maxsize)
+    finally:
+        shutil.rmtree(metrics_folder, ignore_errors=True)
+    score = score_policy(scenario, folder, eval_episodes, frames_per_episode, seed)
+    return trial, score, stats["epsilon"][scenario], stats["frames_per_sec"]
+
+
+def sweep_hyperparameters(space, scenario="knight", method="grid", num_trials=20, budgets=(300, 900, 2700), keep=3,
+                          eval_episodes=20, frames_per_episode=1000, workers=None, seed=0, folder=SWEEP_DIR):
+    """
+    Tune SARSA hyperparameters and reward weights with successive halving.
+    space maps each name to a list of values, or for random search to a
+    (low, high) or (low, high, "log") range. SWEEP_SARSA_PARAMS go to the
+    learner, reward names from
+    KNIGHT_REWARDS / ENEMY_REWARDS override the training weights.
+    Each rung trains the surviving trials up to the next episode budget in
+    headless workers, scores their greedy policies on the same seeded episodes
+    with the default weights and keeps the best 1/keep. Every rung is written
+    to results.csv in the sweep folder.
+    """
+    import csv
+
+    if scenario not in SWEEP_SCENARIOS:
+        raise ValueError(f"Unknown sweep scenario: {scenario}")
+    rewards = SWEEP_SCENARIOS[scenario][1]
+    for name in space:
+        if name not in SWEEP_SARSA_PARAMS and name not in rewards["training"]:
+            raise ValueError(f"Unknown hyperparameter: {name}")
+
+    configs = sample_configs(space, method, num_trials, seed)
+    sweep_folder = os.path.join(folder, f"{scenario}_{time.strftime('%Y%m%d-%H%M%S')}")
+    os.makedirs(sweep_folder)
+    pool = _headless_pool(workers) if workers != 0 else None
+
+    survivors = list(range(len(configs)))
+    episodes_done = 0
+    epsilons = {}
+    rows = []
+    try:
+        for rung, budget in enumerate(budgets):
+            tasks = []
+            for trial in survivors:
+                config = dict(configs[trial])
+                if trial in epsilons:
+                    config["epsilon"] = epsilons[trial]  # Continue the decay where the last rung stopped
+                tasks.append((scenario, trial, config, episodes_done, budget, eval_episodes, frames_per_episode, seed,
+                              os.path.join(sweep_folder, f"trial_{trial}")))
+            results = pool.imap_unordered(_run_sweep_trial, tasks) if pool else map(_run_sweep_trial, tasks)
+
+            scores = {}
+            for trial, score, epsilon, frames_per_sec in results:
+                scores[trial] = score
+                epsilons[trial] = epsilon
+                rows.append(dict(trial=trial, rung=rung, episodes=budget, score=score,
+                                 frames_per_sec=round(frames_per_sec), **configs[trial]))
+                print(f"Rung {rung}, trial {trial}: score {score:.2f} after {budget} episodes {configs[trial]}", flush=True)
+
+            episodes_done = budget
+            survivors = sorted(survivors, key=scores.get, reverse=True)[:max(1, math.ceil(len(survivors) / keep))]
+            if len(survivors) == 1:
                 break
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    output = os.path.join(sweep_folder, 'results.csv')
+    with open(output, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=["trial", "rung", "episodes", "score", "frames_per_sec", *space])
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"Sweep results saved as {output}")
+    print(f"Best trial {survivors[0]}: {configs[survivors[0]]}")
+    return rows
+
+
+PBT_SPACES = {
+    "knight": {"alpha": (0.02, 0.5, "log"), "epsilon": (0.01, 0.5, "log"), "hit": (20, 80), "damaged": (-80, -10)},
+    "enemy": {"alpha": (0.02, 0.5, "log"), "epsilon": (0.01, 0.5, "log"), "hit": (20, 100), "near": (-0.5, 0.0)},
+}
+
+
+def _latest_q_table_file(folder):
+    q_table_files = glob.glob(f'{folder}/*.json')
+    return max(q_table_files, key=os.path.getctime) if q_table_files else None
+
+
+def _take_over_q_table(source, destination):
+    # Replace destination's tables with the latest one in source. The copy lands
+    # first, so destination's tables are only removed once it has a new one
+    import shutil
+
+    source_file = _latest_q_table_file(source)
+    if source_file is None:
+        return None
+    copied = shutil.copy(source_file, destination)
+    for path in glob.glob(f'{destination}/*.json'):
+        if path != copied:
+            os.remove(path)
+    return copied
+
+
+def perturb_config(config, rng, factors=(0.8, 1.2)):
+    perturbed = {}
+    for name, value in config.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = value * rng.choice(factors)
+            if name in ("epsilon", "gamma", "epsilon_decay"):
+                value = min(value, 1.0)
+        perturbed[name] = value
+    return perturbed
+
+
+def population_based_training(scenario="knight", population=8, generations=20, interval=500, space=None,
+                              exploit_fraction=0.25, eval_episodes=20, frames_per_episode=1000, workers=None, seed=0,
+                              folder=SWEEP_DIR):
+    """
+    Train a population of knights (or enemies) in parallel and, every interval
+    episodes, replace the weakest exploit_fraction with a copy of the Q-table
+    and settings of a member from the top, with alpha, epsilon and the reward
+    weights perturbed by 0.8x or 1.2x. Members are scored like sweep trials.
+    Every generation is written to pbt.csv; returns the best member's config
+    and its Q-table folder.
+    """
+    import csv
+
+    if scenario not in SWEEP_SCENARIOS:
+        raise ValueError(f"Unknown training scenario: {scenario}")
+    if population < 2:
+        raise ValueError("Population-based training needs at least two members")
+    if not 0 < exploit_fraction <= 0.5:
+        raise ValueError("exploit_fraction must be in (0, 0.5] so parents and replaced members never overlap")
+    space = space or PBT_SPACES[scenario]
+    rng = random.Random(seed)
+    configs = sample_configs(space, "random", population, seed)
+    run_folder = os.path.join(folder, f"pbt_{scenario}_{time.strftime('%Y%m%d-%H%M%S')}")
+    member_folders = [os.path.join(run_folder, f"member_{member}") for member in range(population)]
+    for member_folder in member_folders:
+        os.makedirs(member_folder)
+    pool = _headless_pool(workers) if workers != 0 else None
+
+    rows = []
+    scores = {}
+    try:
+        for generation in range(generations):
+            start = generation * interval
+            tasks = [(scenario, member, configs[member], start, start + interval, eval_episodes, frames_per_episode,
+                      f"{seed}:{generation}", member_folders[member]) for member in range(population)]
+            results = pool.imap_unordered(_run_sweep_trial, tasks) if pool else map(_run_sweep_trial, tasks)
+            for member, score, epsilon, frames_per_sec in results:
+                scores[member] = score
+                configs[member]["epsilon"] = epsilon  # Keep the decayed value for the next generation
+                rows.append(dict(generation=generation, episodes=start + interval, member=member, score=score,
+                                 parent=None, **configs[member]))
+
+            ranked = sorted(range(population), key=scores.get, reverse=True)
+            print(f"Generation {generation}: best member {ranked[0]} ({scores[ranked[0]]:.2f}), "
+                  f"worst member {ranked[-1]} ({scores[ranked[-1]]:.2f})", flush=True)
+            cutoff = max(1, int(population * exploit_fraction))
+            replaced = ranked[-cutoff:]
+            parents = [member for member in ranked[:cutoff] if member not in replaced]
+            for member in replaced:
+                parent = rng.choice(parents)
+                # Exploit: take over the parent's Q-table, explore: perturb its settings
+                _take_over_q_table(member_folders[parent], member_folders[member])
+                configs[member] = perturb_config(configs[parent], rng)
+                rows.append(dict(generation=generation, episodes=start + interval, member=member, score=None,
+                                 parent=parent, **configs[member]))
+            # Only the newest table of every member is ever read again
+            for member_folder in member_folders:
+                latest = _latest_q_table_file(member_folder)
+                for path in glob.glob(f'{member_folder}/*.json'):
+                    if path != latest:
+                        os.remove(path)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    output = os.path.join(run_folder, 'pbt.csv')
+    with open(output, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=["generation", "episodes", "member", "score", "parent", *configs[0]])
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"Population-based training results saved as {output}")
+
+    best = max(scores, key=scores.get)
+    print(f"Best member {best}: {configs[best]}")
+    return configs[best], member_folders[best]
+
+
+def _greedy_policy(sarsa):
+    # States, greedy action indices over the available actions, and visit weights
+    states = list(sarsa.q_table.keys())
+    actions = []
+    for state in states:
+        row = sarsa.q_table[state]
+        mask = sarsa.state_masks.get(state)
+        candidates = sarsa._allowed(mask) if mask else sarsa.actions
+        actions.append(sarsa.actions.index(max(candidates, key=row.get)))
+    if sarsa.visit_counts:
+        weights = [sarsa.visit_counts.get(state, 0) for state in states]
+    else:
+        weights = [1] * len(states)
+    return states, actions, weights
 
-        knight.sarsa.end_episode()
-        
-        # Add episode reward to rewards list
-        rewards_list.append(episode_reward)
-        
-        print(f"Episode {episode + 1}: Reward: {episode_reward:.2f}, Epsilon: {knight.sarsa.epsilon:.6f}", flush=True)
-        
-        # if (episode + 1) % 100 == 0:
-        #     knight.sarsa.save_q_table()
-        #     gc.collect()
 
-    print("Training complete")
-    print(f"Final Epsilon: {knight.sarsa.epsilon:.6f}")
-    #knight.sarsa.save_q_table()
+def _grow_tree(X, y, w, sizes, actions, depth, max_depth, min_weight):
+    # CART on one-vs-rest field == value splits with weighted Gini impurity.
+    # Inner nodes are [field, value, then, else], leaves a tuple of actions
+    # ranked by weight, so a masked first choice falls back to the next
+    import numpy as np
 
-    # Save rewards to Excel
-    new_df = pd.DataFrame({column_name: rewards_list})
-    
-    if df.empty:
-        df = new_df
-    else:
-        # Extend shorter DataFrame with NaN values to match the longer one
-        max_length = max(len(df), len(new_df))
-        df = df.reindex(range(max_length))
-        new_df = new_df.reindex(range(max_length))
-        df = pd.concat([df, new_df], axis=1)
+    counts = np.bincount(y, weights=w, minlength=len(actions))
+    total = counts.sum()
+    leaf = tuple(actions[i] for i in np.argsort(-counts, kind="stable"))
+    if depth == max_depth or total < 2 * min_weight or np.count_nonzero(counts) <= 1:
+        return leaf
+
+    impurity = total - (counts ** 2).sum() / total
+    best_gain, best_split = 1e-9, None
+    for field, size in enumerate(sizes):
+        left = np.zeros((size, len(actions)))
+        np.add.at(left, (X[:, field], y), w)
+        left_total = left.sum(axis=1)
+        right = counts - left
+        right_total = total - left_total
+        valid = (left_total >= min_weight) & (right_total >= min_weight)
+        if not valid.any():
+            continue
+        with np.errstate(divide="ignore", invalid="ignore"):
+            gain = (impurity - (left_total - (left ** 2).sum(axis=1) / left_total)
+                    - (right_total - (right ** 2).sum(axis=1) / right_total))
+        gain[~valid] = -np.inf
+        value = int(gain.argmax())
+        if gain[value] > best_gain:
+            best_gain, best_split = gain[value], (field, value)
+    if best_split is None:
+        return leaf
+
+    field, value = best_split
+    split = X[:, field] == value
+    return [field, value,
+            _grow_tree(X[split], y[split], w[split], sizes, actions, depth + 1, max_depth, min_weight),
+            _grow_tree(X[~split], y[~split], w[~split], sizes, actions, depth + 1, max_depth, min_weight)]
+
+
+class DistilledPolicy:
+    """
+    A Q-table's greedy policy compressed into a small decision tree over the
+    fields of the state string. It answers get_action / get_best_action like
+    a SARSA, so an agent built with sarsa=policy plays from it without the
+    table, and it learns nothing. Saved as a JSON tree of field == value
+    tests with ranked actions at the leaves.
+    """
+    observes = False
 
-    # Save to Excel
-    df.to_excel(excel_file, index=False)
-    print(f"Rewards saved to {excel_file}")
+    def __init__(self, character_type, tree, actions):
+        self.character_type = character_type
+        self.fields = STATE_FIELDS[character_type]
+        self.tree = tree
+        self.actions = list(actions)
+        self.epsilon = 0.0
+        self.gamma = 0.9
+        # State string to its leaf, bounded by the field vocabulary
+        self.cache = {}
+
+    def predict(self, state):
+        leaf = self.cache.get(state)
+        if leaf is None:
+            values = parse_state(state, self.fields)
+            leaf = self.tree
+            while isinstance(leaf, list):
+                leaf = leaf[2] if values[leaf[0]] == leaf[1] else leaf[3]
+            self.cache[state] = leaf
+        return leaf
+
+    def get_action(self, state, mask=()):
+        ranked = self.predict(state)
+        if mask:
+            for action in ranked:
+                if action not in mask:
+                    return action
+        return ranked[0]
+
+    get_best_action = get_action
+
+    def update_q_table(self, state, action, reward, next_state, next_action, steps=1):
+        pass
 
-    total_time = (time.time() - start_time) / 60
-    print(f"\nTotal training time: {total_time:.2f} minutes")
+    def end_episode(self):
+        pass
+
+    def size(self):
+        # (inner nodes, leaves)
+        stack, nodes, leaves = [self.tree], 0, 0
+        while stack:
+            node = stack.pop()
+            if isinstance(node, list):
+                nodes += 1
+                stack += node[2:]
+            else:
+                leaves += 1
+        return nodes, leaves
+
+    def agreement(self, sarsa):
+        # Share of states, plain and visit-weighted, where the tree picks the table's greedy action
+        states, actions, weights = _greedy_policy(sarsa)
+        if not states:
+            return {"states": 1.0, "weighted": 1.0}
+        matches = [self.get_action(state, sarsa.state_masks.get(state, ())) == sarsa.actions[action]
+                   for state, action in zip(states, actions)]
+        total_weight = sum(weights)
+        return {
+            "states": sum(matches) / len(states),
+            "weighted": sum(w for w, m in zip(weights, matches) if m) / total_weight if total_weight else 1.0,
+        }
+
+    def to_dict(self):
+        def export(node):
+            if not isinstance(node, list):
+                return list(node)
+            name, values = self.fields[node[0]]
+            return {"field": name, "value": values[node[1]], "then": export(node[2]), "else": export(node[3])}
+        return {"character_type": self.character_type, "actions": self.actions, "tree": export(self.tree)}
+
+    def save(self, path):
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.to_dict(), f)
+        os.replace(path + '.tmp', path)
+        print(f"Distilled policy saved as {path}")
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        fields = STATE_FIELDS[data["character_type"]]
+        names = [name for name, _ in fields]
+
+        def build(node):
+            if isinstance(node, list):
+                return tuple(node)
+            field = names.index(node["field"])
+            return [field, fields[field][1].index(node["value"]), build(node["then"]), build(node["else"])]
+        return cls(data["character_type"], build(data["tree"]), data["actions"])
+
+
+def distill_policy(sarsa, max_depth=8, min_weight=1.0):
+    """
+    Fit a DistilledPolicy to the greedy policy of a trained learner's
+    Q-table. States are weighted by sarsa.visit_counts, so train with
+    track_visits=True to spend the tree's depth on the states that come up
+    in play; without counts every state weighs the same. Prints the tree
+    size and its agreement with the table.
+    """
+    import numpy as np
+
+    states, actions, weights = _greedy_policy(sarsa)
+    fields = STATE_FIELDS[sarsa.character_type]
+    if states:
+        X = np.array([parse_state(state, fields) for state in states])
+        tree = _grow_tree(X, np.array(actions), np.array(weights, dtype=float), [len(values) for _, values in fields],
+                          sarsa.actions, 0, max_depth, min_weight)
+    else:
+        tree = tuple(sarsa.actions)
+    policy = DistilledPolicy(sarsa.character_type, tree, sarsa.actions)
+    nodes, leaves = policy.size()
+    agreement = policy.agreement(sarsa)
+    print(f"Distilled {len(states)} states into {nodes} splits and {leaves} leaves, "
+          f"agreement {agreement['states']:.1%} of states, {agreement['weighted']:.1%} weighted by visits")
+    return policy
+
+
+def distill_q_table(character_type, max_depth=8, min_weight=1.0, q_table_folder=None, output=None, weighted=True):
+    # Distill the latest checkpoint, weighted by the visit counts saved with
+    # it unless weighted is False, and save the tree in the working directory
+    sarsa = SARSA(character_type, q_table_folder=q_table_folder)
+    if weighted:
+        sarsa.visit_counts = sarsa.load_visit_counts()
+        if not sarsa.visit_counts:
+            raise ValueError(f"No visit counts saved in {sarsa.q_table_folder}, train with "
+                             "sarsa_params={'track_visits': True} or pass weighted=False")
+    policy = distill_policy(sarsa, max_depth, min_weight)
+    policy.save(output or f"{character_type}_policy.json")
+    return policy
 
-    gc.collect()
 
 if __name__ == "__main__":
     test()
     #test_knight_performance()
     # Uncomment the function you want to run
     #show_map()
+    #benchmark_scenarios()
+    #microbenchmark_sarsa(plot=True)
+    #schedule_training()
+    #sweep_hyperparameters({"alpha": [0.05, 0.1, 0.2], "gamma": [0.9, 0.99], "epsilon": [0.1, 0.3]})
+    #population_based_training("knight")
+    #distill_q_table("bird")
     #train_enemy_fast()
     #visualize_enemy_training()
     
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# RL_Game opens a window at import, so run pygame without a display or audio device
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
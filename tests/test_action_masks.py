@@ -0,0 +1,50 @@
+import itertools
+from types import SimpleNamespace
+
+import pytest
+
+import RL_Game as G
+
+
+@pytest.mark.parametrize("blocking, attack_cooldown, shield_cooldown",
+                         list(itertools.product([False, True], [0, 5], [0, 5])))
+def test_knight_mask_covers_the_no_op_actions(blocking, attack_cooldown, shield_cooldown):
+    knight = SimpleNamespace(blocking=blocking, attack_cooldown=attack_cooldown, shield_cooldown=shield_cooldown)
+    mask = G.Knight.action_mask(knight)
+    assert ('attack' in mask) == bool(blocking or attack_cooldown)
+    assert ('block' in mask) == bool(shield_cooldown and not blocking)
+    assert ('maintain_block' in mask) == (not blocking)
+    # Masks are cache keys, so they keep the action order
+    actions = G.SARSA("knight", q_table_folder="unused").actions
+    assert list(mask) == sorted(mask, key=actions.index)
+
+
+def test_enemy_and_bird_masks():
+    assert G.Enemy.action_mask(SimpleNamespace(attack_cooldown=3)) == ('shoot',)
+    assert G.Enemy.action_mask(SimpleNamespace(attack_cooldown=0)) == ()
+    assert G.Bird.action_mask(SimpleNamespace(shield_cooldown=0, shield_active=True)) == ('activate_shield',)
+    assert G.Bird.action_mask(SimpleNamespace(shield_cooldown=0, shield_active=False)) == ()
+
+
+@pytest.mark.parametrize("sarsa_class", [G.SARSA, G.ArraySARSA])
+def test_masked_actions_are_never_chosen(tmp_path, sarsa_class):
+    sarsa = sarsa_class("knight", q_table_folder=str(tmp_path))
+    sarsa.epsilon = 0.5
+    state = "s"
+    sarsa.get_action(state)
+    sarsa.update_q_table(state, "attack", 100.0, "t", "idle")
+    mask = ('attack', 'maintain_block')
+    for _ in range(200):
+        assert sarsa.get_action(state, mask) not in mask
+    assert sarsa.get_best_action(state, mask) not in mask
+
+
+@pytest.mark.parametrize("sarsa_class", [G.SARSA, G.ArraySARSA])
+def test_q_learning_target_skips_masked_actions(tmp_path, sarsa_class):
+    sarsa = sarsa_class("enemy", q_table_folder=str(tmp_path), target="q_learning")
+    sarsa.alpha = 1.0
+    sarsa.get_action("next", ('shoot',))
+    sarsa.update_q_table("next", "shoot", 10.0, "end", "idle")
+    sarsa.update_q_table("start", "idle", 0.0, "next", "idle")
+    # shoot is unavailable in next, so its high value is not bootstrapped from
+    assert sarsa.q_table["start"]["idle"] == pytest.approx(0.0)
@@ -0,0 +1,63 @@
+import pytest
+
+import RL_Game as G
+
+
+def test_k_step_return_is_discounted_and_bootstraps_with_gamma_k(tmp_path):
+    sarsa = G.SARSA("enemy", q_table_folder=str(tmp_path))
+    sarsa.q_table["next"] = {action: 0.0 for action in sarsa.actions}
+    sarsa.q_table["next"]["idle"] = 10.0
+    repeat = G.ActionRepeat(k=3)
+    gamma = sarsa.gamma
+
+    assert repeat.due()
+    repeat.begin("start", "shoot")
+    assert not repeat.add(1.0, gamma)
+    assert not repeat.due()
+    assert not repeat.add(2.0, gamma)
+    assert repeat.add(4.0, gamma)
+    assert repeat.reward == pytest.approx(1 + 2 * gamma + 4 * gamma ** 2)
+
+    repeat.update(sarsa, "next", "idle")
+    target = 1 + 2 * gamma + 4 * gamma ** 2 + gamma ** 3 * 10.0
+    assert sarsa.q_table["start"]["shoot"] == pytest.approx(sarsa.alpha * target)
+    assert repeat.due() and repeat.reward == 0.0 and repeat.discount == 1.0
+
+
+def test_single_step_repeat_matches_a_plain_update(tmp_path):
+    plain = G.SARSA("enemy", q_table_folder=str(tmp_path / "plain"))
+    repeated = G.SARSA("enemy", q_table_folder=str(tmp_path / "repeated"))
+    repeat = G.ActionRepeat(k=1)
+    for i in range(20):
+        state, next_state = f"s{i % 4}", f"s{(i + 1) % 4}"
+        plain.update_q_table(state, "shoot", float(i), next_state, "shoot")
+        repeat.begin(state, "shoot")
+        assert repeat.add(float(i), repeated.gamma)
+        repeat.update(repeated, next_state, "shoot")
+    assert repeated.q_table == plain.q_table
+
+
+def test_event_change_ends_the_repeat_early():
+    repeat = G.ActionRepeat(k=10, event_driven=True)
+    repeat.begin("start", "shoot", events=(0, False))
+    assert not repeat.add(1.0, 0.9, events=(0, False))
+    assert repeat.add(1.0, 0.9, events=(1, False))
+    assert repeat.frames == 2
+
+
+def test_choose_reuses_the_bootstrapped_action_only_in_the_same_state(tmp_path):
+    sarsa = G.SARSA("enemy", q_table_folder=str(tmp_path))
+    sarsa.epsilon = 0
+    sarsa.q_table["next"] = {action: float(action == "idle") for action in sarsa.actions}
+    repeat = G.ActionRepeat()
+    repeat.begin("start", "shoot")
+    repeat.add(0.0, sarsa.gamma)
+    repeat.update(sarsa, "next", "shoot")
+    # The update bootstrapped from shoot, so shoot runs even though idle is greedy
+    assert repeat.choose(sarsa, "next") == "shoot"
+    assert repeat.choose(sarsa, "next") == "idle"
+
+    repeat.update(sarsa, "next", "shoot")
+    repeat.choose(sarsa, "elsewhere")
+    assert repeat.carried is None
+    assert repeat.choose(sarsa, "next") == "idle"
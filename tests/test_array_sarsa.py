@@ -0,0 +1,56 @@
+import random
+
+import pytest
+
+import RL_Game as G
+
+
+def play(sarsa, seed, steps=400):
+    # The same stream of states, masks and rewards, actions drawn by the learner
+    sarsa.epsilon = 0.3
+    stream = random.Random(seed)
+    random.seed(seed)
+    masks = [(), ("shoot",), ("move_left", "idle")]
+    chosen = []
+    state, mask = "s0", ()
+    action = sarsa.get_action(state, mask)
+    for _ in range(steps):
+        next_state, next_mask = f"s{stream.randrange(6)}", stream.choice(masks)
+        next_action = sarsa.get_action(next_state, next_mask)
+        sarsa.update_q_table(state, action, stream.uniform(-1, 1), next_state, next_action)
+        chosen.append(next_action)
+        state, action = next_state, next_action
+    return chosen
+
+
+@pytest.mark.parametrize("target", ["sarsa", "expected", "q_learning"])
+def test_array_sarsa_matches_sarsa(tmp_path, target):
+    reference = G.SARSA("enemy", q_table_folder=str(tmp_path / "dict"), target=target)
+    array = G.ArraySARSA("enemy", q_table_folder=str(tmp_path / "array"), target=target)
+    assert play(array, 3) == play(reference, 3)
+
+    table = array.q_table
+    assert set(table) == set(reference.q_table)
+    for state, row in reference.q_table.items():
+        assert table[state] == pytest.approx(row)
+
+
+def test_q_table_assignment_and_checkpoint_round_trip(tmp_path):
+    sarsa = G.ArraySARSA("enemy", q_table_folder=str(tmp_path))
+    rows = {f"s{i}": {action: float(i + j) for j, action in enumerate(sarsa.actions)} for i in range(1500)}
+    sarsa.q_table = rows
+    assert sarsa.to_dict() == rows
+    sarsa.save_q_table()
+    assert G.ArraySARSA("enemy", q_table_folder=str(tmp_path)).to_dict() == rows
+
+
+def test_replay_accumulates_repeated_pairs(tmp_path):
+    sarsa = G.ArraySARSA("enemy", q_table_folder=str(tmp_path), replay_capacity=8, batch_size=4,
+                         replay_every=100)
+    sarsa.update_q_table("s0", "shoot", 1.0, "s1", "idle")
+    # Stored, not learnt, until the buffer is replayed
+    assert sarsa.q_table["s0"]["shoot"] == 0
+    sarsa.replay()
+    # Four samples of the one transition, each stepping from the same old value
+    assert sarsa.q_table["s0"]["shoot"] == pytest.approx(4 * sarsa.alpha)
+    assert sarsa.update_count == 4
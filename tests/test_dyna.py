@@ -0,0 +1,38 @@
+import RL_Game as G
+
+
+def make(tmp_path, **kwargs):
+    sarsa = G.SARSA("enemy", q_table_folder=str(tmp_path), **kwargs)
+    sarsa.epsilon = 0.0
+    return sarsa
+
+
+def walk_chain(sarsa, length):
+    # s0 -> s1 -> ... -> goal, rewarded only on the last step
+    for i in range(length):
+        next_state = f"s{i + 1}" if i + 1 < length else "goal"
+        sarsa.update_q_table(f"s{i}", "shoot", float(next_state == "goal"), next_state, "shoot")
+
+
+def test_uniform_model_is_bounded_and_relinked(tmp_path):
+    sarsa = make(tmp_path, planning_steps=5, model_size=3)
+    walk_chain(sarsa, 5)
+    assert len(sarsa.model) == len(sarsa.model_keys) == 3
+    assert set(sarsa.model) == set(sarsa.model_keys)
+    assert sarsa.planning_count == 5 * 5
+    # Every model entry is linked from its next state and nothing else is
+    links = {key for keys in sarsa.predecessors.values() for key in keys}
+    assert links == set(sarsa.model)
+
+    key = sarsa.model_keys[0]
+    old_next_state = sarsa.model[key][1]
+    sarsa.update_q_table(key[0], key[1], 2.0, "elsewhere", "shoot")
+    assert sarsa.model[key][:2] == [2.0, "elsewhere"]
+    assert key in sarsa.predecessors["elsewhere"]
+    assert key not in sarsa.predecessors.get(old_next_state, ())
+
+
+def test_uniform_planning_propagates_the_reward_back(tmp_path):
+    sarsa = make(tmp_path, planning_steps=200)
+    walk_chain(sarsa, 3)
+    assert sarsa.q_table["s0"]["shoot"] > 0
@@ -0,0 +1,69 @@
+import json
+
+import numpy as np
+import pytest
+
+import RL_Game as G
+
+
+@pytest.fixture
+def checkpoint(tmp_path, monkeypatch):
+    # Checkpoint paths are relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "knight_q_tables").mkdir()
+    path = tmp_path / G.knight_checkpoint_path(10)
+    path.write_text(json.dumps({"state": {"attack": 1.0}}))
+    return path
+
+
+def test_eval_cache_key_tracks_every_input(checkpoint, monkeypatch):
+    key = G.eval_cache_key(10, 1000, 0, "performance")
+    assert key == G.eval_cache_key(10, 1000, 0, "performance")
+    assert key != G.eval_cache_key(10, 1000, 1, "performance")
+    assert key != G.eval_cache_key(10, 500, 0, "performance")
+    assert key != G.eval_cache_key(10, 1000, 0, "test")
+    assert G.eval_cache_key(20, 1000, 0, "performance") is None
+
+    checkpoint.write_text(json.dumps({"state": {"attack": 2.0}}))
+    assert G.eval_cache_key(10, 1000, 0, "performance") != key
+    checkpoint.write_text(json.dumps({"state": {"attack": 1.0}}))
+    assert G.eval_cache_key(10, 1000, 0, "performance") == key
+
+    monkeypatch.setattr(G, "EVAL_VERSION", G.EVAL_VERSION + 1)
+    assert G.eval_cache_key(10, 1000, 0, "performance") != key
+
+
+def test_eval_cache_round_trip_and_unreadable_entries(tmp_path, capsys):
+    cache_dir = str(tmp_path / "cache")
+    assert G.load_eval_cache(cache_dir, "missing") == []
+    G.save_eval_cache(cache_dir, "key", 10, [1.0, 2.5])
+    assert G.load_eval_cache(cache_dir, "key") == [1.0, 2.5]
+
+    (tmp_path / "cache" / "key.json").write_text("{not json")
+    assert G.load_eval_cache(cache_dir, "key") == []
+    assert "Ignoring unreadable cache entry" in capsys.readouterr().out
+
+
+def test_evaluate_knight_checkpoints_only_simulates_uncached_episodes(checkpoint, monkeypatch):
+    tasks = []
+
+    def evaluate(task):
+        tasks.append(task)
+        q_table_number, first_episode, last_episode = task[:3]
+        if q_table_number == 20:
+            return q_table_number, first_episode, None
+        return q_table_number, first_episode, [float(e) for e in range(first_episode, last_episode)]
+
+    monkeypatch.setattr(G, "_evaluate_knight_checkpoint", evaluate)
+    rewards = G.evaluate_knight_checkpoints([10, 20], num_episodes=3, workers=0)
+    np.testing.assert_array_equal(rewards[0], [0, 1, 2])
+    assert np.isnan(rewards[1]).all()
+
+    tasks.clear()
+    rewards = G.evaluate_knight_checkpoints([10], num_episodes=5, workers=0)
+    assert [task[:3] for task in tasks] == [(10, 3, 5)]
+    np.testing.assert_array_equal(rewards[0], [0, 1, 2, 3, 4])
+
+    tasks.clear()
+    G.evaluate_knight_checkpoints([10], num_episodes=4, workers=0)
+    assert tasks == []
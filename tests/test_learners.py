@@ -0,0 +1,155 @@
+import random
+
+import numpy as np
+import pytest
+
+import RL_Game as G
+
+
+def random_state(fields, rng):
+    return "_".join(rng.choice(values) for _, values in fields)
+
+
+def greedy_table(sarsa, fields, rng, count=300):
+    # A Q-table whose greedy action depends on the first two fields only
+    for _ in range(count):
+        state = random_state(fields, rng)
+        values = G.parse_state(state, fields)
+        best = (values[0] + values[1]) % len(sarsa.actions)
+        sarsa.q_table[state] = {action: float(i == best) for i, action in enumerate(sarsa.actions)}
+
+
+@pytest.mark.parametrize("character_type", sorted(G.STATE_FIELDS))
+def test_parse_state_round_trips_every_field(character_type):
+    fields = G.STATE_FIELDS[character_type]
+    rng = random.Random(0)
+    for _ in range(200):
+        indices = [rng.randrange(len(values)) for _, values in fields]
+        state = "_".join(values[i] for (_, values), i in zip(fields, indices))
+        assert G.parse_state(state, fields) == indices
+
+
+def test_parse_state_tells_medium_close_from_medium():
+    fields = G.ENEMY_STATE_FIELDS
+    x_states = fields[0][1]
+    rest = "left_same_level_high_low_facing_player_attack_ready_no_wall"
+    assert G.parse_state(f"medium_close_{rest}", fields)[0] == x_states.index("medium_close")
+    assert G.parse_state(f"medium_{rest}", fields)[0] == x_states.index("medium")
+    assert G.parse_state(f"medium_far_{rest}", fields)[0] == x_states.index("medium_far")
+
+
+def test_parse_state_rejects_unknown_values():
+    with pytest.raises(ValueError):
+        G.parse_state("nowhere_left_same_level_high_low_facing_player_attack_ready_no_wall", G.ENEMY_STATE_FIELDS)
+
+
+def test_linear_sarsa_update_and_checkpoint(tmp_path):
+    sarsa = G.LinearSARSA("enemy", q_table_folder=str(tmp_path))
+    rng = random.Random(1)
+    state = random_state(sarsa.fields, rng)
+    next_state = random_state(sarsa.fields, rng)
+
+    sarsa.update_q_table(state, "shoot", 1.0, next_state, "idle")
+    q = sarsa.q_values(state)
+    # From zero weights the shared step moves Q(s, a) by exactly alpha * delta
+    assert q[sarsa.action_index["shoot"]] == pytest.approx(sarsa.alpha)
+    assert np.count_nonzero(q) == 1
+    assert sarsa.get_best_action(state) == "shoot"
+    assert sarsa.get_best_action(state, ("shoot",)) != "shoot"
+    assert sarsa.q_table[state]["shoot"] == pytest.approx(sarsa.alpha)
+
+    sarsa.save_q_table()
+    loaded = G.LinearSARSA("enemy", q_table_folder=str(tmp_path))
+    np.testing.assert_array_equal(loaded.weights, sarsa.weights)
+
+
+def test_qnetwork_backward_matches_finite_differences():
+    rng = np.random.default_rng(0)
+    network = G.QNetwork(6, 4, hidden=(5, 3), rng=rng)
+    # float64 and nonzero biases keep the check away from rounding and ReLU kinks
+    network.params = [p.astype(np.float64) + 0.1 * rng.standard_normal(p.shape) for p in network.params]
+    x = rng.standard_normal((7, 6))
+    upstream = rng.standard_normal((7, 4))
+
+    activations = []
+    network.forward(x.copy(), activations)
+    grads = network.backward(activations, upstream)
+
+    eps = 1e-6
+    for param, grad in zip(network.params, grads):
+        numeric = np.zeros_like(param)
+        for i in np.ndindex(param.shape):
+            saved = param[i]
+            param[i] = saved + eps
+            plus = (network.forward(x.copy()) * upstream).sum()
+            param[i] = saved - eps
+            minus = (network.forward(x.copy()) * upstream).sum()
+            param[i] = saved
+            numeric[i] = (plus - minus) / (2 * eps)
+        np.testing.assert_allclose(grad, numeric, rtol=1e-5, atol=1e-7)
+
+
+def test_observation_replay_buffer_wraps_around():
+    buffer = G.ObservationReplayBuffer(5, 2, 3)
+
+    def batch(start, n):
+        values = np.arange(start, start + n, dtype=np.float32)
+        masks = np.zeros((n, 3), dtype=bool)
+        masks[:, 0] = True
+        return (np.stack([values, -values], axis=1), np.arange(start, start + n), values,
+                np.stack([values + 100, -values], axis=1), np.full(n, 0.9, dtype=np.float32), masks)
+
+    buffer.add(*batch(0, 3))
+    assert len(buffer) == 3 and buffer.position == 3
+    buffer.add(*batch(3, 4))
+    assert len(buffer) == 5 and buffer.position == 2
+    # Rows 0 and 1 were overwritten by the last two transitions
+    np.testing.assert_array_equal(buffer.observations[:, 0], [5, 6, 2, 3, 4])
+    np.testing.assert_array_equal(buffer.actions, [5, 6, 2, 3, 4])
+    np.testing.assert_array_equal(buffer.next_observations[:, 0], [105, 106, 102, 103, 104])
+    assert buffer.next_masks[:, 0].all() and not buffer.next_masks[:, 1:].any()
+
+    observations, actions, *_ = buffer.sample(50, np.random.default_rng(0))
+    np.testing.assert_array_equal(observations[:, 0], actions)
+
+
+def test_grow_tree_finds_the_deciding_field():
+    actions = ["a", "b", "c"]
+    rng = np.random.default_rng(0)
+    X = rng.integers(0, 4, size=(200, 3))
+    y = (X[:, 1] == 2).astype(int)
+    w = np.ones(len(y))
+
+    tree = G._grow_tree(X, y, w, [4, 4, 4], actions, 0, 8, 1.0)
+    assert tree[:2] == [1, 2]
+    assert tree[2][0] == "b" and tree[3][0] == "a"
+
+    # At the depth limit the leaf ranks actions by weight, not by count
+    w = np.where(y == 1, 10.0, 1.0)
+    assert y.sum() < len(y) / 2
+    assert G._grow_tree(X, y, w, [4, 4, 4], actions, 0, 0, 1.0) == ("b", "a", "c")
+
+
+def test_distilled_policy_json_round_trip(tmp_path):
+    sarsa = G.SARSA("knight", q_table_folder=str(tmp_path / "q_tables"))
+    greedy_table(sarsa, G.STATE_FIELDS["knight"], random.Random(2))
+    policy = G.distill_policy(sarsa, max_depth=8)
+    assert policy.agreement(sarsa)["states"] == 1.0
+
+    path = str(tmp_path / "policy.json")
+    policy.save(path)
+    loaded = G.DistilledPolicy.load(path)
+    assert loaded.tree == policy.tree
+    assert loaded.actions == policy.actions
+    assert loaded.agreement(sarsa) == policy.agreement(sarsa)
+    for state in sarsa.q_table:
+        assert loaded.get_action(state) == policy.get_action(state)
+
+
+def test_network_sarsa_reports_its_array_footprint(tmp_path):
+    sarsa = G.NetworkSARSA("enemy", q_table_folder=str(tmp_path))
+    memory = G.q_table_memory(sarsa)
+    assert memory["parameters"] == sum(p.size for p in sarsa.network.params) > 0
+    assert memory["estimated_bytes"] >= 2 * sum(p.nbytes for p in sarsa.network.params)
+    stats = G.training_stats([sarsa], 10, 1, 1.0)
+    assert stats["q_table_states"] == {} and stats["network_bytes"] == {"enemy": memory["estimated_bytes"]}
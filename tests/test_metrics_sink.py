@@ -0,0 +1,48 @@
+import json
+
+import RL_Game as G
+
+
+def read_rows(sink):
+    with open(sink.path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_close_flushes_every_recorded_episode(tmp_path, capsys):
+    # A long flush interval leaves all the writing to close()
+    sink = G.MetricsSink("test", folder=str(tmp_path), flush_interval=60, summary_interval=2)
+    for episode in range(1, 6):
+        sink.record(episode, float(episode), 0.5, 10, hits=1)
+    sink.close()
+
+    rows = read_rows(sink)
+    assert [row["episode"] for row in rows] == [1, 2, 3, 4, 5]
+    assert set(rows[0]) == set(G.MetricsSink.FIELDS)
+    assert rows[4]["reward"] == 5.0 and rows[4]["hits"] == 1
+
+    # Two full windows plus the partial one printed by close()
+    out = capsys.readouterr().out
+    assert out.count("Episodes ") == 3 and "Episodes 5-5" in out
+
+
+def test_background_writer_drains_in_batches(tmp_path):
+    sink = G.MetricsSink("test", folder=str(tmp_path), flush_interval=0.01, summary_interval=0)
+    sink.record(1, 1.0, 0.5, 10)
+    for _ in range(500):
+        if not sink.buffer:
+            break
+        sink.stop_event.wait(0.01)
+    assert not sink.buffer
+    sink.record(2, 2.0, 0.5, 10)
+    sink.close()
+    assert [row["episode"] for row in read_rows(sink)] == [1, 2]
+
+
+def test_full_buffer_counts_dropped_episodes(tmp_path, capsys):
+    sink = G.MetricsSink("test", folder=str(tmp_path), capacity=3, flush_interval=60, summary_interval=0)
+    for episode in range(5):
+        sink.record(episode, 0.0, 0.5, 1)
+    sink.close()
+    assert sink.dropped == 2
+    assert [row["episode"] for row in read_rows(sink)] == [2, 3, 4]
+    assert "2 episodes were not written" in capsys.readouterr().out
@@ -0,0 +1,33 @@
+import pytest
+
+import RL_Game as G
+
+
+@pytest.mark.parametrize("exploit_fraction", [0, 0.6, 1.0])
+def test_exploit_fraction_is_validated(tmp_path, exploit_fraction):
+    with pytest.raises(ValueError):
+        G.population_based_training("enemy", population=4, exploit_fraction=exploit_fraction, folder=str(tmp_path))
+    assert not list(tmp_path.iterdir())
+
+
+def test_take_over_q_table_replaces_the_members_tables(tmp_path):
+    parent, member = tmp_path / "parent", tmp_path / "member"
+    parent.mkdir()
+    member.mkdir()
+    (parent / "q_table_episode_400.json").write_text('{"s": {"idle": 1}}')
+    (member / "q_table_episode_200.json").write_text('{"s": {"idle": -1}}')
+    (member / "q_table_episode_400.json").write_text('{"s": {"idle": -2}}')
+
+    G._take_over_q_table(str(parent), str(member))
+    assert sorted(p.name for p in member.iterdir()) == ["q_table_episode_400.json"]
+    assert (member / "q_table_episode_400.json").read_text() == '{"s": {"idle": 1}}'
+    assert (parent / "q_table_episode_400.json").exists()
+
+
+def test_take_over_q_table_keeps_the_member_without_a_parent_table(tmp_path):
+    parent, member = tmp_path / "parent", tmp_path / "member"
+    parent.mkdir()
+    member.mkdir()
+    (member / "q_table_episode_200.json").write_text("{}")
+    assert G._take_over_q_table(str(parent), str(member)) is None
+    assert (member / "q_table_episode_200.json").exists()
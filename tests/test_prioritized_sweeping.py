@@ -0,0 +1,54 @@
+import pytest
+
+import RL_Game as G
+
+
+def make(tmp_path, **kwargs):
+    sarsa = G.SARSA("enemy", q_table_folder=str(tmp_path), **kwargs)
+    sarsa.epsilon = 0.0
+    return sarsa
+
+
+def walk_chain(sarsa, length):
+    # s0 -> s1 -> ... -> goal, rewarded only on the last step
+    for i in range(length):
+        next_state = f"s{i + 1}" if i + 1 < length else "goal"
+        sarsa.update_q_table(f"s{i}", "shoot", float(next_state == "goal"), next_state, "shoot")
+
+
+def test_prioritized_sweeping_follows_predecessors(tmp_path):
+    sarsa = make(tmp_path, planning_steps=10, planning="prioritized")
+    walk_chain(sarsa, 4)
+    # The single rewarded update was swept back along the whole chain
+    assert all(sarsa.q_table[f"s{i}"]["shoot"] > 0 for i in range(4))
+    assert 0 < sarsa.planning_count <= 4 * 10
+    assert sarsa.priority_queue == [] and sarsa.queued == {}
+
+
+def test_prioritized_sweeping_skips_small_errors(tmp_path):
+    sarsa = make(tmp_path, planning_steps=10, planning="prioritized", priority_threshold=10.0)
+    walk_chain(sarsa, 4)
+    assert sarsa.planning_count == 0
+    assert sarsa.q_table["s0"]["shoot"] == 0
+
+
+def test_stale_queue_entries_are_rebuilt_in_place(tmp_path):
+    sarsa = make(tmp_path, planning_steps=1, planning="prioritized", model_size=2)
+    sarsa.update_q_table("a", "shoot", 0.0, "b", "shoot")
+    sarsa.update_q_table("b", "shoot", 0.0, "c", "shoot")
+    queue = sarsa.priority_queue
+    # Re-queue the same two keys with growing errors, each push leaves a stale duplicate behind
+    for reward in range(1, 10):
+        for key in list(sarsa.model):
+            sarsa.model[key][0] = float(reward)
+            sarsa._queue(key)
+    assert sarsa.priority_queue is queue
+    assert len(queue) <= 4 * sarsa.model_size
+    assert set(key for _, _, key in queue) == set(sarsa.queued)
+    assert all(queue[(i - 1) // 2] <= queue[i] for i in range(1, len(queue)))
+    assert -queue[0][0] == pytest.approx(max(sarsa.queued.values()))
+
+
+def test_unknown_planning_mode_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        make(tmp_path, planning="random")
@@ -0,0 +1,29 @@
+import pytest
+
+import RL_Game as G
+
+
+@pytest.mark.parametrize("eviction", ["lru", "least_visited"])
+def test_capped_updates_land_in_the_table(tmp_path, eviction):
+    # Two rows: every update that inserts a state hits the cap
+    sarsa = G.SARSA("enemy", q_table_folder=str(tmp_path), max_states=2, eviction=eviction)
+    for _ in range(5):
+        sarsa.get_action("home")
+    for i in range(50):
+        # Fresh states have no visits, so least_visited would pick them first
+        state, next_state = f"s{i}", f"t{i}"
+        sarsa.update_q_table(state, "shoot", 1.0, next_state, "idle")
+        assert len(sarsa.q_table) <= 2
+        assert sarsa.q_table[state]["shoot"] == pytest.approx(sarsa.alpha)
+        assert next_state in sarsa.q_table
+    assert sarsa.evicted_states > 0
+
+
+def test_least_visited_eviction_keeps_frequent_states(tmp_path):
+    sarsa = G.SARSA("enemy", q_table_folder=str(tmp_path), max_states=3, eviction="least_visited")
+    for _ in range(10):
+        sarsa.get_action("home")
+    for i in range(20):
+        sarsa.update_q_table(f"s{i}", "idle", 0.0, f"s{i + 1}", "idle")
+    assert "home" in sarsa.q_table
+    assert len(sarsa.q_table) <= 3
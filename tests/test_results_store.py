@@ -0,0 +1,25 @@
+import RL_Game as G
+
+
+def test_append_run_and_read_back(tmp_path):
+    store = G.ResultsStore(str(tmp_path / "results"))
+    assert store.runs() == []
+
+    first = store.append_run([1.5, -2.0, 3.25], agent="knight", scenario="test", seed=7)
+    second = store.append_run([], agent="knight", scenario="test")
+    runs = store.runs()
+    assert [run["run_id"] for run in runs] == [first, second]
+    assert runs[0]["seed"] == 7 and runs[0]["num_episodes"] == 3
+    assert store.load_rewards(runs[0]) == [1.5, -2.0, 3.25]
+    assert store.load_rewards(runs[1]) == []
+
+    # The index is read from disk, so a new store on the same folder sees the same runs
+    assert G.ResultsStore(str(tmp_path / "results")).runs() == runs
+
+
+def test_rewards_are_stored_little_endian(tmp_path):
+    store = G.ResultsStore(str(tmp_path))
+    run_id = store.append_run([1.0])
+    run = store.runs()[0]
+    assert run["run_id"] == run_id
+    assert (tmp_path / run["file"]).read_bytes() == bytes.fromhex("000000000000f03f")
@@ -0,0 +1,60 @@
+import multiprocessing
+import os
+
+import RL_Game as G
+
+
+class InlineProcess:
+    # Runs the job in the test process when started
+    def __init__(self, target, args, name):
+        self.target, self.args, self.name = target, args, name
+        self.pid = 0
+        self.exitcode = None
+
+    def start(self):
+        self.target(*self.args)
+        self.exitcode = 0
+
+    def is_alive(self):
+        return False
+
+    def join(self):
+        pass
+
+
+def test_checkpoint_episodes_reads_the_given_folder(tmp_path):
+    for name in ("q_table_episode_100.json", "q_table_episode_300.npz", "q_table_episode_900.json.visits",
+                 "q_table_episode_700.json.tmp"):
+        (tmp_path / name).write_text("{}")
+    assert G.checkpoint_episodes("knight", str(tmp_path)) == 300
+    assert G.checkpoint_episodes("knight", str(tmp_path / "missing")) == 0
+
+
+def test_schedule_training_follows_redirected_folders(tmp_path, monkeypatch):
+    calls = {}
+
+    def fake_trainer(name):
+        def train(**kwargs):
+            calls[name] = kwargs
+            os.makedirs(kwargs["q_table_folder"], exist_ok=True)
+            open(os.path.join(kwargs["q_table_folder"], "q_table_episode_50.json"), "w").close()
+        return train
+
+    scenarios = {name: (fake_trainer(name),) + entry[1:] for name, entry in G.TRAINING_SCENARIOS.items()}
+    monkeypatch.setattr(G, "TRAINING_SCENARIOS", scenarios)
+    monkeypatch.setattr(multiprocessing, "Process", InlineProcess)
+    knights = str(tmp_path / "knights")
+    birds = str(tmp_path / "birds")
+    jobs = [
+        {"scenario": "knight", "kwargs": {"q_table_folder": knights}},
+        {"scenario": "enemy", "kwargs": {"q_table_folder": str(tmp_path / "enemies")}},
+        {"scenario": "bird_with_knight", "after": {"knight": 50}, "kwargs": {"q_table_folder": birds}},
+        {"scenario": "bird_and_enemy", "after": {"enemy": 50, "bird_with_knight": None}},
+    ]
+
+    exit_codes = G.schedule_training(jobs, workers=1, poll_interval=0)
+    assert exit_codes == {name: 0 for name in ("knight", "enemy", "bird_with_knight", "bird_and_enemy")}
+    assert calls["bird_with_knight"]["frozen_folders"] == {"knight": knights}
+    # The second bird job continues from the first one's folder and freezes the redirected enemy
+    assert calls["bird_and_enemy"]["q_table_folder"] == birds
+    assert calls["bird_and_enemy"]["frozen_folders"] == {"enemy": str(tmp_path / "enemies")}
@@ -0,0 +1,60 @@
+import pytest
+
+import RL_Game as G
+
+
+def make(tmp_path, gamma=0.9, **kwargs):
+    sarsa = G.SARSA("enemy", q_table_folder=str(tmp_path), **kwargs)
+    sarsa.gamma = gamma
+    return sarsa
+
+
+def test_reward_reaches_earlier_pairs_through_the_trace(tmp_path):
+    sarsa = make(tmp_path, trace_decay=0.8)
+    sarsa.update_q_table("s0", "shoot", 0.0, "s1", "shoot")
+    sarsa.update_q_table("s1", "shoot", 1.0, "s2", "shoot")
+    decay = sarsa.gamma * 0.8
+    assert sarsa.q_table["s1"]["shoot"] == pytest.approx(sarsa.alpha)
+    assert sarsa.q_table["s0"]["shoot"] == pytest.approx(sarsa.alpha * decay)
+
+    sarsa.end_episode()
+    assert sarsa.traces == []
+    sarsa.update_q_table("s3", "shoot", 1.0, "s4", "shoot")
+    # A new episode does not reach back into the last one
+    assert sarsa.q_table["s0"]["shoot"] == pytest.approx(sarsa.alpha * decay)
+
+
+def test_zero_trace_decay_is_the_one_step_update(tmp_path):
+    plain = make(tmp_path / "plain")
+    traced = make(tmp_path / "traced", trace_decay=0.0)
+    for sarsa in (plain, traced):
+        for i in range(10):
+            sarsa.update_q_table(f"s{i % 3}", "shoot", float(i), f"s{(i + 1) % 3}", "idle")
+    assert traced.q_table == plain.q_table
+    assert traced.traces == []
+
+
+@pytest.mark.parametrize("trace_mode, revisited", [("replacing", 1.0), ("accumulating", 1.5)])
+def test_revisiting_a_pair_replaces_or_accumulates(tmp_path, trace_mode, revisited):
+    sarsa = make(tmp_path, trace_decay=0.5, trace_mode=trace_mode, gamma=1.0)
+    sarsa.update_q_table("s0", "shoot", 0.0, "s1", "shoot")
+    sarsa.update_q_table("s0", "shoot", 0.0, "s1", "shoot")
+    assert sarsa.traces == [["s0", "shoot", pytest.approx(0.5 * revisited)]]
+
+
+def test_traces_are_capped_and_short_ones_dropped(tmp_path):
+    sarsa = make(tmp_path, trace_decay=0.9, gamma=1.0, max_traces=3)
+    for i in range(6):
+        sarsa.update_q_table(f"s{i}", "shoot", 0.0, f"s{i + 1}", "shoot")
+    assert [entry[0] for entry in sarsa.traces] == ["s3", "s4", "s5"]
+
+    sarsa = make(tmp_path, trace_decay=0.05, gamma=1.0)
+    for i in range(3):
+        sarsa.update_q_table(f"s{i}", "shoot", 0.0, f"s{i + 1}", "shoot")
+    # 0.05 ** 2 falls below the 0.01 threshold
+    assert [entry[0] for entry in sarsa.traces] == ["s2"]
+
+
+def test_unknown_trace_mode_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        make(tmp_path, trace_decay=0.5, trace_mode="dutch")
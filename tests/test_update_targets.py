@@ -0,0 +1,59 @@
+import random
+
+import numpy as np
+import pytest
+
+import RL_Game as G
+
+NEXT_VALUES = {"move_left": 4.0, "move_right": -2.0, "shoot": 1.0, "idle": 0.5}
+MASK = ("move_left",)
+
+
+def expected_target(target, epsilon, next_action, values):
+    if target == "sarsa":
+        return values[next_action]
+    greedy = max(values.values())
+    if target == "q_learning":
+        return greedy
+    return epsilon * sum(values.values()) / len(values) + (1 - epsilon) * greedy
+
+
+@pytest.mark.parametrize("learner", [G.SARSA, G.ArraySARSA])
+@pytest.mark.parametrize("target", G.SARSA_TARGETS)
+@pytest.mark.parametrize("mask", [(), MASK])
+def test_table_targets(tmp_path, learner, target, mask):
+    sarsa = learner("enemy", q_table_folder=str(tmp_path), target=target)
+    sarsa.epsilon = 0.2
+    sarsa.q_table = {"next": dict(NEXT_VALUES)}
+    # Masks are recorded when an action is chosen in the state
+    sarsa.get_best_action("next", mask)
+
+    sarsa.update_q_table("start", "shoot", 1.0, "next", "shoot", steps=2)
+    allowed = {a: v for a, v in NEXT_VALUES.items() if a not in mask}
+    target_value = 1.0 + sarsa.gamma ** 2 * expected_target(target, sarsa.epsilon, "shoot", allowed)
+    assert sarsa.q_table["start"]["shoot"] == pytest.approx(sarsa.alpha * target_value)
+
+
+@pytest.mark.parametrize("target", G.SARSA_TARGETS)
+def test_linear_targets(tmp_path, target):
+    sarsa = G.LinearSARSA("enemy", q_table_folder=str(tmp_path), target=target)
+    sarsa.epsilon = 0.2
+    sarsa.weights[:] = np.random.default_rng(0).standard_normal(sarsa.weights.shape)
+    rng = random.Random(4)
+    state, next_state = ("_".join(rng.choice(values) for _, values in sarsa.fields) for _ in range(2))
+    sarsa.get_best_action(next_state, MASK)
+
+    before = sarsa.q_values(state)[sarsa.action_index["shoot"]]
+    next_q = sarsa.q_values(next_state)
+    allowed = {a: next_q[sarsa.action_index[a]] for a in sarsa.actions if a not in MASK}
+    sarsa.update_q_table(state, "shoot", 1.0, next_state, "shoot")
+    delta = 1.0 + sarsa.gamma * expected_target(target, sarsa.epsilon, "shoot", allowed) - before
+    assert sarsa.q_values(state)[sarsa.action_index["shoot"]] == pytest.approx(before + sarsa.alpha * delta)
+
+
+def test_unknown_target_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        G.SARSA("enemy", q_table_folder=str(tmp_path), target="double")
+    sarsa = G.SARSA("enemy", q_table_folder=str(tmp_path))
+    with pytest.raises(ValueError):
+        G.configure_sarsa(sarsa, sarsa_params={"target": "double"})